@@ -0,0 +1,118 @@
+import queue
+import threading
+
+
+class AnnotatedDataWriter:
+
+    # File extension of each supported compression method.
+    COMPRESSION_EXTENSIONS = {
+        None: '',
+        'gzip': '.gz',
+        'bz2': '.bz2',
+        'xz': '.xz',
+        'zip': '.zip'
+    }
+
+    # ******************************************************************************
+    # ****************************** CONSTRUCTOR ***********************************
+    # ******************************************************************************
+    def __init__(self, compression=None, max_pending=1):
+        # Writes the annotated raw data of each year to its CSV file on a background thread, as soon
+        # as the year is processed. At most max_pending years wait to be written; submit() blocks
+        # beyond that, so only a few years of annotated data are held in memory at once.
+        if compression not in self.COMPRESSION_EXTENSIONS:
+            raise ValueError(f"Unsupported compression <{compression}>. Must be one of "
+                             f"{list(self.COMPRESSION_EXTENSIONS.keys())}.")
+        self.compression = compression
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.errors = []
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    # End constructor.
+
+    # ******************************************************************************
+    # ******************************** GETTERS *************************************
+    # ******************************************************************************
+    def get_file_path(self, write_path, filename, year):
+        return f"{write_path}/{filename}_{year}_annotated_raw_data.csv{self.COMPRESSION_EXTENSIONS[self.compression]}"
+    # End get_file_path.
+
+    # ******************************************************************************
+    # ***************************** DATA PROCESSING ********************************
+    # ******************************************************************************
+    def submit(self, file_path, buffer, telemetry=None, year=None):
+        # Queue the AnnotationBuffer of a year to be written to file_path. The write is recorded in
+        # telemetry, if given.
+        self._raise_errors()
+        self.queue.put((file_path, buffer, telemetry, year))
+    # End submit.
+
+    def flush(self):
+        # Wait until every submitted year is written.
+        self.queue.join()
+        self._raise_errors()
+    # End flush.
+
+    def close(self):
+        # Write the remaining years and stop the writer thread.
+        self.queue.put(None)
+        self.thread.join()
+        self._raise_errors()
+    # End close.
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+
+            file_path, buffer, telemetry, year = item
+            try:
+                if telemetry is not None:
+                    with telemetry.stage('annotated_writes', year) as stage:
+                        stage['rows'] = self._write(file_path, buffer)
+                else:
+                    self._write(file_path, buffer)
+            except Exception as error:
+                # Errors are raised in the submitting thread on its next call.
+                self.errors.append(error)
+            finally:
+                self.queue.task_done()
+        # End while.
+    # End _run.
+
+    def _raise_errors(self):
+        if self.errors:
+            raise self.errors[0]
+    # End _raise_errors.
+
+    # ******************************************************************************
+    # ***************************** FILE HANDLING **********************************
+    # ******************************************************************************
+    def _write(self, file_path, buffer):
+        # Write the annotated data points of a year. Returns the number of rows written.
+        annotated_df = self.to_annotated_df(buffer)
+        if annotated_df.empty:
+            return 0
+
+        # Gzip files are written without a timestamp, so unchanged data gives identical files.
+        compression = {'method': 'gzip', 'mtime': 0} if self.compression == 'gzip' else self.compression
+        annotated_df.to_csv(file_path, index=False, compression=compression)
+        return len(annotated_df)
+    # End _write.
+
+    @staticmethod
+    def to_annotated_df(buffer):
+        # Get the table of annotated series data, with the columns of the annotated raw data report.
+        annotated_df = buffer.to_dataframe()
+
+        reorder_columns = ['date_time', 'primary_water_level', 'reference_water_level', 'vertical_offset',
+                           'temporal_shift']
+        annotated_df = annotated_df[reorder_columns]
+        return annotated_df.rename(columns={
+            'date_time': 'Date Time', 'primary_water_level': 'Primary Water Level',
+            'reference_water_level': 'Reference Water Level', 'vertical_offset': 'Vertical Offset',
+            'temporal_shift': 'Temporal Shift'})
+    # End to_annotated_df.
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+
+class AnnotationBuffer:
+
+    # Storage type of temporal shifts, wide enough for the lags of lag estimation, and the temporal shift
+    # code for data points that could not be temporally corrected, outside the range of any lag.
+    SHIFT_DTYPE = np.int32
+    UNCORRECTABLE_SHIFT = np.iinfo(SHIFT_DTYPE).min
+
+    # ******************************************************************************
+    # ****************************** CONSTRUCTOR ***********************************
+    # ******************************************************************************
+    def __init__(self, size=0, datetimes=None):
+        # Columns are preallocated for the whole series (e.g. the 6-minute grid of a year) and
+        # filled by segment. Only the annotated data points are exported.
+        if datetimes is None:
+            self.date_time = np.full(size, np.datetime64('NaT'), dtype='datetime64[ns]')
+        else:
+            self.date_time = np.asarray(datetimes, dtype='datetime64[ns]')[:size].copy()
+        self.primary_water_level = np.full(size, np.nan)
+        self.reference_water_level = np.full(size, np.nan)
+        self.vertical_offset = np.full(size, np.nan, dtype=np.float32)
+        self.temporal_shift = np.full(size, self.UNCORRECTABLE_SHIFT, dtype=self.SHIFT_DTYPE)
+        self.is_annotated = np.zeros(size, dtype=bool)
+    # End constructor.
+
+    def __len__(self):
+        return int(np.count_nonzero(self.is_annotated))
+    # End __len__.
+
+    # ******************************************************************************
+    # ******************************** SETTERS *************************************
+    # ******************************************************************************
+    def write_segment(self, start_index, end_index, temporal_shift, vertical_offset, primary_values,
+                      reference_values, uncorrected=False):
+        # Annotate the data points [start_index, end_index) of a segment. The primary and reference
+        # values are the water levels (in meters) of the segment. Uncorrected segments are annotated
+        # with the vertical offset of each data point.
+        segment = slice(start_index, end_index)
+        primary_values = np.asarray(primary_values, dtype=float)
+        reference_values = np.asarray(reference_values, dtype=float)
+
+        if uncorrected:
+            self.temporal_shift[segment] = self.UNCORRECTABLE_SHIFT
+            self.vertical_offset[segment] = np.round(reference_values - primary_values, 3)
+        else:
+            self.temporal_shift[segment] = temporal_shift
+            self.vertical_offset[segment] = np.where(np.isnan(primary_values) | np.isnan(reference_values),
+                                                     np.nan, vertical_offset)
+
+        self.primary_water_level[segment] = primary_values
+        self.reference_water_level[segment] = reference_values
+        self.is_annotated[segment] = True
+    # End write_segment.
+
+    # ******************************************************************************
+    # ******************************** GETTERS *************************************
+    # ******************************************************************************
+    def count_time_shifted(self):
+        # Count the annotated data points with a nonzero, correctable temporal shift.
+        return int(np.count_nonzero(self.is_annotated & (self.temporal_shift != 0) &
+                                    (self.temporal_shift != self.UNCORRECTABLE_SHIFT)))
+    # End count_time_shifted.
+
+    def count_uncorrectable(self):
+        return int(np.count_nonzero(self.is_annotated & (self.temporal_shift == self.UNCORRECTABLE_SHIFT)))
+    # End count_uncorrectable.
+
+    def to_dataframe(self) -> pd.DataFrame:
+        # Export the annotated data points. Uncorrectable temporal shifts and missing vertical offsets
+        # are written as 'N/A'.
+        mask = self.is_annotated
+
+        temporal_shift = self.temporal_shift[mask].astype(object)
+        temporal_shift[self.temporal_shift[mask] == self.UNCORRECTABLE_SHIFT] = 'N/A'
+
+        # Vertical offsets are rounded to at most 4 decimal places, which recovers the exact values
+        # stored with float32 precision.
+        vertical_offset = np.round(self.vertical_offset[mask].astype(float), 4).astype(object)
+        vertical_offset[np.isnan(self.vertical_offset[mask])] = 'N/A'
+
+        return pd.DataFrame({
+            'temporal_shift': temporal_shift,
+            'vertical_offset': vertical_offset,
+            'date_time': self.date_time[mask],
+            'primary_water_level': self.primary_water_level[mask].astype(str),
+            'reference_water_level': self.reference_water_level[mask]
+        })
+    # End to_dataframe.
+
+    # ******************************************************************************
+    # ***************************** DATA PROCESSING ********************************
+    # ******************************************************************************
+    @staticmethod
+    def concat(buffers):
+        result = AnnotationBuffer()
+        buffers = [buffer for buffer in buffers if len(buffer.is_annotated)]
+        if not buffers:
+            return result
+
+        for field in ['date_time', 'primary_water_level', 'reference_water_level', 'vertical_offset',
+                      'temporal_shift', 'is_annotated']:
+            setattr(result, field, np.concatenate([getattr(buffer, field) for buffer in buffers]))
+        return result
+    # End concat.
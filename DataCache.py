@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+import helpers
+
+
+class DataCache:
+
+    # ******************************************************************************
+    # ****************************** CONSTRUCTOR ***********************************
+    # ******************************************************************************
+    def __init__(self, cache_dir='generated_files/cache', max_size_bytes=2 * 1024 ** 3):
+        # On-disk cache of parsed data files. Each entry is a directory holding one .npy file per
+        # column and a meta.json file, and is keyed by the absolute path of the source file. An entry is
+        # valid while the source file has the same size and modification time, or the same content hash.
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+
+        # Files may be stored from several threads of a loader.
+        self.lock = threading.Lock()
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+    # End constructor.
+
+    # ******************************************************************************
+    # ******************************** GETTERS *************************************
+    # ******************************************************************************
+    def get_size(self):
+        return sum(self._get_entry_size(entry_path) for entry_path in self._get_entry_paths())
+    # End get_size.
+
+    def _get_entry_path(self, file):
+        return os.path.join(self.cache_dir, hashlib.sha1(os.path.abspath(file).encode('utf-8')).hexdigest())
+    # End _get_entry_path.
+
+    def _get_entry_paths(self):
+        return [entry.path for entry in os.scandir(self.cache_dir)
+                if entry.is_dir() and os.path.isfile(os.path.join(entry.path, 'meta.json'))]
+    # End _get_entry_paths.
+
+    @staticmethod
+    def _get_entry_size(entry_path):
+        return sum(entry.stat().st_size for entry in os.scandir(entry_path) if entry.is_file())
+    # End _get_entry_size.
+
+    # ******************************************************************************
+    # ***************************** DATA PROCESSING ********************************
+    # ******************************************************************************
+    def load(self, file):
+        # Return the cached dataframe of a file, with its columns memory mapped, or None if the file
+        # is not cached or has changed since.
+        entry_path = self._get_entry_path(file)
+        with self.lock:
+            meta = self._read_meta(entry_path)
+            if meta is None:
+                return None
+
+            stat = os.stat(file)
+            if meta['size'] != stat.st_size:
+                self._remove_entry(entry_path)
+                return None
+            if meta['mtime_ns'] != stat.st_mtime_ns:
+                # The file was modified or touched. Its content decides if the entry is still valid.
+                if helpers.get_file_hash(file) != meta['content_hash']:
+                    self._remove_entry(entry_path)
+                    return None
+                meta['mtime_ns'] = stat.st_mtime_ns
+
+            # Columns are mapped copy-on-write, so changes to the dataframe never reach the cache.
+            columns = {}
+            for column_index, column_name in enumerate(meta['columns']):
+                columns[column_name] = np.load(os.path.join(entry_path, f'{column_index}.npy'), mmap_mode='c')
+
+            meta['last_used'] = time.time()
+            self._write_meta(entry_path, meta)
+
+        return pd.DataFrame(columns, copy=False)
+    # End load.
+
+    def store(self, file, df):
+        # Cache the dataframe parsed from a file. Only dataframes with a default index and NumPy
+        # numeric, boolean or datetime columns are cached.
+        if not self._is_cacheable(df):
+            return False
+
+        stat = os.stat(file)
+        meta = {
+            'source': os.path.abspath(file),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'content_hash': helpers.get_file_hash(file),
+            'columns': df.columns.tolist(),
+            'last_used': time.time()
+        }
+
+        # Write the entry to a temporary directory first, so a partially written entry is never loaded.
+        entry_path = self._get_entry_path(file)
+        temp_path = f"{entry_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path)
+        os.makedirs(temp_path)
+        for column_index, column_name in enumerate(meta['columns']):
+            np.save(os.path.join(temp_path, f'{column_index}.npy'), df[column_name].to_numpy())
+        self._write_meta(temp_path, meta)
+
+        with self.lock:
+            self._remove_entry(entry_path)
+            os.replace(temp_path, entry_path)
+            self._evict()
+        return True
+    # End store.
+
+    def evict(self):
+        with self.lock:
+            self._evict()
+    # End evict.
+
+    def _evict(self):
+        # Remove the least recently used entries until the cache fits in max_size_bytes.
+        entries = []
+        for entry_path in self._get_entry_paths():
+            meta = self._read_meta(entry_path)
+            last_used = meta['last_used'] if meta is not None else 0.0
+            entries.append((last_used, entry_path, self._get_entry_size(entry_path)))
+        entries.sort()
+
+        total_size = sum(size for last_used, entry_path, size in entries)
+        for last_used, entry_path, size in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            self._remove_entry(entry_path)
+            total_size -= size
+    # End _evict.
+
+    def clear(self):
+        for entry_path in self._get_entry_paths():
+            self._remove_entry(entry_path)
+    # End clear.
+
+    @staticmethod
+    def _is_cacheable(df):
+        if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+            return False
+        if not df.columns.is_unique:
+            return False
+        for column_name in df.columns:
+            if not isinstance(column_name, str):
+                return False
+            dtype = df[column_name].dtype
+            if not isinstance(dtype, np.dtype) or dtype.kind not in 'biufmM':
+                return False
+        return True
+    # End _is_cacheable.
+
+    # ******************************************************************************
+    # ***************************** FILE HANDLING **********************************
+    # ******************************************************************************
+    @staticmethod
+    def _read_meta(entry_path):
+        try:
+            with open(os.path.join(entry_path, 'meta.json'), 'r') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+    # End _read_meta.
+
+    @staticmethod
+    def _write_meta(entry_path, meta):
+        with open(os.path.join(entry_path, 'meta.json'), 'w') as file:
+            json.dump(meta, file)
+    # End _write_meta.
+
+    @staticmethod
+    def _remove_entry(entry_path):
+        if os.path.exists(entry_path):
+            shutil.rmtree(entry_path, ignore_errors=True)
+    # End _remove_entry.
@@ -0,0 +1,252 @@
+import numpy as np
+import pandas as pd
+
+import helpers
+from TransformData import TransformData
+from MetricsCalculator import MetricsCalculator
+from SegmentLog import SegmentLog
+
+
+class IncrementalCorrector:
+
+    # Columns of the series, grown by doubling.
+    SERIES_FIELDS = ['date_time', 'reference', 'reference_valid', 'corrected', 'corrected_valid', 'discrepancies']
+
+    # ******************************************************************************
+    # ****************************** CONSTRUCTOR ***********************************
+    # ******************************************************************************
+    def __init__(self, user_config=None, gaps_are_interruptions=False, **kwargs):
+        # Temporal correction and offset runs of a series that grows as new aligned rows arrive, for near-real-time
+        # comparisons. Each append corrects the new rows and the last rows whose correction was not final yet, so
+        # its cost depends on the size of the batch and not on the length of the series. The corrected series,
+        # temporal shifts summary and runs table are the same as when the whole series is corrected at once.
+        default_col_names = {
+            'primary_data_column_name': 'primary_col',
+            'reference_data_column_name': 'ref_col',
+            'datetime_column_name': 'dt_col'
+        }
+        temporal_config = (user_config or {}).get('temporal_shift_correction', {})
+        if temporal_config.get('engine', 'vectorized') != 'vectorized':
+            raise ValueError("Incremental correction is only supported by the 'vectorized' temporal correction "
+                             "engine.")
+        if temporal_config.get('lag_estimation', {}).get('enabled', False):
+            raise ValueError("Incremental correction is not supported with lag estimation.")
+        self.user_config = user_config
+        self.col_names = {**default_col_names, **kwargs}
+        self.gaps_are_interruptions = gaps_are_interruptions
+
+        # State of the temporal correction at the first row that is not final, and the rows from there on,
+        # which are corrected again with the next batch.
+        self.carry_over_state = None
+        self.provisional_df = None
+
+        # Columns of the series. Only the first self.size rows are valid. The columns are allocated with the
+        # first batch, whose columns and storage mode they keep.
+        self.size = 0
+        self.columns = None
+        self.fixed_point = None
+
+        # Segments of the temporal correction, in indices of the whole series.
+        self.segment_log = SegmentLog()
+
+        # Indices where a run of discrepancies ends, as in MetricsCalculator.get_runs. Only the first
+        # self.num_run_changes entries are valid.
+        self.run_changes = np.zeros(256, dtype=np.int64)
+        self.num_run_changes = 0
+    # End constructor.
+
+    def __len__(self):
+        return self.size
+    # End __len__.
+
+    # ******************************************************************************
+    # ******************************** SETTERS *************************************
+    # ******************************************************************************
+    def append(self, batch_df):
+        # Correct a batch of new rows, aligned on the sample grid of the series and following its last row.
+        # Returns the number of rows at the end of the series whose correction may still change.
+        if batch_df.empty:
+            return self.get_provisional_rows()
+        if self.columns is None:
+            self._allocate(batch_df)
+
+        # The provisional rows of the previous batches are corrected again with the new rows.
+        provisional_rows = self.get_provisional_rows()
+        start_index = self.size - provisional_rows
+        if provisional_rows:
+            df = pd.concat([self.provisional_df, batch_df[self.columns]], ignore_index=True)
+        else:
+            df = batch_df[self.columns].reset_index(drop=True)
+
+        # A new corrector for each batch, so its annotations and summary only hold the rows of the batch.
+        corrector = TransformData(user_config=self.user_config)
+        corrector.set_document_corrected_time_shift_series_data(False)
+        corrected_df = corrector.temporal_shift_corrector(df, carry_over=self.carry_over_state, **self.col_names)
+        continues_segment = self.carry_over_state is not None and self.carry_over_state['segment'] is not None
+        self.carry_over_state, provisional_rows = TransformData.split_carry_over_state(
+            corrector.get_carry_over_state())
+        self.provisional_df = df.iloc[len(df) - provisional_rows:].reset_index(drop=True)
+
+        self._update_series(start_index, df, corrected_df)
+        self._update_segments(start_index, corrector.get_segment_log(), continues_segment)
+        self._update_runs(start_index)
+        return provisional_rows
+    # End append.
+
+    def _allocate(self, batch_df, capacity=1024):
+        self.columns = list(batch_df.columns)
+        self.fixed_point = helpers.is_fixed_point(batch_df[self.col_names['primary_data_column_name']])
+        value_dtype = np.int64 if self.fixed_point else float
+        datetimes = batch_df[self.col_names['datetime_column_name']].to_numpy()
+
+        self.date_time = np.zeros(capacity, dtype=datetimes.dtype)
+        self.reference = np.zeros(capacity, dtype=value_dtype)
+        self.reference_valid = np.zeros(capacity, dtype=bool)
+        self.corrected = np.zeros(capacity, dtype=value_dtype)
+        self.corrected_valid = np.zeros(capacity, dtype=bool)
+        self.discrepancies = np.zeros(capacity, dtype=float)
+    # End _allocate.
+
+    def _reserve(self, size):
+        # Grow the columns of the series by doubling until size rows fit.
+        capacity = len(self.date_time)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+
+        for field in self.SERIES_FIELDS:
+            values = getattr(self, field)
+            grown = np.zeros(capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            setattr(self, field, grown)
+    # End _reserve.
+
+    def _update_series(self, start_index, df, corrected_df):
+        # Write the corrected rows from start_index on, and their discrepancies.
+        primary_col_name = self.col_names['primary_data_column_name']
+        reference_col_name = self.col_names['reference_data_column_name']
+        end_index = start_index + len(df)
+        self._reserve(end_index)
+
+        rows = slice(start_index, end_index)
+        self.date_time[rows] = df[self.col_names['datetime_column_name']].to_numpy()
+        self.reference[rows], self.reference_valid[rows] = self._get_values(df[reference_col_name])
+        self.corrected[rows], self.corrected_valid[rows] = self._get_values(corrected_df[primary_col_name])
+        self.discrepancies[rows] = MetricsCalculator.get_discrepancies(corrected_df[primary_col_name],
+                                                                       df[reference_col_name], len(df))
+        self.size = end_index
+    # End _update_series.
+
+    def _update_segments(self, start_index, segment_log, continues_segment):
+        # Segments that start before start_index are final, but the last of them ends where the new segments
+        # start, or continues in the first of them.
+        kept = np.searchsorted(self.segment_log.get_start_indices(), start_index)
+        self.segment_log.truncate(kept)
+
+        first = 0
+        if len(self.segment_log):
+            # The segment open at the end of the previous batch continues if the batch starts with it.
+            if (continues_segment and len(segment_log) and segment_log.get_start_indices()[0] == 0 and
+                    segment_log.get_temporal_shifts()[0] == self.segment_log.get_temporal_shifts()[-1] and
+                    segment_log.get_vertical_offsets()[0] == self.segment_log.get_vertical_offsets()[-1]):
+                self.segment_log.set_last_end_index(start_index + segment_log.get_end_indices()[0])
+                first = 1
+            else:
+                self.segment_log.set_last_end_index(start_index)
+
+        uncorrectable = segment_log.get_uncorrectable_mask()
+        for position in range(first, len(segment_log)):
+            self.segment_log.append(start_index + segment_log.get_start_indices()[position],
+                                    start_index + segment_log.get_end_indices()[position],
+                                    segment_log.get_temporal_shifts()[position],
+                                    segment_log.get_vertical_offsets()[position],
+                                    uncorrected=uncorrectable[position])
+        # End for.
+    # End _update_segments.
+
+    def _update_runs(self, start_index):
+        # Runs that end before the row preceding start_index are final. The runs from there on are found
+        # again from the discrepancies of the rows that changed and the row before them.
+        first = max(start_index - 1, 0)
+        kept = np.searchsorted(self.run_changes[:self.num_run_changes], first)
+        changes = MetricsCalculator.get_run_changes(self.discrepancies[first:self.size],
+                                                    self.gaps_are_interruptions) + first
+
+        size = kept + len(changes)
+        if size > len(self.run_changes):
+            grown = np.zeros(max(2 * len(self.run_changes), size), dtype=np.int64)
+            grown[:kept] = self.run_changes[:kept]
+            self.run_changes = grown
+        self.run_changes[kept:size] = changes
+        self.num_run_changes = size
+    # End _update_runs.
+
+    # ******************************************************************************
+    # ******************************** GETTERS *************************************
+    # ******************************************************************************
+    def get_provisional_rows(self):
+        # Number of rows at the end of the series whose correction may still change with the next batch.
+        return len(self.provisional_df) if self.provisional_df is not None else 0
+    # End get_provisional_rows.
+
+    def get_dataframe(self):
+        # The series with the temporally corrected primary values, in the columns of the batches.
+        datetime_col_name = self.col_names['datetime_column_name']
+        if self.columns is None:
+            return pd.DataFrame(columns=[datetime_col_name, self.col_names['reference_data_column_name'],
+                                         self.col_names['primary_data_column_name']])
+
+        columns = {
+            datetime_col_name: self.date_time[:self.size].copy(),
+            self.col_names['reference_data_column_name']: self._to_column(self.reference, self.reference_valid),
+            self.col_names['primary_data_column_name']: self._to_column(self.corrected, self.corrected_valid)
+        }
+        return pd.DataFrame({name: columns[name] for name in self.columns if name in columns})
+    # End get_dataframe.
+
+    def get_shifts_summary_df(self):
+        return self.segment_log.to_summary_df(self._get_datetimes())
+    # End get_shifts_summary_df.
+
+    def get_segment_log(self):
+        return self.segment_log
+    # End get_segment_log.
+
+    def get_runs_df(self):
+        # The runs table of MetricsCalculator.generate_runs_df for the corrected series.
+        if not self.size:
+            return MetricsCalculator.to_runs_df({'start_index': [], 'end_index': [], 'offset': []},
+                                                pd.Series(dtype='datetime64[ns]'))
+
+        changes = self.run_changes[:self.num_run_changes]
+        start_indices = np.concatenate(([0], changes))
+        end_indices = np.append(changes, self.size - 1)
+        runs = {
+            'start_index': start_indices,
+            'end_index': end_indices,
+            'offset': self.discrepancies[end_indices],
+            'duration': end_indices - start_indices
+        }
+        return MetricsCalculator.to_runs_df(runs, self._get_datetimes())
+    # End get_runs_df.
+
+    def _get_datetimes(self):
+        return pd.Series(self.date_time[:self.size])
+    # End _get_datetimes.
+
+    def _get_values(self, series):
+        # Return the values of a water level column in the storage mode of the series, and a mask of the
+        # non-missing values.
+        if self.fixed_point:
+            return series.to_numpy(dtype=np.int64, na_value=0), series.notna().to_numpy()
+
+        values = series.to_numpy(dtype=float, na_value=np.nan)
+        return values, ~np.isnan(values)
+    # End _get_values.
+
+    def _to_column(self, values, valid):
+        if self.fixed_point:
+            return pd.arrays.IntegerArray(values[:self.size].astype(np.int32), ~valid[:self.size])
+        return np.where(valid[:self.size], values[:self.size], np.nan)
+    # End _to_column.
@@ -4,6 +4,8 @@ import numpy as np
 from datetime import timedelta
 import re
 
+import helpers
+
 
 class MetricsCalculator:
 
@@ -126,52 +128,60 @@ class MetricsCalculator:
     # ***************************** DATA PROCESSING ********************************
     # ******************************************************************************
     @staticmethod
-    def get_comparison_stats(primary_df_col, reference_df_col, size, calc_all=True, **kwargs):
-
-        # Initialize incremented stats.
-        values_disagree = 0
-        values_agree = 0
-        primary_gaps = 0
-        ref_gaps = 0
-        shared_gaps = 0
-
-        for index in range(size):
-            # If neither value is NaN, compare the values and increment disagreements
-            # if not equal.
+    def get_comparison_stats(primary_df_col, reference_df_col, size, calc_all=True, mask=None, window=None,
+                             **kwargs):
+        # Compare the first size values of the columns. Optionally, compare only the values in
+        # window (a (start, stop) pair of positions) and/or where mask is True. The percentages are
+        # then relative to the number of values compared.
+
+        # In fixed-point storage mode the values are integers and are compared without rounding.
+        fixed_point = helpers.is_fixed_point(primary_df_col)
+
+        primary_missing_mask = primary_df_col.isna().to_numpy()[:size]
+        ref_missing_mask = reference_df_col.isna().to_numpy()[:size]
+        if fixed_point:
+            primary_values = primary_df_col.to_numpy(dtype=np.int64, na_value=0)[:size]
+            ref_values = reference_df_col.to_numpy(dtype=np.int64, na_value=0)[:size]
+        else:
             # Round values to millimeters.
-            if not pd.isna(primary_df_col.iloc[index]) and not pd.isna(reference_df_col.iloc[index]):
-                if round(primary_df_col.iloc[index], 4) != round(reference_df_col.iloc[index], 4):
-                    values_disagree += 1
-                else:
-                    values_agree += 1
-
-            if pd.isna(primary_df_col.iloc[index]) and pd.isna(reference_df_col.iloc[index]):
-                shared_gaps += 1
-                continue
-
-            if pd.isna(primary_df_col.iloc[index]):
-                primary_gaps += 1
-
-            if pd.isna(reference_df_col.iloc[index]):
-                ref_gaps += 1
-        # End for.
+            primary_values = np.round(primary_df_col.to_numpy(dtype=float, na_value=np.nan)[:size], 4)
+            ref_values = np.round(reference_df_col.to_numpy(dtype=float, na_value=np.nan)[:size], 4)
+
+        # Select the values to compare.
+        selected = np.ones(len(primary_values), dtype=bool)
+        if window is not None:
+            start, stop = window
+            selected[:start] = False
+            selected[stop:] = False
+        if mask is not None:
+            selected &= np.asarray(mask, dtype=bool)[:size]
+        if window is not None or mask is not None:
+            size = int(np.count_nonzero(selected))
+
+        primary_missing_mask = primary_missing_mask[selected]
+        ref_missing_mask = ref_missing_mask[selected]
+        both_present = ~primary_missing_mask & ~ref_missing_mask
+
+        # If neither value is NaN, compare the values and count disagreements if not equal.
+        values_differ = primary_values[selected][both_present] != ref_values[selected][both_present]
+        values_disagree = int(np.count_nonzero(values_differ))
+        values_agree = int(np.count_nonzero(both_present)) - values_disagree
+        shared_gaps = int(np.count_nonzero(primary_missing_mask & ref_missing_mask))
+        primary_gaps = int(np.count_nonzero(primary_missing_mask & ~ref_missing_mask))
+        ref_gaps = int(np.count_nonzero(ref_missing_mask & ~primary_missing_mask))
 
         total_disagree = values_disagree + primary_gaps + ref_gaps
         total_agree = values_agree + shared_gaps
         primary_missing = shared_gaps + primary_gaps
         ref_missing = shared_gaps + ref_gaps
 
-        percent_agree = round(total_agree / size * 100, 4)
-        percent_val_disagree = round(values_disagree / size * 100, 4)
-        percent_total_disagree = round(total_disagree / size * 100, 4)
-        percent_primary_missing = round(primary_missing / size * 100, 4)
-        percent_ref_missing = round(ref_missing / size * 100, 4)
+        # The percentages are NaN if no values are compared, as with an empty window or mask.
+        totals = [total_agree, values_disagree, total_disagree, primary_missing, ref_missing]
+        percentages = [round(total / size * 100, 4) if size else np.nan for total in totals]
 
         table = {
-            'total points': [total_agree, values_disagree, total_disagree, primary_missing,
-                             ref_missing],
-            'percent': [percent_agree, percent_val_disagree, percent_total_disagree,
-                        percent_primary_missing, percent_ref_missing]
+            'total points': totals,
+            'percent': percentages
         }
 
         row_labels = ['total agreements', 'value disagreements', 'total disagreements',
@@ -191,70 +201,67 @@ class MetricsCalculator:
 
     def generate_runs_df(self, offset_column: pd.Series, reference_column: pd.Series,
                          ref_dates: pd.Series, size: int, gaps_are_interruptions: bool = False):
-        offsets = self.get_discrepancies(offset_column, reference_column, size)
-
-        start_indices = []
-        end_indices = []
-        run_values = []
-
-        previous_value = offsets[0]
-        start_index = 0
-
-        for index in range(1, size):
-            current_value = offsets[index]
-
-            if gaps_are_interruptions:
-                # Check if current value is different from previous value.
-                if current_value != previous_value and not (pd.isna(current_value) and pd.isna(previous_value)):
-                    end_index = index - 1
-                    start_indices.append(start_index)
-                    end_indices.append(end_index)
-                    run_values.append(previous_value)
-                    start_index = end_index
-            else:
-                # Ignore NaNs when checking for changes in value.
-                if not pd.isna(current_value):
-                    if current_value != previous_value:
-                        end_index = index - 1
-                        start_indices.append(start_index)
-                        end_indices.append(end_index)
-                        run_values.append(previous_value)
-                        start_index = end_index
-
-            previous_value = current_value
-        # End for.
-
-        # Append the last run.
-        start_indices.append(start_index)
-        end_indices.append(size - 1)
-        run_values.append(previous_value)
-
-        # Create the dataframe.
+        runs = self.get_runs(offset_column, reference_column, size, gaps_are_interruptions)
+        return self.to_runs_df(runs, ref_dates)
+    # End generate_runs_df.
+
+    @staticmethod
+    def to_runs_df(runs: dict, ref_dates: pd.Series) -> pd.DataFrame:
+        # Create the runs dataframe from the runs returned by get_runs.
         summary_df = pd.DataFrame()
-        summary_df['offset'] = run_values
-        summary_df['start date'] = ref_dates.iloc[start_indices].tolist()
-        summary_df['end date'] = ref_dates.iloc[end_indices].tolist()
+        summary_df['offset'] = runs['offset']
+        summary_df['start date'] = ref_dates.iloc[runs['start_index']].reset_index(drop=True)
+        summary_df['end date'] = ref_dates.iloc[runs['end_index']].reset_index(drop=True)
         summary_df['duration'] = summary_df['end date'] - summary_df['start date']
 
         return summary_df
-    # End generate_runs_df.
+    # End to_runs_df.
 
     @staticmethod
-    def get_discrepancies(offset_column: pd.Series, reference_column: pd.Series,
-                          size: int) -> list[float]:
-        discrepancies = []
-
-        for index in range(size):
+    def get_runs(offset_column: pd.Series, reference_column: pd.Series, size: int,
+                 gaps_are_interruptions: bool = False) -> dict:
+        # Run-length encode the discrepancies. A run ends where the discrepancy changes, and the next
+        # run starts at the index where the previous one ended. If gaps are not interruptions, a missing
+        # discrepancy does not end a run, but the first discrepancy after a gap always starts a new one.
+        offsets = MetricsCalculator.get_discrepancies(offset_column, reference_column, size)
+        change_indices = MetricsCalculator.get_run_changes(offsets, gaps_are_interruptions)
+
+        start_indices = np.concatenate(([0], change_indices))
+        end_indices = np.append(change_indices, size - 1)
+
+        return {
+            'start_index': start_indices,
+            'end_index': end_indices,
+            'offset': offsets[end_indices],
+            'duration': end_indices - start_indices
+        }
+    # End get_runs.
 
-            if pd.isna(offset_column.iloc[index]):
-                discrepancies.append(np.nan)
-                continue
+    @staticmethod
+    def get_run_changes(offsets: np.ndarray, gaps_are_interruptions: bool = False) -> np.ndarray:
+        # Indices where a run ends because the discrepancy at the next index is different.
+        is_missing = np.isnan(offsets)
 
-            difference = round(reference_column.iloc[index] - offset_column.iloc[index], 4)
-            discrepancies.append(difference)
-        # End for.
+        is_change = offsets[1:] != offsets[:-1]
+        if gaps_are_interruptions:
+            is_change &= ~(is_missing[1:] & is_missing[:-1])
+        else:
+            is_change &= ~is_missing[1:]
+        return np.flatnonzero(is_change)
+    # End get_run_changes.
 
-        return discrepancies
+    @staticmethod
+    def get_discrepancies(offset_column: pd.Series, reference_column: pd.Series,
+                          size: int) -> np.ndarray:
+        # In fixed-point storage mode the integer differences are converted back to meters.
+        if helpers.is_fixed_point(offset_column):
+            is_missing = (offset_column.isna() | reference_column.isna()).to_numpy()[:size]
+            differences = (reference_column.to_numpy(dtype=np.int64, na_value=0)[:size] -
+                           offset_column.to_numpy(dtype=np.int64, na_value=0)[:size]) / helpers.FIXED_POINT_SCALE
+            return np.where(is_missing, np.nan, differences)
+
+        return np.round(reference_column.to_numpy(dtype=float, na_value=np.nan)[:size] -
+                        offset_column.to_numpy(dtype=float, na_value=np.nan)[:size], 4)
     # End get_discrepancies.
 
     def calculate_metrics(self, df: pd.DataFrame = None, calc_all=True, **kwargs):
@@ -266,29 +273,78 @@ class MetricsCalculator:
         else:
             raise ValueError("No DataFrame provided and no pre-set DataFrame found.")
 
+        offsets_column_name = self.col_config['offset_column']
+        duration_column_name = self.col_config['duration_column']
+        start_date_column_name = self.col_config['start_date_column']
+        end_date_column_name = self.col_config['end_date_column']
+
+        # Intermediates shared by the metrics. Each is computed at most once, when a requested metric
+        # first needs it.
+        intermediates = {}
+
+        def get(name):
+            if name not in intermediates:
+                intermediates[name] = metric_plan[name]()
+            return intermediates[name]
+
+        metric_plan = {
+            "is_nan": lambda: df[offsets_column_name].isna(),
+            "nan_df": lambda: df[get("is_nan")],
+            "non_nan_df": lambda: df[~get("is_nan")],
+            "offset_duration_threshold": lambda: self._parse_timedelta(
+                self.config['filter_offsets_by_duration']['threshold']),
+            "gap_duration_threshold": lambda: self._parse_timedelta(
+                self.config['filter_gaps_by_duration']['threshold']),
+            "max_gap_duration": lambda: get("nan_df")[duration_column_name].max(),
+            "max_offset_duration": lambda: get("non_nan_df")[duration_column_name].max(),
+            "min_max_offsets": lambda: (df[offsets_column_name].max(), df[offsets_column_name].min())
+        }
+
+        offset_duration_params = self.config['filter_offsets_by_duration']
+        gap_duration_params = self.config['filter_gaps_by_duration']
+        value_params = self.config['filter_offsets_by_value']
+
         available_metrics = {
-            "duration_filtered_offsets_count": lambda df: self.count_duration_filtered_offsets(df),
-            "duration_filtered_gaps_count": lambda df: self.count_duration_filtered_gaps(df),
-            "max_gap_duration": lambda df: self.get_max_gap_duration(df),
-            "max_gap_dates": lambda df: self.get_max_gap_dates(self.get_max_gap_duration(df)),
-            "max_offset_duration": lambda df: self.get_max_offset_duration(df),
-            "longest_offsets": lambda df: self.get_longest_offsets(self.get_max_offset_duration(df)),
-            "value_filtered_offsets_count": lambda df: self.count_value_filtered_offsets(df),
-            "min_max_offsets": lambda df: self.get_min_max_offsets(df),
-            "max_offset_dates": lambda df: self.get_offset_dates(self.get_min_max_offsets(df)[0]),
-            "min_offset_dates": lambda df: self.get_offset_dates(self.get_min_max_offsets(df)[1])
+            "duration_filtered_offsets_count": lambda: len(self.filter_by_duration(
+                get("non_nan_df"), duration_column_name, get("offset_duration_threshold"),
+                offset_duration_params['type'], offset_duration_params['is_strict'],
+                offset_duration_params['nonzero'])),
+            "duration_filtered_gaps_count": lambda: len(self.filter_by_duration(
+                get("nan_df"), duration_column_name, get("gap_duration_threshold"),
+                gap_duration_params['type'], gap_duration_params['is_strict'])),
+            "max_gap_duration": lambda: get("max_gap_duration"),
+            "max_gap_dates": lambda: self._get_dates_where(get("nan_df"), duration_column_name,
+                                                           get("max_gap_duration"), start_date_column_name,
+                                                           end_date_column_name),
+            "max_offset_duration": lambda: get("max_offset_duration"),
+            "longest_offsets": lambda: get("non_nan_df")[get("non_nan_df")[duration_column_name]
+                                                         == get("max_offset_duration")][offsets_column_name].tolist(),
+            "value_filtered_offsets_count": lambda: len(self.filter_by_value(
+                df, offsets_column_name, value_params['threshold'], value_params['type'],
+                value_params['use_abs'], value_params['is_strict'], value_params['nonzero'])),
+            "min_max_offsets": lambda: get("min_max_offsets"),
+            "max_offset_dates": lambda: self._get_dates_where(df, offsets_column_name, get("min_max_offsets")[0],
+                                                              start_date_column_name, end_date_column_name),
+            "min_offset_dates": lambda: self._get_dates_where(df, offsets_column_name, get("min_max_offsets")[1],
+                                                              start_date_column_name, end_date_column_name)
         }
 
         metrics = {}
         for key, func in available_metrics.items():
-            if calc_all:
-                metrics[key] = func(df)
-            elif key in kwargs:
-                metrics[key] = func(df)
+            if calc_all or key in kwargs:
+                metrics[key] = func()
 
         return metrics
     # End calculate_metrics.
 
+    @staticmethod
+    def _get_dates_where(df, column_name, value, start_date_column_name, end_date_column_name):
+        bool_mask = df[column_name] == value
+        start_dates = df.loc[bool_mask, start_date_column_name].tolist()
+        end_dates = df.loc[bool_mask, end_date_column_name].tolist()
+        return start_dates, end_dates
+    # End _get_dates_where.
+
     def count_duration_filtered_gaps(self, df: pd.DataFrame = None, duration_column_name: str = None,
                         offsets_column_name: str = None, **kwargs) -> int:
         if df is None:
@@ -421,10 +477,8 @@ class MetricsCalculator:
         if end_date_column_name is None:
             end_date_column_name = self.col_config['end_date_column']
 
-        bool_mask = df[offsets_column_name] == offset_value
-        start_dates = df.loc[bool_mask, start_date_column_name].tolist()
-        end_dates = df.loc[bool_mask, end_date_column_name].tolist()
-        return start_dates, end_dates
+        return self._get_dates_where(df, offsets_column_name, offset_value, start_date_column_name,
+                                     end_date_column_name)
     # End get_offset_dates.
 
     def generate_duration_filtered_offsets_info(self, df: pd.DataFrame = None, duration_column_name: str = None, nonzero=False):
@@ -488,7 +542,7 @@ class MetricsCalculator:
     #@staticmethod
     def filter_by_duration(self, dataframe: pd.DataFrame, duration_column_name: str, threshold=timedelta(0),
                            type='min', is_strict=False, nonzero=False) -> pd.DataFrame:
-        filtered_df = dataframe.copy()
+        filtered_df = dataframe
 
         series = filtered_df[duration_column_name]
 
@@ -503,7 +557,7 @@ class MetricsCalculator:
             else:
                 filter_series = series <= threshold
         else:
-            filter_series = pd.Series([True] * len(dataframe))  # Default case: no filtering
+            filter_series = pd.Series(True, index=dataframe.index)  # Default case: no filtering
 
         filtered_df = filtered_df[filter_series]
 
@@ -520,8 +574,8 @@ class MetricsCalculator:
     #@staticmethod
     def filter_by_value(self, dataframe: pd.DataFrame, offset_column_name: str, threshold=0.0, type='min',
                         use_abs=True, is_strict=False, nonzero=False) -> pd.DataFrame:
-        # Copy dataframe.
-        filtered_df = dataframe.copy()
+        # Filtering returns a new dataframe, so the input is not copied.
+        filtered_df = dataframe
 
         # Apply absolute value if needed.
         series = abs(filtered_df[offset_column_name]) if use_abs else filtered_df[offset_column_name]
@@ -538,7 +592,7 @@ class MetricsCalculator:
             else:
                 filter_series = series <= threshold
         else:
-            filter_series = pd.Series([True] * len(dataframe))  # Default case: no filtering
+            filter_series = pd.Series(True, index=dataframe.index)  # Default case: no filtering
 
         filtered_df = filtered_df[filter_series]
 
@@ -549,6 +603,68 @@ class MetricsCalculator:
         return filtered_df
     # End filter_by_value.
 
+    def sweep_filter_thresholds(self, filter_name: str, thresholds: list, df: pd.DataFrame = None,
+                                **kwargs) -> pd.DataFrame:
+        # Count the runs meeting each threshold of a filter in one pass over the sorted durations or
+        # offsets. filter_name is 'filter_offsets_by_duration', 'filter_gaps_by_duration' or
+        # 'filter_offsets_by_value'. Allow user's kwargs to override the type, is_strict, use_abs and
+        # nonzero configurations. The counts are those of the filter methods. Gaps are the runs with
+        # missing offsets, and are counted as by count_duration_filtered_gaps.
+        if filter_name not in self.default_config:
+            raise ValueError(f"Unknown filter '{filter_name}'. Must be one of {list(self.default_config.keys())}.")
+        if df is not None:
+            self._validate_dataframe(df)
+        elif self.run_data_df is not None:
+            df = self.run_data_df
+        else:
+            raise ValueError("No DataFrame provided and no pre-set DataFrame found.")
+
+        params = {**self.config[filter_name], **kwargs}
+        offsets_column_name = self.col_config['offset_column']
+        duration_column_name = self.col_config['duration_column']
+
+        if filter_name == 'filter_offsets_by_value':
+            runs = df[df[offsets_column_name] != 0.0] if params.get('nonzero') else df
+            values = runs[offsets_column_name].to_numpy(dtype=float)
+            values = np.abs(values) if params.get('use_abs') else values
+            threshold_values = np.asarray(thresholds, dtype=float)
+            is_missing = np.isnan(values)
+        else:
+            if filter_name == 'filter_gaps_by_duration':
+                runs = df[df[offsets_column_name].isna()]
+            else:
+                runs = df[df[offsets_column_name].notna()]
+                if params.get('nonzero'):
+                    runs = runs[runs[offsets_column_name] != 0.0]
+            # As in filter_by_duration, the runs with missing offsets are dropped, gaps included.
+            runs = runs[runs[offsets_column_name].notna()]
+            values = runs[duration_column_name].to_numpy(dtype='timedelta64[ns]')
+            threshold_values = pd.to_timedelta([self._parse_timedelta(threshold) if isinstance(threshold, str)
+                                                else threshold for threshold in thresholds]).to_numpy()
+            is_missing = np.isnat(values)
+
+        counts = self._count_meeting_thresholds(values, is_missing, threshold_values, params['type'],
+                                                params['is_strict'])
+
+        return pd.DataFrame({'threshold': list(thresholds), 'count': counts})
+    # End sweep_filter_thresholds.
+
+    @staticmethod
+    def _count_meeting_thresholds(values, is_missing, thresholds, type='min', is_strict=False):
+        # Missing values never meet a threshold.
+        if type not in ['min', 'max']:
+            return np.full(len(thresholds), len(values))
+
+        sorted_values = np.sort(values[~is_missing])
+        if type == 'min':
+            if is_strict:
+                return len(sorted_values) - np.searchsorted(sorted_values, thresholds, side='right')
+            return len(sorted_values) - np.searchsorted(sorted_values, thresholds, side='left')
+        if is_strict:
+            return np.searchsorted(sorted_values, thresholds, side='left')
+        return np.searchsorted(sorted_values, thresholds, side='right')
+    # End _count_meeting_thresholds.
+
     # ******************************************************************************
     # ***************************** VALIDATING INPUT *******************************
     # ******************************************************************************
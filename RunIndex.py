@@ -0,0 +1,111 @@
+import numpy as np
+
+
+class RunIndex:
+
+    # ******************************************************************************
+    # ****************************** CONSTRUCTOR ***********************************
+    # ******************************************************************************
+    def __init__(self, values, valid, offset_criteria=10):
+        # Index of the runs of missing values and of the runs of equal values (flat lines) of a water
+        # level series. Built once per series in O(N); the end of a run is then found by binary search.
+        values = np.asarray(values)
+        valid = np.asarray(valid, dtype=bool)
+        self.size = len(valid)
+        self.offset_criteria = offset_criteria
+
+        # Number of valid values before each index.
+        self.valid_count = np.concatenate(([0], np.cumsum(valid)))
+
+        # Runs of missing values, [nan_run_start, nan_run_end).
+        self.nan_run_start, self.nan_run_end = self._get_runs(~valid)
+
+        # Runs of equal valid values, [flat_run_start, flat_run_end).
+        is_repeated = np.zeros(self.size, dtype=bool)
+        if self.size > 1:
+            is_repeated[1:] = valid[1:] & valid[:-1] & (values[1:] == values[:-1])
+        # A run ends at the next index that does not repeat the previous value.
+        breaks = np.append(np.flatnonzero(~is_repeated), self.size)
+        self.flat_run_start = np.flatnonzero(valid & ~is_repeated)
+        self.flat_run_end = breaks[np.searchsorted(breaks, self.flat_run_start, side='right')]
+
+        # Runs that are long enough to be a nan run or a flat line from their first index.
+        nan_run_length = self.nan_run_end - self.nan_run_start
+        self.long_nan_runs = np.flatnonzero(nan_run_length >= offset_criteria + 1)
+        flat_run_length = self.flat_run_end - self.flat_run_start
+        self.long_flat_runs = np.flatnonzero((flat_run_length >= 2) &
+                                             ((flat_run_length >= offset_criteria + 1) |
+                                              (self.flat_run_end == self.size)))
+    # End constructor.
+
+    @staticmethod
+    def _get_runs(mask):
+        padded = np.concatenate(([False], mask, [False]))
+        edges = np.flatnonzero(padded[1:] != padded[:-1])
+        return edges[::2], edges[1::2]
+    # End _get_runs.
+
+    # ******************************************************************************
+    # ***************************** DATA PROCESSING ********************************
+    # ******************************************************************************
+    def find_nan_run(self, start_index):
+        # A nan run begins if offset_criteria + 1 consecutive values are missing before offset_criteria
+        # valid values are seen. Return the index where the run ends, capped so that offset_criteria
+        # indices remain, and whether a run was found.
+        offset_criteria = self.offset_criteria
+        if offset_criteria <= 0 or start_index + offset_criteria >= self.size:
+            return start_index, False
+
+        run = self._first_long_run(start_index, self.nan_run_start, self.nan_run_end, self.long_nan_runs,
+                                   lambda begin, end: end - begin >= offset_criteria + 1)
+        if run is None:
+            return start_index, False
+
+        begin = max(self.nan_run_start[run], start_index)
+        if self.valid_count[begin] - self.valid_count[start_index] >= offset_criteria:
+            return start_index, False
+
+        return int(min(self.nan_run_end[run], self.size - offset_criteria)), True
+    # End find_nan_run.
+
+    def find_flat_line(self, start_index):
+        # A flat line begins if a value repeats for offset_criteria + 1 values (or to the end of the
+        # series) before offset_criteria other valid values are seen. Return the last index of the flat
+        # line and whether one was found.
+        offset_criteria = self.offset_criteria
+        if offset_criteria <= 0 or start_index + 1 >= self.size:
+            return start_index, False
+
+        size = self.size
+        run = self._first_long_run(start_index, self.flat_run_start, self.flat_run_end, self.long_flat_runs,
+                                   lambda begin, end: end - begin >= 2 and
+                                   (end - begin >= offset_criteria + 1 or end == size))
+        if run is None:
+            return start_index, False
+
+        # Each run ending between the start index and the flat line counts as one valid value.
+        first_run = np.searchsorted(self.flat_run_end, start_index, side='right')
+        if run - first_run >= offset_criteria:
+            return start_index, False
+
+        return int(self.flat_run_end[run] - 1), True
+    # End find_flat_line.
+
+    @staticmethod
+    def _first_long_run(start_index, run_starts, run_ends, long_runs, is_long):
+        # The run containing the start index only counts from the start index. Any later run counts
+        # in full, so the first of those is found by binary search.
+        first_run = np.searchsorted(run_ends, start_index, side='right')
+        if first_run >= len(run_starts):
+            return None
+
+        if run_starts[first_run] <= start_index:
+            if is_long(start_index, run_ends[first_run]):
+                return first_run
+            first_run += 1
+
+        position = np.searchsorted(long_runs, first_run)
+        if position >= len(long_runs):
+            return None
+        return long_runs[position]
+    # End _first_long_run.
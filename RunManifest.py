@@ -0,0 +1,114 @@
+import os
+import json
+import pickle
+import hashlib
+
+import helpers
+
+
+class RunManifest:
+
+    # Version of the stored year results. Increase it when the results returned by process_year, or the
+    # code that computes them, change, so results stored by earlier versions of the program are not reused.
+    RESULTS_VERSION = 1
+
+    # Options listing the years each report is generated for. A year's results depend on which of these
+    # it is in.
+    REPORT_YEARS_OPTIONS = ['metrics_summary_years', 'vert_offset_info_duration_filtered_years',
+                            'vert_offset_info_value_filtered_years', 'temp_corr_summary_years',
+                            'annotated_raw_data_years']
+
+    # ******************************************************************************
+    # ****************************** CONSTRUCTOR ***********************************
+    # ******************************************************************************
+    def __init__(self, write_path, filename):
+        # Record of the years processed into an output directory by earlier runs. Each year is stored
+        # with a hash of its input files and of the configurations its results depend on, so a rerun
+        # can reuse the results and reports of the years that have not changed.
+        self.manifest_path = f'{write_path}/{filename}_run_manifest.json'
+        self.results_path = f'{write_path}/{filename}_run_results'
+        self.years = self._read_manifest()
+    # End constructor.
+
+    # ******************************************************************************
+    # ******************************** SETTERS *************************************
+    # ******************************************************************************
+    def store_year_result(self, year, year_hash, year_result):
+        # Store the result of a processed year, returned by process_year, for later runs.
+        if not os.path.exists(self.results_path):
+            os.makedirs(self.results_path)
+
+        with open(self._get_result_path(year), 'wb') as file:
+            pickle.dump(year_result, file)
+
+        self.years[str(year)] = {
+            'hash': year_hash,
+            'report_files': year_result['report_files']
+        }
+    # End store_year_result.
+
+    # ******************************************************************************
+    # ******************************** GETTERS *************************************
+    # ******************************************************************************
+    def get_year_hash(self, year, files, config, options, previous_hash=None):
+        # Hash the input files of a year and the configurations that affect its results, and the hash of
+        # the previous year if the year's results depend on it.
+        config_sections = {
+            'mode': 'corrected' if options['do_correction'] else 'raw',
+            'gaps_are_interruptions': options['include_gaps'],
+            'fixed_point': options['fixed_point'],
+            'sample_interval': options['sample_interval'],
+            'temporal_shift_correction': config['temporal_shift_correction'],
+            'filter_offsets_by_duration': config['filter_offsets_by_duration'],
+            'filter_offsets_by_value': config['filter_offsets_by_value'],
+            'filter_gaps_by_duration': config['filter_gaps_by_duration'],
+            'annotated_raw_data_compression': config['output'].get('annotated_raw_data_compression'),
+            'reports': [year in options[option] for option in self.REPORT_YEARS_OPTIONS]
+        }
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(self.RESULTS_VERSION).encode('utf-8'))
+        for file in files:
+            digest.update(helpers.get_file_hash(file).encode('utf-8'))
+        digest.update(json.dumps(config_sections, sort_keys=True, default=str).encode('utf-8'))
+        if previous_hash is not None:
+            digest.update(previous_hash.encode('utf-8'))
+        return digest.hexdigest()
+    # End get_year_hash.
+
+    def get_year_result(self, year, year_hash):
+        # Get the stored result of a year if its hash matches and its reports still exist, else None.
+        entry = self.years.get(str(year))
+        if entry is None or entry['hash'] != year_hash:
+            return None
+        if not all(os.path.isfile(report_file) for report_file in entry['report_files']):
+            return None
+
+        try:
+            with open(self._get_result_path(year), 'rb') as file:
+                return pickle.load(file)
+        except Exception:
+            # Results that cannot be read back, e.g. pickled by another version of the program or its
+            # dependencies, are processed again.
+            return None
+    # End get_year_result.
+
+    def _get_result_path(self, year):
+        return f'{self.results_path}/{year}.pkl'
+    # End _get_result_path.
+
+    # ******************************************************************************
+    # ***************************** FILE HANDLING **********************************
+    # ******************************************************************************
+    def save(self):
+        with open(self.manifest_path, 'w') as file:
+            json.dump({'years': self.years}, file, indent=4)
+    # End save.
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as file:
+                return json.load(file)['years']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return {}
+    # End _read_manifest.
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+from AnnotationBuffer import AnnotationBuffer
+
+
+class SegmentLog:
+
+    # Temporal shift code for segments that could not be temporally corrected.
+    UNCORRECTABLE_SHIFT = AnnotationBuffer.UNCORRECTABLE_SHIFT
+
+    # ******************************************************************************
+    # ****************************** CONSTRUCTOR ***********************************
+    # ******************************************************************************
+    def __init__(self, capacity=256):
+        # Append-only columns, grown by doubling. Only the first self.size entries are valid.
+        self.size = 0
+        self.start_index = np.zeros(capacity, dtype=np.int64)
+        self.end_index = np.zeros(capacity, dtype=np.int64)
+        self.temporal_shift = np.zeros(capacity, dtype=AnnotationBuffer.SHIFT_DTYPE)
+        self.vertical_offset = np.zeros(capacity, dtype=float)
+    # End constructor.
+
+    def __len__(self):
+        return self.size
+    # End __len__.
+
+    # ******************************************************************************
+    # ******************************** SETTERS *************************************
+    # ******************************************************************************
+    def append(self, start_index, end_index, temporal_shift=None, vertical_offset=None, uncorrected=False):
+        # Record a segment from start_index to end_index. Uncorrected segments have no temporal shift
+        # or vertical offset.
+        if self.size == len(self.start_index):
+            self._grow()
+
+        self.start_index[self.size] = start_index
+        self.end_index[self.size] = end_index
+        if uncorrected:
+            self.temporal_shift[self.size] = self.UNCORRECTABLE_SHIFT
+            self.vertical_offset[self.size] = np.nan
+        else:
+            self.temporal_shift[self.size] = temporal_shift
+            self.vertical_offset[self.size] = vertical_offset
+        self.size += 1
+    # End append.
+
+    def truncate(self, size):
+        # Keep only the first size segments.
+        self.size = min(size, self.size)
+    # End truncate.
+
+    def set_last_end_index(self, end_index):
+        self.end_index[self.size - 1] = end_index
+    # End set_last_end_index.
+
+    def _grow(self):
+        capacity = max(2 * len(self.start_index), 1)
+        for field in ['start_index', 'end_index', 'temporal_shift', 'vertical_offset']:
+            values = getattr(self, field)
+            grown = np.zeros(capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            setattr(self, field, grown)
+    # End _grow.
+
+    # ******************************************************************************
+    # ******************************** GETTERS *************************************
+    # ******************************************************************************
+    def get_start_indices(self):
+        return self.start_index[:self.size]
+    # End get_start_indices.
+
+    def get_end_indices(self):
+        return self.end_index[:self.size]
+    # End get_end_indices.
+
+    def get_temporal_shifts(self):
+        return self.temporal_shift[:self.size]
+    # End get_temporal_shifts.
+
+    def get_vertical_offsets(self):
+        return self.vertical_offset[:self.size]
+    # End get_vertical_offsets.
+
+    def get_uncorrectable_mask(self):
+        return self.get_temporal_shifts() == self.UNCORRECTABLE_SHIFT
+    # End get_uncorrectable_mask.
+
+    # ******************************************************************************
+    # ***************************** DATA PROCESSING ********************************
+    # ******************************************************************************
+    def to_summary_df(self, datetimes: pd.Series) -> pd.DataFrame:
+        # Materialize the temporal shifts summary. Start and end dates are resolved in one lookup.
+        # Uncorrected segments are listed with 'N/A' temporal shift and vertical offset.
+        start_dates, end_dates = self._get_dates(datetimes)
+        uncorrectable = self.get_uncorrectable_mask()
+
+        temporal_shift = self.get_temporal_shifts().astype(object)
+        temporal_shift[uncorrectable] = 'N/A'
+        vertical_offset = self.get_vertical_offsets().astype(object)
+        vertical_offset[uncorrectable] = 'N/A'
+
+        # Build the columns from lists so all-numeric columns keep a numeric dtype.
+        return pd.DataFrame({
+            'start_date': start_dates,
+            'end_date': end_dates,
+            'duration': end_dates - start_dates,
+            'temporal_shift': temporal_shift.tolist(),
+            'vertical_offset': vertical_offset.tolist()
+        })
+    # End to_summary_df.
+
+    def _get_dates(self, datetimes):
+        start_dates = datetimes.iloc[self.get_start_indices()].reset_index(drop=True)
+        end_dates = datetimes.iloc[self.get_end_indices()].reset_index(drop=True)
+        return start_dates, end_dates
+    # End _get_dates.
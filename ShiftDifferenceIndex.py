@@ -0,0 +1,245 @@
+import numpy as np
+
+
+class ShiftDifferenceIndex:
+
+    # Number of indices whose first matches are found together, at the least and at the most. Blocks grow
+    # while the scan moves through consecutive blocks, and start small again after the scan skips ahead.
+    MIN_BLOCK_SIZE = 64
+    MAX_BLOCK_SIZE = 1 << 16
+
+    # ******************************************************************************
+    # ****************************** CONSTRUCTOR ***********************************
+    # ******************************************************************************
+    def __init__(self, primary, primary_valid, reference, reference_valid, temporal_shifts, duration,
+                 fixed_point=False, window_shifts=None, window_size=None):
+        # Index of the runs of constant differences between the reference series and the primary series
+        # shifted by each temporal shift. Float differences are integerized to units of their 4th decimal
+        # place, which is exactly how np.round(difference, 4) rounds them, so equal keys are equal rounded
+        # differences. For every index and shift, the index stores the next non-missing difference and the
+        # length of its run, in int32 rows built one shift at a time, so it costs O(N * shifts) in vector
+        # operations and 8 bytes per index and shift. The first shift with a constant difference for
+        # duration intervals, in the order of temporal_shifts, is then found for blocks of indices at once.
+        # With window_shifts, the shifts tried in each window of window_size indices, only the shifts of
+        # the window being scanned are indexed, over the window and a margin after it.
+        size = len(primary)
+        self.size = size
+        self.duration = duration
+        self.fixed_point = fixed_point
+        self.temporal_shifts = list(temporal_shifts)
+        self.window_shifts = window_shifts
+        self.window_size = window_size
+        self.reference = reference
+        self.reference_valid = reference_valid
+
+        # Primary values shifted like pd.Series.shift(try_shift): row max_shift - try_shift of the strided
+        # view of the padded series.
+        self.max_shift = max(abs(shift) for shift in self.temporal_shifts)
+        padded_primary = np.zeros(size + 2 * self.max_shift, dtype=primary.dtype)
+        padded_primary[self.max_shift:self.max_shift + size] = primary
+        padded_valid = np.zeros(size + 2 * self.max_shift, dtype=bool)
+        padded_valid[self.max_shift:self.max_shift + size] = primary_valid
+        self.shifted = np.lib.stride_tricks.sliding_window_view(padded_primary, size)
+        self.shifted_valid = np.lib.stride_tricks.sliding_window_view(padded_valid, size)
+
+        # Runs of the indices [span_start, span_end), with one row per shift.
+        self.window = None
+        self.rows = {}
+        self.span_start = 0
+        self.span_end = 0
+        self.next_valid = None
+        self.run_length = None
+        if window_shifts is None:
+            self._index_runs(self.temporal_shifts, 0, size)
+
+        # First matches of the indices [block_start, block_end).
+        self.block_start = 0
+        self.block_end = 0
+        self.block_size = self.MIN_BLOCK_SIZE // 2
+        self.match_position = None
+        self.match_reach = None
+    # End constructor.
+
+    # ******************************************************************************
+    # ******************************** GETTERS *************************************
+    # ******************************************************************************
+    def get_first_match(self, index):
+        # The position in temporal_shifts of the first shift with an offset or that reaches the end of the
+        # data at an index, and the index up to which (excluded) the data is read to find it. The shifts
+        # before it have neither, so they need not be tried.
+        if not self.block_start <= index < self.block_end:
+            if self.block_end <= index < self.block_end + self.block_size:
+                self.block_size = min(2 * self.block_size, self.MAX_BLOCK_SIZE)
+            else:
+                self.block_size = self.MIN_BLOCK_SIZE
+            self._find_first_matches(index, min(index + self.block_size, self.size))
+
+        position = index - self.block_start
+        return self.match_position[position], self.match_reach[position]
+    # End get_first_match.
+
+    def get_shifted(self, try_shift):
+        # The primary values shifted by a temporal shift, and a mask of the non-missing values.
+        row = self.max_shift - try_shift
+        return self.shifted[row], self.shifted_valid[row]
+    # End get_shifted.
+
+    # ******************************************************************************
+    # ***************************** DATA PROCESSING ********************************
+    # ******************************************************************************
+    def _index_runs(self, temporal_shifts, span_start, span_end):
+        # Build the next_valid and run_length rows of the shifts over the indices [span_start, span_end).
+        # next_valid[r, i - span_start] is the index of the next non-missing difference at or after i, and
+        # run_length[r, i - span_start] the number of following differences equal to the difference at i.
+        # Both stop at span_end.
+        span_size = span_end - span_start
+        dtype = np.int32 if span_end < np.iinfo(np.int32).max else np.int64
+        positions = np.arange(span_start, span_end, dtype=dtype)
+        self.rows = {shift: row for row, shift in enumerate(temporal_shifts)}
+        self.span_start = span_start
+        self.span_end = span_end
+        self.next_valid = np.empty((len(temporal_shifts), span_size), dtype=dtype)
+        self.run_length = np.empty((len(temporal_shifts), span_size), dtype=dtype)
+        for shift, row in self.rows.items():
+            valid = self._get_valid(shift, span_start, span_end)
+            keys = self._get_keys(shift, span_start, span_end)
+            np.minimum.accumulate(np.where(valid, positions, span_end)[::-1], out=self.next_valid[row, ::-1])
+
+            is_equal_to_next = np.zeros(span_size, dtype=bool)
+            is_equal_to_next[:-1] = (keys[1:] == keys[:-1]) & valid[1:] & valid[:-1]
+            np.minimum.accumulate(np.where(is_equal_to_next, span_end, positions)[::-1],
+                                  out=self.run_length[row, ::-1])
+            self.run_length[row] -= positions
+        # End for.
+    # End _index_runs.
+
+    def _index_window(self, window):
+        # Index the shifts of a window over the window and a margin after it, which holds the runs that start
+        # near the end of the window.
+        span_start = window * self.window_size
+        span_end = min(span_start + self.window_size + self.MIN_BLOCK_SIZE + self.duration + 1, self.size)
+        self._index_runs(self.window_shifts[window], span_start, span_end)
+        self.window = window
+    # End _index_window.
+
+    def _get_valid(self, try_shift, start, stop):
+        # Mask of the non-missing differences of the indices [start, stop).
+        return self.shifted_valid[self.max_shift - try_shift, start:stop] & self.reference_valid[start:stop]
+    # End _get_valid.
+
+    def _get_keys(self, try_shift, start, stop):
+        # Differences of the indices [start, stop), integerized to units of their 4th decimal place in
+        # float mode.
+        keys = self.reference[start:stop] - self.shifted[self.max_shift - try_shift, start:stop]
+        if not self.fixed_point:
+            keys = np.rint(keys * 10000, out=keys)
+        return keys
+    # End _get_keys.
+
+    def _find_first_matches(self, block_start, block_end):
+        # Find the first matches of the indices of a block, with every shift evaluated as in find_offset.
+        size = self.size
+        duration = self.duration
+        start = self.next_valid[:, block_start:block_end]
+        in_range = start < size
+        run_length = np.take_along_axis(self.run_length, np.minimum(start, size - 1), axis=1)
+        found = in_range & (run_length >= duration)
+        run_reaches_end = ~in_range | (start + run_length + 1 >= size)
+        is_end = np.where(in_range, ~found & run_reaches_end, duration > 0)
+        reach = np.where(found, start + duration + 1, np.where(run_reaches_end, size, start + run_length + 2))
+
+        # The shifts are tried up to the first that has an offset or reaches the end, or all of them, and the
+        # data is read up to the furthest reach of the shifts tried.
+        is_match = found | is_end
+        match_position = np.where(is_match.any(axis=0), is_match.argmax(axis=0), len(self.temporal_shifts))
+        reach = np.maximum.accumulate(reach, axis=0)
+        match_reach = reach[np.minimum(match_position, len(self.temporal_shifts) - 1),
+                            np.arange(block_end - block_start)]
+
+        self.block_start = block_start
+        self.block_end = block_end
+        self.match_position = match_position.tolist()
+        self.match_reach = match_reach.tolist()
+    # End _find_first_matches.
+
+    def _scan_runs(self, try_shift, index):
+        # The next non-missing difference at or after an index, and the number of following differences
+        # equal to it, counted up to duration, for the runs that go past the indexed span. Search windows
+        # grow geometrically so the cost is proportional to the distance scanned.
+        size = self.size
+        start = index
+        window = 64
+        row = self.max_shift - try_shift
+        while start < size and not (self.shifted_valid[row, start] and self.reference_valid[start]):
+            stop = min(start + window, size)
+            valid = self._get_valid(try_shift, start, stop)
+            first_valid = valid.argmax()
+            if valid[first_valid]:
+                start += first_valid
+                break
+            start = stop
+            window *= 2
+        # End while.
+        if start >= size:
+            return size, 0
+
+        stop = min(start + self.duration + 1, size)
+        valid = self._get_valid(try_shift, start, stop)
+        keys = self._get_keys(try_shift, start, stop)
+        is_equal_to_next = (keys[1:] == keys[:-1]) & valid[1:] & valid[:-1]
+        run_length = len(is_equal_to_next) if is_equal_to_next.all() else is_equal_to_next.argmin()
+        return start, run_length
+    # End _scan_runs.
+
+    def find_offset(self, try_shift, index):
+        # Mirrors identify_offset: skip missing values, then require the difference to stay the same
+        # for the following duration intervals. Returns the offset (None if not found), whether the
+        # end of the data was reached, and the index up to which (excluded) the data was read.
+        size = self.size
+        duration = self.duration
+        if self.window_shifts is not None and index // self.window_size != self.window:
+            self._index_window(index // self.window_size)
+
+        # A run cut off by the end of the indexed span is scanned past it.
+        row = self.rows[try_shift]
+        span_start = self.span_start
+        span_end = self.span_end
+        start = self.next_valid[row, index - span_start]
+        run_length = self.run_length[row, start - span_start] if start < span_end else 0
+        if span_end < size and (start >= span_end or
+                                (run_length < duration and start + run_length + 1 >= span_end)):
+            start, run_length = self._scan_runs(try_shift, index)
+        if start >= size:
+            return None, duration > 0, size
+
+        if run_length >= duration:
+            offset = self.reference[start] - self.shifted[self.max_shift - try_shift, start]
+            return (offset if self.fixed_point else np.rint(offset * 10000) / 10000), False, start + duration + 1
+
+        if start + run_length + 1 >= size:
+            return None, True, size
+        return None, False, start + run_length + 2
+    # End find_offset.
+
+    def find_segment_end(self, try_shift, vert_offset, index):
+        # Mirrors _record_corrected_values: the segment continues while values are missing or the
+        # offset-corrected primary value matches the reference. Search windows grow geometrically so the
+        # cost is proportional to the segment length.
+        shifted = self.shifted[self.max_shift - try_shift]
+        size = self.size
+        window = 64
+        while index < size:
+            stop = min(index + window, size)
+            corrected_values = shifted[index:stop] + vert_offset
+            comparison_reference = self.reference[index:stop]
+            if not self.fixed_point:
+                corrected_values = np.round(corrected_values, 4)
+                comparison_reference = np.round(comparison_reference, 4)
+            mismatches = np.flatnonzero(self._get_valid(try_shift, index, stop) &
+                                        (corrected_values != comparison_reference))
+            if mismatches.size:
+                return index + mismatches[0]
+            index = stop
+            window *= 2
+        return size
+    # End find_segment_end.
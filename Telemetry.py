@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+# Peak RSS is read with the resource module, which is only available on Unix.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class Telemetry:
+
+    # Prefix and description of each metric in the Prometheus text format.
+    PROMETHEUS_PREFIX = 'lighthouse_analysis_stage'
+    PROMETHEUS_METRICS = {
+        'wall_seconds': 'Wall time of the stage in seconds.',
+        'cpu_seconds': 'CPU time of the process during the stage in seconds.',
+        'rows': 'Number of rows processed by the stage.',
+        'rows_per_second': 'Rows processed per second of wall time.',
+        'peak_rss_bytes': 'Peak resident set size of the process at the end of the stage in bytes.'
+    }
+
+    # ******************************************************************************
+    # ****************************** CONSTRUCTOR ***********************************
+    # ******************************************************************************
+    def __init__(self, station=''):
+        # Records the wall time, CPU time, rows processed and peak RSS of each processing stage of
+        # a station. Records of stages run in worker processes are merged with extend().
+        self.station = station
+        self.records = []
+    # End constructor.
+
+    # ******************************************************************************
+    # ******************************** SETTERS *************************************
+    # ******************************************************************************
+    @contextmanager
+    def stage(self, name, year=None, rows=0):
+        # Time the stage run in the with block. The number of rows can also be set on the yielded
+        # record once it is known.
+        record = {
+            'station': self.station,
+            'year': year,
+            'stage': name,
+            'rows': rows
+        }
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        yield record
+        record['wall_seconds'] = time.perf_counter() - wall_start
+        record['cpu_seconds'] = time.process_time() - cpu_start
+        record['rows_per_second'] = record['rows'] / record['wall_seconds'] if record['wall_seconds'] > 0 else 0.0
+        record['peak_rss_bytes'] = self.get_peak_rss()
+        record['pid'] = os.getpid()
+        self.records.append(record)
+    # End stage.
+
+    def extend(self, records):
+        self.records.extend(records)
+    # End extend.
+
+    # ******************************************************************************
+    # ******************************** GETTERS *************************************
+    # ******************************************************************************
+    def get_records(self):
+        return self.records
+    # End get_records.
+
+    @staticmethod
+    def get_peak_rss():
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+        if resource is None:
+            return None
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+    # End get_peak_rss.
+
+    # ******************************************************************************
+    # ***************************** FILE HANDLING **********************************
+    # ******************************************************************************
+    def write_jsonl(self, file_path):
+        # Append one JSON object per stage, so the file keeps the history of runs.
+        run_time = time.strftime('%Y-%m-%dT%H:%M:%S')
+        with open(file_path, 'a') as file:
+            for record in self.records:
+                file.write(json.dumps({'run_time': run_time, **record}) + '\n')
+    # End write_jsonl.
+
+    def write_prometheus(self, file_path):
+        # Write the records of this run in the Prometheus text format, for a node exporter textfile
+        # collector. The file is written to a temporary file first so it is never read half written.
+        lines = []
+        for metric, description in self.PROMETHEUS_METRICS.items():
+            metric_name = f'{self.PROMETHEUS_PREFIX}_{metric}'
+            lines.append(f'# HELP {metric_name} {description}')
+            lines.append(f'# TYPE {metric_name} gauge')
+            for record in self.records:
+                if record[metric] is None:
+                    continue
+                year = record['year'] if record['year'] is not None else 'all'
+                labels = (f'station="{self._escape_label(record["station"])}",year="{year}",'
+                          f'stage="{record["stage"]}"')
+                lines.append(f'{metric_name}{{{labels}}} {record[metric]}')
+        # End for.
+
+        temp_file_path = f'{file_path}.tmp'
+        with open(temp_file_path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(temp_file_path, file_path)
+    # End write_prometheus.
+
+    @staticmethod
+    def _escape_label(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    # End _escape_label.
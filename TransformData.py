@@ -3,9 +3,24 @@ import pandas as pd
 import json
 import datetime
 
+import helpers
+from AnnotationBuffer import AnnotationBuffer
+from SegmentLog import SegmentLog
+from RunIndex import RunIndex
+from ShiftDifferenceIndex import ShiftDifferenceIndex
+
 
 class TransformData:
 
+    # Default settings of the lag estimation of the vectorized engine, which proposes the temporal shifts to
+    # try in each window of the data instead of the fixed shifts of -3 to 3 intervals.
+    LAG_ESTIMATION_DEFAULTS = {
+        'enabled': False,
+        'max_lag': 30,
+        'window_size': 240,
+        'candidates': 2
+    }
+
     # ******************************************************************************
     # ****************************** CONSTRUCTOR ***********************************
     # ******************************************************************************
@@ -16,7 +31,10 @@ class TransformData:
             },
             'temporal_shift_correction': {
                 'number_of_intervals': 10,
-                'replace_with_nans': True
+                'replace_with_nans': True,
+                'engine': 'vectorized',
+                'max_temporal_shift': 3,
+                'lag_estimation': {}
             }
         }
 
@@ -38,19 +56,19 @@ class TransformData:
         if col_names is not None:
             self.set_column_names(col_names)
 
-        self.time_shift_table = {
-            'temporal_shift': [],
-            'vertical_offset': [],
-            'date_time': [],
-            'primary_water_level': [],
-            'reference_water_level': []
-        }
+        self.time_shift_table = AnnotationBuffer()
+
+        self.segment_log = SegmentLog()
+
+        self.run_index = None
 
         self.shifts_summary_df = [pd.DataFrame(columns=['start_date', 'end_date', 'duration',
                                                'temporal_shift', 'vertical_offset'])]
 
         self.document_corrected_data_entries = False
 
+        self.carry_over_state = None
+
     # ******************************************************************************
     # ******************************** SETTERS *************************************
     # ******************************************************************************
@@ -121,6 +139,14 @@ class TransformData:
     def get_time_shift_table(self):
         return self.time_shift_table
 
+    def get_segment_log(self):
+        return self.segment_log
+
+    def get_carry_over_state(self):
+        # State of the last temporal correction at the end of its data, to continue it with the next chunk
+        # of the series. Only set by the vectorized engine.
+        return self.carry_over_state
+
     def get_temporal_processing_string(self):
         return self.temporal_processing_string
 
@@ -135,7 +161,10 @@ class TransformData:
         self.temporal_processing_string = ""
 
     def temporal_shift_corrector(self, df=None, primary_col=None, reference_col=None, datetime_col=None, index=0,
-                                 **kwargs):
+                                 carry_over=None, lookahead_df=None, **kwargs):
+        # A series can be corrected in consecutive chunks, with the same results as in one piece: pass each
+        # chunk with the carry_over state of the previous chunk (from get_carry_over_state) and, if known, the
+        # next chunk as lookahead_df. Only the rows of df are returned and documented.
         # Get column names.
         default_col_names = self.col_config
         names = {**default_col_names, **kwargs}
@@ -171,22 +200,57 @@ class TransformData:
         params = {**default_params, **kwargs}
         offset_criteria = params['number_of_intervals']
         insert_nans = params['replace_with_nans']
-
-        return self._temporal_deshifter(df, primary_col_name, reference_col_name, ref_dt_col_name, index,
-                                        offset_criteria, insert_nans)
+        engine = params['engine']
+        max_temporal_shift = params['max_temporal_shift']
+        if not isinstance(max_temporal_shift, int) or max_temporal_shift < 0:
+            raise ValueError(f"max_temporal_shift must be a non-negative integer, not {max_temporal_shift!r}.")
+        lag_estimation = {**self.LAG_ESTIMATION_DEFAULTS, **params['lag_estimation']}
+
+        if engine == 'vectorized':
+            if lag_estimation['enabled'] and (carry_over is not None or lookahead_df is not None):
+                raise ValueError("Correcting a series in chunks is not supported with lag estimation.")
+            return self._vectorized_temporal_deshifter(df, primary_col_name, reference_col_name, ref_dt_col_name,
+                                                       index, offset_criteria, insert_nans, carry_over, lookahead_df,
+                                                       lag_estimation, max_temporal_shift)
+        elif engine == 'loop':
+            if carry_over is not None or lookahead_df is not None:
+                raise ValueError("Correcting a series in chunks is only supported by the 'vectorized' engine.")
+            if lag_estimation['enabled']:
+                raise ValueError("Lag estimation is only supported by the 'vectorized' engine.")
+            return self._temporal_deshifter(df, primary_col_name, reference_col_name, ref_dt_col_name, index,
+                                            offset_criteria, insert_nans, max_temporal_shift)
+        else:
+            raise ValueError(f"Unknown temporal correction engine '{engine}'. Must be 'vectorized' or 'loop'.")
     # End temporal_shift_corrector.
 
     def _temporal_deshifter(self, merged_df, primary_col_name, ref_col_name, ref_dt_col_name, index=0,
-                            offset_criteria=10, insert_nans=True):
+                            offset_criteria=10, insert_nans=True, max_temporal_shift=3):
         size = len(merged_df)
 
-        # Initialize dataframes. df_copy will be shifted to find offsets.
         # corrected_df will hold the temporally corrected values. No vertical offset correction is done.
-        df_copy, corrected_df = self._initialize_dataframes(merged_df)
+        corrected_df = merged_df.copy()
 
-        temporal_shifts = [0, -1, -2, -3, 1, 2, 3]  # A temporal shift of 0 or -1 is most likely.
+        temporal_shifts = self._get_temporal_shifts(max_temporal_shift)
         shift_val_index = 0
 
+        # The primary values are padded once, so that each temporal shift is a view of the padded array
+        # rather than a reshifted copy of the column.
+        max_shift = max(abs(shift) for shift in temporal_shifts)
+        padded_primary = self._pad_primary(merged_df[primary_col_name], max_shift)
+        reference_series = merged_df[ref_col_name]
+
+        # In fixed-point storage mode, offsets are found in tenths of a millimeter and reported in meters.
+        fixed_point = helpers.is_fixed_point(merged_df[primary_col_name])
+
+        # Annotations are written by segment into a buffer preallocated for the whole series.
+        # Segments are logged and documented in the summary all at once after the while loop.
+        previous_annotations = self.time_shift_table
+        self.time_shift_table = AnnotationBuffer(size, merged_df[ref_dt_col_name])
+        self.segment_log = SegmentLog()
+
+        # Nan runs and flat lines of the primary series are indexed once for the uncorrectable segments.
+        self.run_index = RunIndex(*self._get_storage_arrays(merged_df[primary_col_name]), offset_criteria)
+
         # While indices of dataframe are valid, correct temporal shifts if possible.
         is_end = [False]
         start_index = index
@@ -196,19 +260,18 @@ class TransformData:
                 start_index = index
             
             # Handle uncorrectable segment.
-            if shift_val_index > 6 or is_end[0]:
-                df_copy, shift_val_index = self._reset_shift(df_copy, merged_df, primary_col_name)
+            if shift_val_index >= len(temporal_shifts) or is_end[0]:
+                shift_val_index = 0
 
                 corrected_df, index = self._handle_uncorrectable_segment(corrected_df, start_index,
-                                                                         primary_col_name, df_copy,
+                                                                         primary_col_name, merged_df,
                                                                          offset_criteria, size, insert_nans)
                 if index >= size:
                     func_index = index - 1
                 else:
                     func_index = index
 
-                self.append_summary_df(start_index, func_index, try_shift, vert_offset, merged_df, ref_dt_col_name,
-                                       uncorrected=True)
+                self.segment_log.append(start_index, func_index, uncorrected=True)
                 self.append_shifts_table(start_index, func_index, try_shift, vert_offset,
                                          merged_df, ref_dt_col_name,
                                          primary_col_name, ref_col_name, uncorrected=True)
@@ -224,13 +287,13 @@ class TransformData:
             # Current shift value.
             try_shift = temporal_shifts[shift_val_index]
 
-            # Temporally shift the dataframe.
-            df_copy = self._apply_temporal_shift(df_copy, merged_df, primary_col_name, try_shift)
+            # Temporally shift the primary series.
+            shifted_primary = self._shift_view(padded_primary, try_shift, max_shift, merged_df.index)
 
             # Get the vertical offset. Note that identify_offset does not let missing
             # values contribute to the detection of an offset, but does include them in the
             # duration count.
-            vert_offset = self.identify_offset(df_copy[primary_col_name], df_copy[ref_col_name], index, size,
+            vert_offset = self.identify_offset(shifted_primary, reference_series, index, size,
                                                duration=offset_criteria, end_reached=is_end)[0]
 
             if pd.isna(vert_offset) and is_end[0]:
@@ -242,49 +305,432 @@ class TransformData:
                 shift_val_index += 1
                 continue
 
-            # If an offset is found, record df_copy values into corrected_df while the vertical
+            # If an offset is found, record shifted values into corrected_df while the vertical
             # offset is valid. Record the index where the offset stops.
             # When offset stops, undo the shift.
-            corrected_df, index = self._record_corrected_values(df_copy, corrected_df,
-                                                                primary_col_name, ref_col_name,
-                                                                vert_offset, index, size)
-            
-            df_copy, shift_val_index = self._reset_shift(df_copy, merged_df, primary_col_name)
+            corrected_df, index = self._record_corrected_values(shifted_primary, reference_series, corrected_df,
+                                                                primary_col_name, vert_offset, index, size)
+
+            shift_val_index = 0
 
             if index >= size:
                 func_index = index - 1
             else:
                 func_index = index
 
-            self.append_summary_df(start_index, func_index, try_shift,
-                                   vert_offset, merged_df, ref_dt_col_name)
+            reported_offset = vert_offset / helpers.FIXED_POINT_SCALE if fixed_point else vert_offset
+            self.segment_log.append(start_index, func_index, try_shift, reported_offset)
 
             if self.document_corrected_data_entries:
-                self.append_shifts_table(start_index, func_index, try_shift, vert_offset,
+                self.append_shifts_table(start_index, func_index, try_shift, reported_offset,
                                          corrected_df, ref_dt_col_name, primary_col_name, ref_col_name)
             else:
-                self.append_shifts_table(start_index, func_index, try_shift, vert_offset,
+                self.append_shifts_table(start_index, func_index, try_shift, reported_offset,
                                          merged_df, ref_dt_col_name, primary_col_name, ref_col_name)
 
             # index += 1
         # End while.
 
+        self._extend_summary_df(self.segment_log, merged_df[ref_dt_col_name])
+        self._merge_time_shift_tables(previous_annotations)
+
         # Return temporally corrected dataframe.
         return corrected_df
     # End temporal_deshifter.
+
+    def _vectorized_temporal_deshifter(self, merged_df, primary_col_name, ref_col_name, ref_dt_col_name, index=0,
+                                       offset_criteria=10, insert_nans=True, carry_over=None, lookahead_df=None,
+                                       lag_estimation=None, max_temporal_shift=3):
+        size = len(merged_df)
+
+        # Work on NumPy arrays. corrected holds the temporally corrected primary values, and is written back to
+        # corrected_df once the whole series has been processed. In fixed-point storage mode the values are
+        # integers and are compared directly, otherwise the float values are rounded to 4 decimal places.
+        fixed_point = helpers.is_fixed_point(merged_df[primary_col_name])
+        rows = [self._get_row_arrays(merged_df[primary_col_name], merged_df[ref_col_name])]
+
+        # A carry-over state continues the series of the previous chunk: the rows it carries are put before
+        # the data, and the scan resumes where the previous chunk stopped. The rows of the next chunk, if
+        # given, are put after the data, so the segments reaching the end of this chunk are decided as in
+        # one continuous series. Only the rows of this chunk are corrected and documented.
+        if carry_over is not None:
+            if carry_over['fixed_point'] != fixed_point:
+                raise ValueError("The carry-over state and the data must both be in fixed-point storage mode, "
+                                 "or both not.")
+            rows.insert(0, carry_over['rows'])
+        if lookahead_df is not None:
+            rows.append(self._get_row_arrays(lookahead_df[primary_col_name], lookahead_df[ref_col_name]))
+        chunk_start = len(rows[0]['primary']) if carry_over is not None else 0
+        chunk_end = chunk_start + size
+        primary, primary_valid, reference, reference_valid = [
+            np.concatenate([row_arrays[name] for row_arrays in rows])
+            for name in ['primary', 'primary_valid', 'reference', 'reference_valid']]
+        total_size = len(primary)
+
+        corrected = primary.copy()
+        corrected_valid = primary_valid.copy()
+        self.run_index = RunIndex(primary, primary_valid, offset_criteria)
+
+        # Index the runs of the difference series of every candidate shift up front. With lag estimation, the
+        # shifts tried in each window are the most likely lags of the window, and only the shifts of the window
+        # being scanned are indexed.
+        temporal_shifts = self._get_temporal_shifts(max_temporal_shift)
+        window_shifts = None
+        window_size = None
+        if lag_estimation is not None and lag_estimation['enabled']:
+            window_size = lag_estimation['window_size']
+            window_shifts = self._estimate_lags(primary, primary_valid, reference, reference_valid, window_size,
+                                                lag_estimation['max_lag'], lag_estimation['candidates'])
+            temporal_shifts = sorted({0} | {shift for shifts in window_shifts for shift in shifts}, key=abs)
+        max_shift = max(abs(shift) for shift in temporal_shifts)
+        shift_index = ShiftDifferenceIndex(primary, primary_valid, reference, reference_valid, temporal_shifts,
+                                           offset_criteria, fixed_point, window_shifts, window_size)
+
+        # Segments, as (start_index, end_index, temporal_shift, vertical_offset, uncorrected, reach) with the
+        # end index excluded, are applied and documented all at once after the while loop. reach is the index
+        # up to which (excluded) the data was read to decide the segment. A segment decided from the data at
+        # the end of the series is not final if the series continues in a next chunk.
+        segments = []
+
+        # Resume the scan where the previous chunk left it. If it left it in a corrected segment, the segment
+        # continues until its offset stops being valid, checked again from the last rows whose shifted values
+        # were missing at the end of the previous chunk.
+        index = chunk_start + index
+        if carry_over is not None:
+            index = chunk_start + carry_over['resume_index']
+            if carry_over['segment'] is not None:
+                try_shift, vert_offset, uncorrected = carry_over['segment']
+                segment_start = min(index, chunk_start)
+                if not uncorrected:
+                    index = shift_index.find_segment_end(try_shift, vert_offset, max(index + min(try_shift, 0), 0))
+                    index = max(index, segment_start)
+                if index > segment_start:
+                    segments.append((segment_start, index, try_shift, vert_offset, uncorrected, 0))
+        carried_segments = len(segments)
+
+        # While indices of this chunk are valid, correct temporal shifts if possible.
+        while index < chunk_end:
+            start_index = index
+
+            # The shifts before the first one with an offset or that reaches the end of the data are skipped,
+            # and the shifts after it are only tried if its segment does not advance the index. With lag
+            # estimation, the few shifts proposed for the window are tried in order.
+            is_end = False
+            segment = None
+            if window_shifts is None:
+                shifts = temporal_shifts
+                position, reach = shift_index.get_first_match(index)
+            else:
+                shifts = window_shifts[index // window_size]
+                position, reach = 0, index
+            for try_shift in shifts[position:]:
+                vert_offset, is_end, try_reach = shift_index.find_offset(try_shift, index)
+                reach = max(reach, try_reach)
+
+                # If the end of the data was reached with no identifiable offset, the remaining data
+                # is handled as an uncorrectable segment.
+                if is_end:
+                    break
+
+                # If there is no consistent vertical offset, try the next temporal shift value.
+                if vert_offset is None:
+                    continue
+
+                # Find the index where the vertical offset stops being valid.
+                end_index = shift_index.find_segment_end(try_shift, vert_offset, index)
+
+                # Guard against a segment that does not advance the index, so the engine always terminates.
+                if end_index > index:
+                    segment = (try_shift, vert_offset, end_index)
+                    break
+            # End for.
+
+            # Record the corrected segment.
+            if segment is not None:
+                try_shift, vert_offset, index = segment
+                segments.append((start_index, index, try_shift, vert_offset, False, reach))
+                continue
+
+            # Handle uncorrectable segment.
+            end_fill_index = self._uncorrectable_segment_end(start_index, offset_criteria, total_size)
+            end_fill_index = max(end_fill_index, start_index)
+            index = end_fill_index + 1
+            segments.append((start_index, index, None, None, True, reach))
+
+            # If end of data was reached with no identifiable offset, stop after filling
+            # and documenting last segment.
+            if is_end:
+                break
+        # End while.
+
+        # Apply the segments.
+        for start_index, end_index, try_shift, vert_offset, uncorrected, reach in segments:
+            segment = slice(start_index, end_index)
+            if not uncorrected:
+                shifted, shifted_valid = shift_index.get_shifted(try_shift)
+                corrected[segment] = shifted[segment]
+                corrected_valid[segment] = shifted_valid[segment]
+            elif insert_nans:
+                corrected_valid[segment] = False
+            else:
+                corrected[segment] = primary[segment]
+                corrected_valid[segment] = primary_valid[segment]
+        # End for.
+
+        # Keep the state of the scan at the end of this chunk, to continue it in the next chunk.
+        self.carry_over_state = self._get_carry_over_state(
+            {'primary': primary, 'primary_valid': primary_valid, 'reference': reference,
+             'reference_valid': reference_valid},
+            segments, carried_segments, index, chunk_end, offset_criteria, max_shift, fixed_point)
+
+        # Document the segments of this chunk, in its own indices. Reported values are in meters.
+        chunk = slice(chunk_start, chunk_end)
+        previous_annotations = self.time_shift_table
+        self.time_shift_table = AnnotationBuffer(size, merged_df[ref_dt_col_name])
+        primary_meters = self._to_meters(primary[chunk], primary_valid[chunk], fixed_point)
+        reference_meters = self._to_meters(reference[chunk], reference_valid[chunk], fixed_point)
+        corrected_meters = self._to_meters(corrected[chunk], corrected_valid[chunk], fixed_point)
+        self.segment_log = SegmentLog()
+        for start_index, end_index, try_shift, vert_offset, uncorrected, reach in segments:
+            start_index = max(start_index, chunk_start) - chunk_start
+            end_index = min(end_index, chunk_end) - chunk_start
+            if end_index <= start_index:
+                continue
+
+            func_index = end_index - 1 if end_index >= size else end_index
+            segment = slice(start_index, func_index)
+            if uncorrected:
+                self.segment_log.append(start_index, func_index, uncorrected=True)
+                self.time_shift_table.write_segment(start_index, func_index, None, None, primary_meters[segment],
+                                                    reference_meters[segment], uncorrected=True)
+                continue
+
+            vert_offset = vert_offset / helpers.FIXED_POINT_SCALE if fixed_point else vert_offset
+            self.segment_log.append(start_index, func_index, try_shift, vert_offset)
+            if self.document_corrected_data_entries:
+                self.time_shift_table.write_segment(start_index, func_index, try_shift, vert_offset,
+                                                    corrected_meters[segment], reference_meters[segment])
+            else:
+                self.time_shift_table.write_segment(start_index, func_index, try_shift, vert_offset,
+                                                    primary_meters[segment], reference_meters[segment])
+        # End for.
+        self._extend_summary_df(self.segment_log, merged_df[ref_dt_col_name])
+        self._merge_time_shift_tables(previous_annotations)
+
+        # Return temporally corrected dataframe.
+        corrected_df = merged_df.copy()
+        if fixed_point:
+            corrected_df[primary_col_name] = pd.arrays.IntegerArray(corrected[chunk].astype(np.int32),
+                                                                    ~corrected_valid[chunk])
+        else:
+            corrected_df[primary_col_name] = np.where(corrected_valid[chunk], corrected[chunk], np.nan)
+        return corrected_df
+    # End _vectorized_temporal_deshifter.
+
+    @staticmethod
+    def _get_carry_over_state(row_arrays, segments, carried_segments, index, chunk_end, offset_criteria, max_shift,
+                              fixed_point):
+        # The state holds the index relative to the next chunk where the scan resumes, the corrected segment
+        # it resumes in if any, and the rows it resumes from, which the shifted values and comparisons of the
+        # next chunk start from. The scan resumes at the first index whose segment may be decided differently
+        # in one continuous series, so the state does not depend on where the series is split.
+        total_size = len(row_arrays['primary'])
+
+        # Shifted values are missing for the last max_shift indices, so data read up to final_reach is the same
+        # in one continuous series. An uncorrectable segment is also found from the runs of values that
+        # follow its start, up to (offset_criteria + 1) * (offset_criteria + 2) indices ahead.
+        final_reach = total_size - max_shift
+        margin = (offset_criteria + 1) * (offset_criteria + 2) + max_shift
+
+        # By default the scan resumes where it stopped, in the segment that continues into the next chunk.
+        resume_index = index
+        segment = None
+        if segments and segments[-1][1] > chunk_end:
+            segment = segments[-1][2:5]
+
+        # Walk back over the segments, so the first segment that is not final sets the state.
+        for position in range(len(segments) - 1, -1, -1):
+            start_index, end_index, try_shift, vert_offset, uncorrected, reach = segments[position]
+            is_carried = position < carried_segments
+            if not is_carried and (reach > final_reach or (uncorrected and end_index + margin >= total_size)):
+                # The segment is decided again from its start.
+                resume_index = start_index
+                segment = None
+            elif not uncorrected:
+                # A corrected segment ends at the first index whose corrected value differs from the reference.
+                # Values missing only because their shifted value lies beyond the data may still end it.
+                changing_index = total_size + min(try_shift, 0)
+                if end_index >= total_size or end_index > changing_index:
+                    resume_index = max(start_index, changing_index)
+                    segment = (try_shift, vert_offset, False) if is_carried or resume_index > start_index else None
+        # End for.
+
+        carry_start = max(min(resume_index, chunk_end) - max_shift, 0)
+        return {
+            'rows': {name: values[carry_start:chunk_end].copy() for name, values in row_arrays.items()},
+            'segment': segment,
+            'resume_index': resume_index - chunk_end,
+            'fixed_point': fixed_point
+        }
+    # End _get_carry_over_state.
+
+    @staticmethod
+    def split_carry_over_state(carry_over_state):
+        # Without lookahead, the last rows of a chunk may be corrected differently once the series continues:
+        # the rows from the index where the next chunk resumes the scan. Split the state into the state at the
+        # first of these provisional rows and their number, so the rows can be corrected again with the next
+        # chunk. Every row before them is final.
+        provisional_rows = int(max(-carry_over_state['resume_index'], 0))
+        if not provisional_rows:
+            return carry_over_state, 0
+
+        final_rows = len(carry_over_state['rows']['primary']) - provisional_rows
+        return {
+            'rows': {name: values[:final_rows] for name, values in carry_over_state['rows'].items()},
+            'segment': carry_over_state['segment'],
+            'resume_index': 0,
+            'fixed_point': carry_over_state['fixed_point']
+        }, provisional_rows
+    # End split_carry_over_state.
+
+    @staticmethod
+    def _get_temporal_shifts(max_temporal_shift):
+        # The temporal shifts tried, in order: 0, then the negative and the positive shifts up to
+        # max_temporal_shift intervals, each by increasing size. A temporal shift of 0 or -1 is most likely.
+        shifts = list(range(1, max_temporal_shift + 1))
+        return [0] + [-shift for shift in shifts] + shifts
+    # End _get_temporal_shifts.
+
+    @staticmethod
+    def _get_row_arrays(primary_series, reference_series):
+        primary, primary_valid = TransformData._get_storage_arrays(primary_series)
+        reference, reference_valid = TransformData._get_storage_arrays(reference_series)
+        return {
+            'primary': primary,
+            'primary_valid': primary_valid,
+            'reference': reference,
+            'reference_valid': reference_valid
+        }
+    # End _get_row_arrays.
+
+    @staticmethod
+    def _get_storage_arrays(series):
+        # Return the values of a water level column and a mask of the non-missing values.
+        if helpers.is_fixed_point(series):
+            return series.to_numpy(dtype=np.int64, na_value=0), series.notna().to_numpy()
+
+        values = series.to_numpy(dtype=float)
+        return values, ~np.isnan(values)
+    # End _get_storage_arrays.
+
+    @staticmethod
+    def _to_meters(values, valid, fixed_point):
+        if fixed_point:
+            values = values / helpers.FIXED_POINT_SCALE
+        return np.where(valid, values, np.nan)
+    # End _to_meters.
+
+    @staticmethod
+    def _estimate_lags(primary, primary_valid, reference, reference_valid, window_size, max_lag, candidates):
+        # Propose the temporal shifts to try in each window of window_size indices: the lags of up to max_lag
+        # intervals with the highest normalized cross-correlation of the primary and reference series in the
+        # window, followed by a shift of 0. The series are correlated by their first differences, which
+        # removes the vertical offset and most of the slow tide, so the correlation peaks at the exact lag.
+        # All windows are correlated at once with FFTs, in O(N log N) for any max_lag.
+        size = len(primary)
+        num_windows = -(-size // window_size)
+        if not num_windows:
+            return []
+
+        # Each window of the reference is correlated with the primary from max_lag indices before the window
+        # to max_lag indices after it. Shift s compares reference[i] to primary[i - s].
+        reference_windows = np.zeros(num_windows * window_size)
+        reference_windows[:size] = TransformData._get_first_differences(reference, reference_valid)
+        reference_windows = reference_windows.reshape(num_windows, window_size)
+        padded_primary = np.zeros(num_windows * window_size + 2 * max_lag)
+        padded_primary[max_lag:max_lag + size] = TransformData._get_first_differences(primary, primary_valid)
+        primary_windows = np.lib.stride_tricks.sliding_window_view(
+            padded_primary, window_size + 2 * max_lag)[::window_size]
+
+        # Cross-correlation at every lag, where position m of a window holds the lag max_lag - m. The FFT size
+        # holds the primary window, so the correlations do not wrap around.
+        fft_size = 1 << int(np.ceil(np.log2(window_size + 2 * max_lag)))
+        correlation = np.fft.irfft(np.conj(np.fft.rfft(reference_windows, fft_size)) *
+                                   np.fft.rfft(primary_windows, fft_size), fft_size)[:, :2 * max_lag + 1]
+
+        # Normalize by the energy of the reference window and of the primary values compared at each lag.
+        primary_energy = np.cumsum(np.concatenate((np.zeros((num_windows, 1)), primary_windows ** 2), axis=1),
+                                   axis=1)
+        primary_energy = primary_energy[:, window_size:window_size + 2 * max_lag + 1] - \
+            primary_energy[:, :2 * max_lag + 1]
+        reference_energy = np.sum(reference_windows ** 2, axis=1, keepdims=True)
+        energy = np.sqrt(reference_energy * primary_energy)
+        score = np.divide(correlation, energy, out=np.zeros_like(correlation), where=energy > 0)
+
+        # Rank the lags of each window by score, and the smaller lags first among equal scores.
+        lags = max_lag - np.arange(2 * max_lag + 1)
+        order = np.lexsort((np.abs(lags)[None, :].repeat(num_windows, axis=0), -np.round(score, 9)), axis=1)
+        best_lags = [[int(lag) for lag, lag_score in zip(lags[order[window, :candidates]],
+                                                          score[window, order[window, :candidates]])
+                      if lag_score > 0]
+                     for window in range(num_windows)]
+
+        # A segment that starts in a window may have the lag of the next window, if the lag changes in the
+        # window, so the lags of the next window are tried next.
+        window_shifts = []
+        for window in range(num_windows):
+            shifts = best_lags[window] + (best_lags[window + 1] if window + 1 < num_windows else []) + [0]
+            window_shifts.append(list(dict.fromkeys(shifts)))
+        # End for.
+        return window_shifts
+    # End _estimate_lags.
+
+    @staticmethod
+    def _get_first_differences(values, valid):
+        # Differences of consecutive values, and 0 where either value is missing.
+        differences = np.zeros(len(values))
+        if len(values) > 1:
+            differences[1:] = np.where(valid[1:] & valid[:-1], np.diff(values.astype(float)), 0.0)
+        return differences
+    # End _get_first_differences.
+
+    def _extend_summary_df(self, segment_log, datetimes):
+        if not len(segment_log):
+            return
+
+        summary_df = segment_log.to_summary_df(datetimes)
+        self.shifts_summary_df[0] = self.shifts_summary_df[0].dropna(axis=1, how='all')
+        self.shifts_summary_df[0] = pd.concat([self.shifts_summary_df[0], summary_df], ignore_index=True)
+    # End _extend_summary_df.
+
+    def _merge_time_shift_tables(self, previous_annotations):
+        # Keep the annotations of previous corrections done with this instance.
+        if len(previous_annotations):
+            self.time_shift_table = AnnotationBuffer.concat([previous_annotations, self.time_shift_table])
+    # End _merge_time_shift_tables.
     
-    def _handle_uncorrectable_segment(self, corrected_df, start_index, primary_col_name, df_copy,
+    def _handle_uncorrectable_segment(self, corrected_df, start_index, primary_col_name, merged_df,
                                       offset_criteria, size, insert_nans=True):
+        end_fill_index = self._uncorrectable_segment_end(start_index, offset_criteria, size)
+
+        if insert_nans:
+            corrected_df.loc[start_index:end_fill_index, primary_col_name] = np.nan
+        else:
+            corrected_df.loc[start_index:end_fill_index, primary_col_name] = \
+                merged_df.loc[start_index:end_fill_index, primary_col_name].copy()
+
+        return corrected_df, end_fill_index + 1
+    # End uncorrectable case.
+
+    def _uncorrectable_segment_end(self, start_index, offset_criteria, size):
         # Case I: determine if a run of nans begins.
         # If so, return index where run ends if <= stopping index,
         # else return stopping index.
-        case_one_index, is_nan_run = self._check_nan_runs(df_copy[primary_col_name], start_index,
-                                                          offset_criteria, size)
+        case_one_index, is_nan_run = self.run_index.find_nan_run(start_index)
 
         # Case II: determine if a flat line begins.
         # If so, return index where flat line ends.
-        case_two_index, is_flat_line = self._check_flat_line(df_copy[primary_col_name], start_index,
-                                                             offset_criteria, size)
+        case_two_index, is_flat_line = self.run_index.find_flat_line(start_index)
 
         # Case III: likely that there is some intermediate problem like a duplicate value,
         # or the previous segment was also Case III so an offset exists but is interrupted
@@ -301,61 +747,8 @@ class TransformData:
                 case_three_index = size - 1
             end_fill_index = case_three_index
 
-        if insert_nans:
-            corrected_df.loc[start_index:end_fill_index, primary_col_name] = np.nan
-        else:
-            corrected_df.loc[start_index:end_fill_index, primary_col_name] = \
-                df_copy.loc[start_index:end_fill_index, primary_col_name].copy()
-
-        return corrected_df, end_fill_index + 1
-    # End uncorrectable case.
-
-    def _check_nan_runs(self, series, starting_index, offset_criteria, size):
-        index = starting_index
-        nan_run_found = False
-        valid_value_count = 0
-        while index + offset_criteria < size:
-            if valid_value_count >= offset_criteria:
-                break
-            if pd.isna(series[index]):
-                if not nan_run_found:
-                    if series.loc[index:index + offset_criteria].isna().all():
-                        nan_run_found = True
-            elif nan_run_found:
-                break
-            else:
-                valid_value_count += 1
-            index += 1
-        # End while.
-
-        return index, nan_run_found
-    # End _check_nan_runs.
-
-    def _check_flat_line(self, series, starting_index, offset_criteria, size):
-        index = starting_index
-        valid_value_count = 0
-        flat_line_found = False
-        while index + 1 < size:
-            current_val = series[index]
-            next_val = series[index + 1]
-            if valid_value_count >= offset_criteria and not flat_line_found:
-                break
-            if pd.isna(current_val):
-                index += 1
-                continue
-            if current_val == next_val:
-                if not flat_line_found:
-                    if len(series.loc[index:index + offset_criteria].unique()) == 1:
-                        flat_line_found = True
-            elif flat_line_found:
-                break
-            else:
-                valid_value_count += 1
-            index += 1
-        # End while.
-
-        return index, flat_line_found
-    # End _check_flat_line.
+        return end_fill_index
+    # End _uncorrectable_segment_end.
 
     def _initialize_write_path(self, enable_write, write_path):
         if enable_write and not write_path:
@@ -363,28 +756,40 @@ class TransformData:
             write_path = f"generated_files/correction_reports/temporal_correction_report_{timestamp}.txt"
         return write_path
     
-    def _initialize_dataframes(self, merged_df):
-        return merged_df.copy(), merged_df.copy()
-    
-    def _reset_shift(self, df_copy, merged_df, primary_col_name):
-        df_copy[primary_col_name] = merged_df[primary_col_name].copy()
-        shift_val_index = 0
-        return df_copy, shift_val_index
-    
-    def _apply_temporal_shift(self, df_copy, merged_df, primary_col_name, try_shift):
-        df_copy[primary_col_name] = merged_df[primary_col_name].shift(try_shift)
-        return df_copy
-    
-    def _record_corrected_values(self, df_copy, corrected_df, primary_col_name, ref_col_name,
+    @staticmethod
+    def _pad_primary(series, max_shift):
+        # Pad a water level column with max_shift missing values at both ends.
+        size = len(series)
+        missing = np.ones(size + 2 * max_shift, dtype=bool)
+        missing[max_shift:max_shift + size] = series.isna().to_numpy()
+        if helpers.is_fixed_point(series):
+            values = np.zeros(size + 2 * max_shift, dtype=series.dtype.numpy_dtype)
+            values[max_shift:max_shift + size] = series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0)
+            return pd.arrays.IntegerArray(values, missing)
+
+        values = np.full(size + 2 * max_shift, np.nan)
+        values[max_shift:max_shift + size] = series.to_numpy(dtype=float)
+        return values
+    # End _pad_primary.
+
+    @staticmethod
+    def _shift_view(padded, try_shift, max_shift, index):
+        # Equivalent to series.shift(try_shift), as a view of the padded values.
+        start = max_shift - try_shift
+        return pd.Series(padded[start:start + len(index)], index=index, copy=False)
+    # End _shift_view.
+
+    def _record_corrected_values(self, shifted_primary, reference_series, corrected_df, primary_col_name,
                                  vert_offset, index, size):
+        fixed_point = helpers.is_fixed_point(shifted_primary)
         while index < size:
-            if pd.isna(df_copy[primary_col_name].iloc[index]):
+            if pd.isna(shifted_primary.iloc[index]):
                 corrected_df.loc[index, primary_col_name] = np.nan
-            elif pd.isna(df_copy[ref_col_name].iloc[index]):
-                corrected_df.loc[index, primary_col_name] = df_copy[primary_col_name].iloc[index]
-            elif round(df_copy[primary_col_name].iloc[index] + vert_offset, 4) == round(
-                    df_copy[ref_col_name].iloc[index], 4):
-                corrected_df.loc[index, primary_col_name] = df_copy.loc[index, primary_col_name]
+            elif pd.isna(reference_series.iloc[index]):
+                corrected_df.loc[index, primary_col_name] = shifted_primary.iloc[index]
+            elif self._values_match(shifted_primary.iloc[index] + vert_offset,
+                                    reference_series.iloc[index], fixed_point):
+                corrected_df.loc[index, primary_col_name] = shifted_primary.iloc[index]
             else:
                 break
             index += 1
@@ -392,54 +797,21 @@ class TransformData:
 
     def append_shifts_table(self, start_index, index, try_shift, vert_offset, df, ref_dt_col_name,
                             primary_wl_col_name, ref_wl_col_name, uncorrected=False):
-        if uncorrected:
-            try_shift = 'N/A'
-            # vert_offset = 'N/A'
-
-        func_index = start_index
-        while func_index < index:
-
-            vert_offset_current = vert_offset
-
-            if uncorrected:
-                vert_offset_current = round(df[ref_wl_col_name].iloc[func_index] -
-                                            df[primary_wl_col_name].iloc[func_index], 3)
-
-            if pd.isna(df[ref_wl_col_name].iloc[func_index]) or \
-                    pd.isna(df[primary_wl_col_name].iloc[func_index]):
-                vert_offset_current = 'N/A'
-
-            self.time_shift_table['temporal_shift'].append(try_shift)
-            self.time_shift_table['vertical_offset'].append(vert_offset_current)
-            self.time_shift_table['date_time'].append(df[ref_dt_col_name].iloc[func_index])
-            self.time_shift_table['primary_water_level'].append(str(df[primary_wl_col_name].iloc[func_index]))
-            self.time_shift_table['reference_water_level'].append(df[ref_wl_col_name].iloc[func_index])
-
-            func_index += 1
-
-    def append_summary_df(self, start_index, index, try_shift, vert_offset,
-                          original_df, ref_dt_col_name, uncorrected=False):
-        if uncorrected:
-            try_shift = 'N/A'
-            vert_offset = 'N/A'
-
-        summary_row = pd.DataFrame({
-            'start_date': [original_df[ref_dt_col_name].iloc[start_index]],
-            'end_date': [original_df[ref_dt_col_name].iloc[index]],
-            'duration': [original_df[ref_dt_col_name].iloc[index] -
-                         original_df[ref_dt_col_name].iloc[start_index]],
-            'temporal_shift': [try_shift],
-            'vertical_offset': [vert_offset]
-        })
-        self.shifts_summary_df[0] = self.shifts_summary_df[0].dropna(axis=1, how='all')
-        self.shifts_summary_df[0] = pd.concat([self.shifts_summary_df[0], summary_row], ignore_index=True)
-
-        # return self.shifts_summary_df.copy()
+        # Water levels are written by slice, in meters.
+        primary_values = helpers.from_fixed_point(df[primary_wl_col_name].iloc[start_index:index])
+        reference_values = helpers.from_fixed_point(df[ref_wl_col_name].iloc[start_index:index])
+        self.time_shift_table.write_segment(start_index, index, try_shift, vert_offset,
+                                            primary_values.to_numpy(dtype=float, na_value=np.nan),
+                                            reference_values.to_numpy(dtype=float, na_value=np.nan),
+                                            uncorrected=uncorrected)
+    # End append_shifts_table.
 
     def process_offsets(self, offset_column, reference_column, size, index=0, criteria=10, offset_arr=None):
         if criteria is None:
             criteria = self.config['vertical_offset_correction']['number_of_intervals']
 
+        fixed_point = helpers.is_fixed_point(offset_column)
+
         # index = 0
         while index < size:
             # Skip NaNs.
@@ -464,7 +836,8 @@ class TransformData:
 
             # Correct offset until the correction stops working.
             while index < size:
-                if round(offset_column.iloc[index] + offset, 4) == round(reference_column.iloc[index], 4):
+                if self._values_match(offset_column.iloc[index] + offset, reference_column.iloc[index],
+                                      fixed_point):
                     offset_column.iloc[index] = offset_column.iloc[index] + offset
                     offset_arr.append(offset)
                     index += 1
@@ -485,10 +858,13 @@ class TransformData:
 
         end_reached[0] = False
 
+        # In fixed-point storage mode the values are integers and are compared without rounding.
+        fixed_point = helpers.is_fixed_point(offset_column)
+
         while index < size:
             offset_value = offset_column.iloc[index]
             ref_value = reference_column.iloc[index]
-            difference = round(ref_value - offset_value, 4)
+            difference = self._difference(ref_value, offset_value, fixed_point)
 
             if pd.isna(difference):
                 index += 1
@@ -510,8 +886,9 @@ class TransformData:
                 index += 1
                 continue
 
-            current_diff = round(reference_column.iloc[f_loop + 1] - offset_column.iloc[f_loop + 1], 4)
-            if current_diff != difference:
+            current_diff = self._difference(reference_column.iloc[f_loop + 1], offset_column.iloc[f_loop + 1],
+                                            fixed_point)
+            if pd.isna(current_diff) or current_diff != difference:
                 return np.nan, f_loop
             # Increment index.
             f_loop += 1
@@ -519,6 +896,20 @@ class TransformData:
         return difference, f_loop
     # End identify_offset.
 
+    @staticmethod
+    def _difference(minuend, subtrahend, fixed_point=False):
+        if fixed_point:
+            return minuend - subtrahend
+        return round(minuend - subtrahend, 4)
+    # End _difference.
+
+    @staticmethod
+    def _values_match(value, other_value, fixed_point=False):
+        if fixed_point:
+            return value == other_value
+        return round(value, 4) == round(other_value, 4)
+    # End _values_match.
+
     # ******************************************************************************
     # ***************************** FILE HANDLING **********************************
     # ******************************************************************************
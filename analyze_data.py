@@ -4,6 +4,10 @@ import helpers
 # Import classes.
 from MetricsCalculator import MetricsCalculator
 from TransformData import TransformData
+from AnnotatedDataWriter import AnnotatedDataWriter
+from DataCache import DataCache
+from RunManifest import RunManifest
+from Telemetry import Telemetry
 
 # Imports continued...
 import os
@@ -13,8 +17,9 @@ import pandas as pd
 import numpy as np
 import json
 import logging
-import datetime
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
 def custom_logger(user_level, file):
@@ -52,57 +57,264 @@ def custom_logger(user_level, file):
 # End custom_logger()
 
 
-''' ***********************************************************************************************************
-    ********************************************** PROGRAM START **********************************************
-    *********************************************************************************************************** '''
-def main(args):
-    program_start_time = time.perf_counter()
+def align_year(year, primary_df, ref_df, options, logger=None):
+    # Align the ref and primary data of a year on the regular grid of the year, in one dataframe. Timestamps
+    # that are not on the grid or are repeated are reported to the logger, if given. Returns the dataframe
+    # and the names of its datetime, ref and primary columns.
+    sample_interval = options['sample_interval']
+    datetimes = helpers.get_year_grid(year, sample_interval)
+    aligned_values = {}
+    for source, df in [('reference', ref_df), ('primary', primary_df)]:
+        values, off_grid_count, duplicate_count = helpers.align_to_grid(df.iloc[:, 0], df.iloc[:, 1],
+                                                                        datetimes[0], len(datetimes),
+                                                                        sample_interval)
+        if off_grid_count and logger is not None:
+            logger.warning(f"Year {year}: {off_grid_count} {source} timestamps are not on the "
+                           f"{sample_interval} grid and were ignored")
+        if duplicate_count and logger is not None:
+            logger.warning(f"Year {year}: {duplicate_count} {source} timestamps are repeated; the first value "
+                           f"of each was kept")
+        aligned_values[source] = values
+    # End for.
 
-    # Store loaded configs.
-    config = helpers.load_configs(args.config)
+    # Name the columns as the data files do. Same names are suffixed.
+    ref_pwl_col_name = ref_df.columns[1]
+    primary_pwl_col_name = primary_df.columns[1]
+    if ref_pwl_col_name == primary_pwl_col_name:
+        ref_pwl_col_name = f"{ref_pwl_col_name}_primary"
+        primary_pwl_col_name = f"{primary_pwl_col_name}_reference"
+
+    ref_dt_col_name = 'datetime'
+    merged_df = pd.DataFrame({
+        ref_dt_col_name: datetimes,
+        ref_pwl_col_name: aligned_values['reference'],
+        primary_pwl_col_name: aligned_values['primary']
+    })
+
+    # In fixed-point storage mode, convert the water levels once so they are compared as integers.
+    if options['fixed_point']:
+        merged_df[ref_pwl_col_name] = helpers.to_fixed_point(merged_df[ref_pwl_col_name])
+        merged_df[primary_pwl_col_name] = helpers.to_fixed_point(merged_df[primary_pwl_col_name])
+
+    return merged_df, ref_dt_col_name, ref_pwl_col_name, primary_pwl_col_name
+# End align_year()
+
+
+def process_year(year, year_number, num_years, primary_df, ref_df, config, options, carry_over=None,
+                 next_primary_df=None, next_ref_df=None):
+    # Align, correct and analyze one year of data. Years are independent, so this can run in a worker
+    # process. Per-year reports are written here. In continuous mode, the temporal correction continues
+    # from the carry_over state of the previous year and looks ahead into the data of the next year.
+    logger = logging.getLogger(__name__)
+
+    logger.info(f"Processing year {year_number}/{num_years}")
+    process_year_start_time = time.perf_counter()
+
+    # Get the options shared by all years.
+    do_correction = options['do_correction']
+    include_gaps = options['include_gaps']
+    write_path = options['write_path']
+    filename = options['filename']
+
+    # Results merged into the all-years reports by main, in year order.
+    year_summary = None
+    processed_year_row = None
+    series_data_buffer = None
+    report_files = []
+
+    # State of the temporal correction at the end of the year, for the next year to continue from.
+    carry_over_state = None
+
+    # Per-stage telemetry of this year, merged into the station's telemetry by main.
+    telemetry = Telemetry(filename)
+
+    # Instantiate an objects to get metrics and process offsets. Set configs.
+    calculator = MetricsCalculator(user_config=config)
+    corrector = TransformData(user_config=config)
+
+    # Set documenting the corrected data entries to False so the raw data is reflected.
+    corrector.set_document_corrected_time_shift_series_data(False)
+
+    # Align the ref and primary series on the regular grid of the year. The position of a timestamp
+    # on the grid is its offset from Jan 1 in sample intervals, so no joins are needed.
+    with telemetry.stage('align', year) as stage:
+        merged_df, ref_dt_col_name, ref_pwl_col_name, primary_pwl_col_name = align_year(year, primary_df, ref_df,
+                                                                                        options, logger)
+
+        # In continuous mode, the next year is aligned too, for the temporal correction to look ahead into.
+        lookahead_df = None
+        if next_primary_df is not None:
+            lookahead_df = align_year(year + 1, next_primary_df, next_ref_df, options)[0]
+            lookahead_df.columns = merged_df.columns
 
-    # Configure logger.
-    logging_enabled = args.logging and config['logging']['enabled']
-    logging_level = config['logging']['level']
-    logging_file = config['logging']['file']
-    logger = custom_logger(logging_level, logging_file)
-    if not logging_enabled:
-        logging.disable(logging.CRITICAL)  # Disables all logging.
+        # Get size of merged dataframe.
+        size = len(merged_df)
+        stage['rows'] = size
 
-    logger.info(f"Program started with logging level: {logging_level}")
+    ''' *******************************************************************************************************
+        ********************************************* TEMPORAL CORRECTION *************************************
+        ******************************************************************************************************* '''
+    if do_correction:
+        initial_nan_percentage = (len(merged_df[merged_df[primary_pwl_col_name].isna()]) / size) * 100
 
-    # Get program configurations: allow config to be overridden by cmdl args.
-    # Get data paths.
-    config_refdir = config['data']['paths']['refdir']
-    config_primarydir = config['data']['paths']['primarydir']
-    args_flag_ptr = [True]
-    paths = helpers.get_data_paths(args, config_refdir, config_primarydir, flag=args_flag_ptr)
+        correction_start_time = time.perf_counter()
+        logger.info(f"Temporal correction for year ({year_number}) start")
 
-    # Get output configurations.
-    config_filename = config['output']['base_filename']
-    filename = helpers.get_filename(args, config_filename)
-    config_path = config['output']['path']
-    write_path = helpers.get_output_path(args, config_path)
-    if not os.path.exists(write_path):
-        os.makedirs(write_path)
+        with telemetry.stage('temporal_correction', year, rows=size):
+            corrected_df = merged_df.copy()
+            corrected_df = corrector.temporal_shift_corrector(corrected_df,
+                                                              carry_over=carry_over,
+                                                              lookahead_df=lookahead_df,
+                                                              primary_data_column_name=primary_pwl_col_name,
+                                                              reference_data_column_name=ref_pwl_col_name,
+                                                              datetime_column_name=ref_dt_col_name)
+            if options['continue_across_years']:
+                carry_over_state = corrector.get_carry_over_state()
+
+        correction_end_time = time.perf_counter()
+        correction_duration = correction_end_time - correction_start_time
+        logger.info(f"Temporal correction algorithm for year ({year_number}) finished in "
+                    f"{correction_duration:.2f} seconds")
+
+        # If doing analysis on corrected data, update merged_df with corrected_df.
+        merged_df = corrected_df
+
+        final_nan_percentage = (len(corrected_df[corrected_df[primary_pwl_col_name].isna()]) / size) * 100
+
+        # Get the annotated raw series data for current year, written to its own file once the year is processed.
+        # The corresponding time and vertical offsets per data point are also listed.
+        series_data_annotated_current_year = corrector.get_time_shift_table()
+        if year in options['annotated_raw_data_years']:
+            series_data_buffer = series_data_annotated_current_year
+
+        # Get time-shifted percentage and error.
+        # Gets the time shifted data points that are not N/A or 0.
+        num_time_shifted = series_data_annotated_current_year.count_time_shifted()
+        percent_time_shifted = num_time_shifted / len(series_data_annotated_current_year) * 100
+
+        error = series_data_annotated_current_year.count_uncorrectable()
+        error_percent = error / len(series_data_annotated_current_year) * 100
+
+        # Add to all-years summary dataframe.
+        shifts_summary_df = corrector.get_shifts_summary_df()[0]
+        if year in options['temp_corr_summary_years']:
+            processed_year_row = pd.DataFrame({
+                'Year': [year],
+                'Temporal shifts': [shifts_summary_df['temporal_shift'].unique().tolist()],
+                'Vertical offsets': [shifts_summary_df['vertical_offset'].unique().tolist()],
+                'Time-shifted data %': [round(percent_time_shifted, 4)],
+                'Positive error %': [round(error_percent, 4)],
+                'Initial NaN %': [round(initial_nan_percentage, 4)],
+                'Final NaN %': [round(final_nan_percentage, 4)],
+                'Increased NaN %': [round(final_nan_percentage - initial_nan_percentage, 4)]
+            })
+    # End if(do_correction).
+
+    # Get comparison table.
+    with telemetry.stage('comparison_stats', year, rows=size):
+        stats_df = MetricsCalculator.get_comparison_stats(merged_df[primary_pwl_col_name],
+                                                          merged_df[ref_pwl_col_name], size)
 
-    # Get mode of analysis.
-    analysis = args.mode if args.mode else config['analysis']['mode']
-    do_correction = True if analysis == "corrected" else False
+    # Add gap_interrupts_vertical_offsets bool to config.
+    # If mode == 'raw' do not run temporal correction algorithm.
+    # Add to metrics calculator, parameter to generate runs df including gaps as part of a VA.
+
+    # Get offset runs dataframe.
+    with telemetry.stage('runs', year, rows=size):
+        run_data_df = calculator.generate_runs_df(merged_df[primary_pwl_col_name],
+                                                  merged_df[ref_pwl_col_name],
+                                                  merged_df[ref_dt_col_name], size,
+                                                  gaps_are_interruptions=include_gaps)
+        calculator.set_runs_dataframe(run_data_df)
 
-    # Get whether to include gaps in runs of vertical offsets, or treat independently.
-    include_gaps = config['analysis']['gaps_are_interruptions']
+    # Set column names in calculator to match those in shifts_summary_df from TransformData.
+    # calculator.set_column_names(shifts_summary_df.columns[2], shifts_summary_df.columns[4],
+    #                             shifts_summary_df.columns[0], shifts_summary_df.columns[1])
 
-    # Check that get_data_paths succeeded.
-    if args_flag_ptr[0] is True:
-        ref_path = paths[0]
-        primary_path = paths[1]
+    # Set the dataframe in calculator so metrics can be calculated.
+    # Using shifts_summary_df from TransformDate is preferable to using runs_df from MetricsCalculator because
+    # the latter assumes gaps are interruptions to vertical offsets while the former does not.
+    # shifts_summary_df.replace('N/A', np.nan, inplace=True)
+    # calculator.set_runs_dataframe(shifts_summary_df)
+
+    # Calculate metrics.
+    with telemetry.stage('metrics', year, rows=len(run_data_df)):
+        metrics = calculator.calculate_metrics()
+
+        # Get table of offsets filtered by duration.
+        offsets_duration_filtered_df = calculator.generate_duration_filtered_offsets_info()
+
+        # Get table of offsets filtered by value.
+        offsets_value_filtered_df = calculator.generate_value_filtered_offsets_info()
+
+    # Append year info to metrics summary.
+    if not do_correction:
+        percent_time_shifted_rounded = 'N/A'
+        error_percent_rounded = 'N/A'
     else:
-        print("args_flag_ptr is False. Data paths not entered, "
-              "or paths do not exist. Exiting program.")
-        sys.exit()
+        percent_time_shifted_rounded = round(percent_time_shifted, 2)
+        error_percent_rounded = round(error_percent, 2)
+    if year in options['metrics_summary_years']:
+        year_summary = {
+            "% agree": stats_df.loc['total agreements', 'percent'],
+            "% values disagree": stats_df.loc['value disagreements', 'percent'],
+            "% missing": stats_df.loc['missing (primary)', 'percent'],
+            "% total disagree": stats_df.loc['total disagreements', 'percent'],
+            "% time-shifted": f'{percent_time_shifted_rounded} (+{error_percent_rounded})',
+            "# DSs (FBD)": metrics['duration_filtered_offsets_count'],
+            "# gaps (FBD)": metrics['duration_filtered_gaps_count'],
+            "DSs list (FBD)": list(offsets_duration_filtered_df['offset'].unique()),
+            "# DSs (FBV)": metrics['value_filtered_offsets_count'],
+            "min DS": metrics['min_max_offsets'][1],
+            "max DS": metrics['min_max_offsets'][0]
+        }
+
+    # Write vertical offsets info (FBD) report.
+    # reorder_columns = [shifts_summary_df.columns[4], shifts_summary_df.columns[0], shifts_summary_df.columns[1],
+    #                    shifts_summary_df.columns[2]]
+    with telemetry.stage('writes', year) as stage:
+        if year in options['vert_offset_info_duration_filtered_years']:
+            # offsets_duration_filtered_df = offsets_duration_filtered_df[reorder_columns]  # Automatically drops the
+            # temporal_shift column from shifts_summary_df.
+            # offsets_duration_filtered_df.rename(columns={"vertical_offset": "vertical offset", "start_date": "start "
+            #                                              "date", "end_date": "end date"}, inplace=True)
+            report_file = f"{write_path}/{filename}_{year}_vertical_offset_info_duration_filtered.csv"
+            offsets_duration_filtered_df.to_csv(report_file, index=False)
+            report_files.append(report_file)
+            stage['rows'] += len(offsets_duration_filtered_df)
+
+        # Write vertical offsets info (FBV) report.
+        if year in options['vert_offset_info_value_filtered_years']:
+            # offsets_value_filtered_df = offsets_value_filtered_df[reorder_columns]
+            # offsets_value_filtered_df.rename(columns={"vertical_offset": "vertical offset", "start_date": "start "
+            #                                           "date", "end_date": "end date"}, inplace=True)
+            report_file = f"{write_path}/{filename}_{year}_vertical_offset_info_value_filtered.csv"
+            offsets_value_filtered_df.to_csv(report_file, index=False)
+            report_files.append(report_file)
+            stage['rows'] += len(offsets_value_filtered_df)
+
+    process_year_end_time = time.perf_counter()
+    process_year_duration = process_year_end_time - process_year_start_time
+    logger.info(f"Year ({year_number}) processed in {process_year_duration:.2f} seconds")
+
+    return {
+        'summary': year_summary,
+        'processed_year_row': processed_year_row,
+        'series_data_buffer': series_data_buffer,
+        'report_files': report_files,
+        'carry_over': carry_over_state,
+        'telemetry': telemetry.get_records()
+    }
+# End process_year()
 
-    logger.info("Program configured")
+
+def prepare_station(config, ref_path, primary_path, write_path, filename, analysis, years=None, run_manifest=None,
+                    streaming=False):
+    # Read the data files of a station pair, and get the common years to process and the options
+    # shared by all of them. If a run manifest is given, the years that have not changed since the
+    # last run are not read; their stored results are reused instead. In streaming mode, no data
+    # files are read here; stream_years reads each year's files when the year is processed.
+    logger = logging.getLogger(__name__)
 
     # Get all csv files from primary path.
     primary_csv_files = glob.glob(f"{primary_path}/*.csv")
@@ -110,35 +322,15 @@ def main(args):
     # Get all csv files from ref path.
     ref_csv_files = glob.glob(f"{ref_path}/*.csv")
 
-    # Read primary files into dataframes.
-    primary_df_arr = []
-    for primary_file in primary_csv_files:
-        column_names = pd.read_csv(primary_file, nrows=0).columns.tolist()
-        df = pd.read_csv(primary_file, parse_dates=[column_names[0]])
-        primary_df_arr.append(df)
-    # End for.
-
-    # Read ref files into dataframes.
-    ref_df_arr = []
-    for ref_file in ref_csv_files:
-        column_names = pd.read_csv(ref_file, nrows=0).columns.tolist()
-        df = pd.read_csv(ref_file, parse_dates=[column_names[0]])
-        ref_df_arr.append(df)
-    # End for.
-
-    logger.info("Data files read into dataframes")
-
-    # Assume position of datetime columns.
-    primary_dt_col_pos = 0
-    ref_dt_col_pos = 0
+    # Index the primary and ref files by year. Only the first row of each file is read here.
+    primary_file_index = helpers.get_data_file_index(primary_csv_files)
+    ref_file_index = helpers.get_data_file_index(ref_csv_files)
 
     # Make sure only common years are compared in the analysis.
-    primary_dfs_dict = helpers.get_df_dictionary(primary_df_arr, primary_dt_col_pos)
-    ref_dfs_dict = helpers.get_df_dictionary(ref_df_arr, ref_dt_col_pos)
-    common_years = set(primary_dfs_dict.keys()) & set(ref_dfs_dict.keys())
+    common_years = set(primary_file_index.keys()) & set(ref_file_index.keys())
 
     # Modify common_years to only include years from configurations.
-    config_years = set(args.years) if args.years else set(config['analysis']['years'])
+    config_years = set(years) if years else set(config['analysis']['years'])
 
     if "all_years" in config_years:
         config_years.remove("all_years")
@@ -161,214 +353,389 @@ def main(args):
     annotated_raw_data_years = common_years if config_report_years['annotated_raw_data'] == ['all_years'] \
         else config_report_years['annotated_raw_data']
 
-    # Process the dataframes of common years to get statistics.
+    # Options shared by all years.
+    do_correction = True if analysis == "corrected" else False
+    options = {
+        'do_correction': do_correction,
+        'continue_across_years': do_correction and config['temporal_shift_correction'].get('continue_across_years',
+                                                                                              False),
+        'include_gaps': config['analysis']['gaps_are_interruptions'],
+        'fixed_point': config['analysis'].get('fixed_point', False),
+        'sample_interval': config['analysis'].get('sample_interval', helpers.DATA_SAMPLE_INTERVAL),
+        'write_path': write_path,
+        'filename': filename,
+        'metrics_summary_years': metrics_summary_years,
+        'vert_offset_info_duration_filtered_years': vert_offset_info_duration_filtered_years,
+        'vert_offset_info_value_filtered_years': vert_offset_info_value_filtered_years,
+        'temp_corr_summary_years': temp_corr_summary_years,
+        'annotated_raw_data_years': annotated_raw_data_years
+    }
+
+    # Find the years whose input files and configurations match the last run.
+    year_hashes = {}
+    reused_results = {}
+    if run_manifest is not None:
+        for year in common_years:
+            files = [ref_file_index[year], primary_file_index[year]]
+            previous_hash = None
+            if options['continue_across_years']:
+                # A continuous year also depends on the next year, which it looks ahead into, and on the years
+                # before it, through the state its temporal correction continues from.
+                if year + 1 in common_years:
+                    files += [ref_file_index[year + 1], primary_file_index[year + 1]]
+                previous_hash = year_hashes.get(year - 1)
+            year_hashes[year] = run_manifest.get_year_hash(year, files, config, options, previous_hash)
+            year_result = run_manifest.get_year_result(year, year_hashes[year])
+            if year_result is not None:
+                reused_results[year] = year_result
+        # End for.
+        logger.info(f"Reusing the results of unchanged years {sorted(reused_results)}")
+    process_years = [year for year in common_years if year not in reused_results]
+
+    # In continuous mode, the next year of each year to process is read too, to look ahead into.
+    load_years = process_years
+    if options['continue_across_years']:
+        load_years = sorted(set(process_years) | {year + 1 for year in process_years if year + 1 in common_years})
+    primary_files = {year: primary_file_index[year] for year in load_years}
+    ref_files = {year: ref_file_index[year] for year in load_years}
+
+    # Read the files of the years to process into dataframes, in one pass per file.
+    telemetry = Telemetry(filename)
+    primary_dfs_dict = {}
+    ref_dfs_dict = {}
+    if not streaming:
+        with telemetry.stage('load') as stage:
+            primary_df_arr = helpers.read_data_files(list(primary_files.values()))
+            ref_df_arr = helpers.read_data_files(list(ref_files.values()))
+            primary_dfs_dict = dict(zip(load_years, primary_df_arr))
+            ref_dfs_dict = dict(zip(load_years, ref_df_arr))
+            stage['rows'] = sum(len(df) for df in primary_df_arr + ref_df_arr)
+
+        logger.info(f"Data files of years {load_years} read into dataframes")
+
+    return {
+        'common_years': common_years,
+        'process_years': process_years,
+        'primary_files': primary_files,
+        'ref_files': ref_files,
+        'primary_dfs_dict': primary_dfs_dict,
+        'ref_dfs_dict': ref_dfs_dict,
+        'options': options,
+        'year_hashes': year_hashes,
+        'reused_results': reused_results,
+        'telemetry': telemetry
+    }
+# End prepare_station()
+
+
+def configure_data_cache(config):
+    cache_config = config['data'].get('cache', {})
+    if cache_config.get('enabled', False):
+        helpers.set_data_cache(DataCache(cache_config['path'], cache_config['max_size_mb'] * 1024 ** 2))
+# End configure_data_cache()
+
+
+def get_year_args(config, station):
+    # Get the arguments of process_year for each year of a station to process, in year order.
+    process_years = station['process_years']
+    num_years = len(process_years)
+    return [(year, year_number, num_years, station['primary_dfs_dict'][year], station['ref_dfs_dict'][year],
+             config, station['options'])
+            for year_number, year in enumerate(process_years, start=1)]
+# End get_year_args()
+
+
+def submit_annotated_data(annotated_data_writer, station, year, year_result):
+    # Hand the annotated raw data of a processed year to the writer thread, and release it from the
+    # year's result. The file is listed with the year's reports.
+    if year_result['series_data_buffer'] is None:
+        return
+
+    options = station['options']
+    file_path = annotated_data_writer.get_file_path(options['write_path'], options['filename'], year)
+    annotated_data_writer.submit(file_path, year_result['series_data_buffer'], station['telemetry'], year)
+    year_result['report_files'].append(file_path)
+    year_result['series_data_buffer'] = None
+# End submit_annotated_data()
+
+
+def run_years(station, year_args, workers, annotated_data_writer):
+    # Process the years of a station, in a pool of worker processes if requested. Each year's annotated
+    # raw data is written as soon as the year is processed. Results come back in year order.
+    year_results = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for year, year_result in zip(station['process_years'], executor.map(process_year, *zip(*year_args))):
+                submit_annotated_data(annotated_data_writer, station, year, year_result)
+                year_results.append(year_result)
+    else:
+        for year, year_arg in zip(station['process_years'], year_args):
+            year_result = process_year(*year_arg)
+            submit_annotated_data(annotated_data_writer, station, year, year_result)
+            year_results.append(year_result)
+    # End if.
+
+    return year_results
+# End run_years()
+
+
+def read_year_data(station, year):
+    # Read the primary and ref data files of one year of a station prepared in streaming mode.
+    with station['telemetry'].stage('load', year) as stage:
+        primary_df = helpers.read_data_file(station['primary_files'][year])
+        ref_df = helpers.read_data_file(station['ref_files'][year])
+        stage['rows'] = len(primary_df) + len(ref_df)
+    return primary_df, ref_df
+# End read_year_data()
+
+
+def stream_years(config, station, workers, annotated_data_writer, lookahead_years):
+    # Process the years of a station prepared in streaming mode, holding the data of at most the years
+    # being processed plus lookahead_years in memory. The files of the next years are read on a
+    # background thread while the current years are processed, and a year's data is released as soon
+    # as its result is back. Results come back in year order.
+    process_years = station['process_years']
+    num_years = len(process_years)
+    max_years_in_memory = workers + lookahead_years
+    year_results = []
+
+    reads = deque()  # (year, year_number, future) of the years being read.
+    runs = deque()  # (year, future) of the years being processed by the workers.
+    next_year_index = 0
+    reader = ThreadPoolExecutor(max_workers=1)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while next_year_index < num_years or reads or runs:
+            # Read ahead, up to the number of years that may be held in memory.
+            while next_year_index < num_years and len(reads) + len(runs) < max_years_in_memory:
+                year = process_years[next_year_index]
+                next_year_index += 1
+                reads.append((year, next_year_index, reader.submit(read_year_data, station, year)))
+            # End while.
+
+            # Start the next year if a worker is free.
+            if reads and len(runs) < workers:
+                year, year_number, read = reads.popleft()
+                year_arg = (year, year_number, num_years, *read.result(), config, station['options'])
+                if executor is None:
+                    year_result = process_year(*year_arg)
+                    submit_annotated_data(annotated_data_writer, station, year, year_result)
+                    year_results.append(year_result)
+                else:
+                    runs.append((year, executor.submit(process_year, *year_arg)))
+                # Release this process's references to the year's data.
+                del read, year_arg
+                continue
+
+            # Otherwise wait for the oldest year being processed.
+            year, run = runs.popleft()
+            year_result = run.result()
+            submit_annotated_data(annotated_data_writer, station, year, year_result)
+            year_results.append(year_result)
+            del run
+        # End while.
+    finally:
+        reader.shutdown(cancel_futures=True)
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    return year_results
+# End stream_years()
+
+
+def iter_years_in_order(config, station, streaming=False):
+    # Process the years of a station one at a time and in order, for temporal correction that continues
+    # across years: each year continues from the state the previous year ended with, and looks ahead into
+    # the next year. Yields the year and its result as each year is processed. In streaming mode, the data
+    # of at most the current and the next year is held in memory.
+    process_years = station['process_years']
+    num_years = len(process_years)
+    year_data = {}
+    carry_overs = {year: year_result.get('carry_over') for year, year_result in station['reused_results'].items()}
+
+    def get_year_data(data_year):
+        if not streaming:
+            return station['primary_dfs_dict'][data_year], station['ref_dfs_dict'][data_year]
+        if data_year not in year_data:
+            year_data[data_year] = read_year_data(station, data_year)
+        return year_data[data_year]
+
+    for year_number, year in enumerate(process_years, start=1):
+        # Release the data of the years before this one.
+        for data_year in [data_year for data_year in year_data if data_year < year]:
+            del year_data[data_year]
+
+        primary_df, ref_df = get_year_data(year)
+        next_primary_df, next_ref_df = None, None
+        if year + 1 in station['primary_files']:
+            next_primary_df, next_ref_df = get_year_data(year + 1)
+
+        year_result = process_year(year, year_number, num_years, primary_df, ref_df, config, station['options'],
+                                   carry_overs.get(year - 1), next_primary_df, next_ref_df)
+        carry_overs[year] = year_result['carry_over']
+        yield year, year_result
+    # End for.
+# End iter_years_in_order()
+
+
+def write_results(config, station, year_results):
+    # Merge the results of each year, in year order, and write the all-years reports.
+    options = station['options']
+    do_correction = options['do_correction']
+    write_path = options['write_path']
+    filename = options['filename']
+    telemetry = station['telemetry']
+
     # Initialize summary and temporal offsets summary dataframe.
     summary = {}
     all_processed_years_df = pd.DataFrame(columns=['Year', 'Temporal shifts', 'Vertical offsets', 'Time-shifted data %',
                                                    'Positive error %', 'Initial NaN %', 'Final NaN %',
                                                    'Increased NaN %'])
 
-    # Initialize series data dictionary. This will be concat-ed for every year in for loop.
-    getXformDataDict = TransformData()
-    series_data_concat_dict = getXformDataDict.get_time_shift_table()
+    for year, year_result in zip(station['common_years'], year_results):
+        if year_result['processed_year_row'] is not None:
+            all_processed_years_df = all_processed_years_df.dropna(axis=1, how='all')
+            all_processed_years_df = pd.concat([all_processed_years_df, year_result['processed_year_row']],
+                                               ignore_index=True)
 
-    ''' ***********************************************************************************************************
-        ********************************************* PROCESSING LOOP *********************************************
-        *********************************************************************************************************** '''
-    logger.info("Processing loop start")
-    processing_loop_start_time = time.perf_counter()
-    for year in common_years:
-        logger.info(f"Processing year {common_years.index(year) + 1}/{len(common_years)}")
-        process_year_start_time = time.perf_counter()
-
-        # Instantiate an objects to get metrics and process offsets. Set configs.
-        calculator = MetricsCalculator(user_config=config)
-        corrector = TransformData(user_config=config)
-
-        # Set documenting the corrected data entries to False so the raw data is reflected.
-        corrector.set_document_corrected_time_shift_series_data(False)
-
-        # Assign dataframes from dictionaries.
-        primary_df = primary_dfs_dict[year]
-        ref_df = ref_dfs_dict[year]
-
-        # Drop unrelated columns.
-        primary_col_names = primary_df.columns[0], primary_df.columns[1]
-        ref_col_names = ref_df.columns[0], ref_df.columns[1]
-        for col in primary_df.columns:
-            if col not in primary_col_names:
-                primary_df.drop(columns=col, inplace=True)
-        for col in ref_df.columns:
-            if col not in ref_col_names:
-                ref_df.drop(columns=col, inplace=True)
-
-        # To merge the ref and primary dfs, do two left joins on the expected datetimes.
-        # Create the datetime column manually.
-        datetimes_list = pd.date_range(
-            start=datetime.datetime(year=year, month=1, day=1),
-            end=datetime.datetime(year=year, month=12, day=31, hour=23, minute=54),
-            freq=datetime.timedelta(minutes=6)  # Frequency of 6 minutes
-        ).tolist()
-        datetimes_col = pd.DataFrame({'datetime': datetimes_list})
-
-        # Do the left joins.
-        datetimes_col.set_index('datetime', inplace=True)
-        primary_df.set_index(primary_col_names[0], inplace=True)
-        ref_df.set_index(ref_col_names[0], inplace=True)
-
-        merged_df = datetimes_col.join(ref_df, how='left')
-        merged_df = merged_df.join(primary_df, how='left', lsuffix='_primary', rsuffix='_reference')
-
-        # Reset the index to get datetime column back as a regular column.
-        merged_df.reset_index(inplace=True)
-
-        # Reassign columns.
-        ref_dt_col_name = merged_df.columns[0]
-        ref_pwl_col_name = merged_df.columns[1]
-        primary_pwl_col_name = merged_df.columns[2]
-
-        # Get size of merged dataframe.
-        size = len(merged_df)
+        if year_result['summary'] is not None:
+            summary[year] = year_result['summary']
+    # End for.
 
-        ''' *******************************************************************************************************
-            ********************************************* TEMPORAL CORRECTION *************************************
-            ******************************************************************************************************* '''
+    with telemetry.stage('writes') as stage:
+        # Write configs to file.
+        with open(f'{write_path}/{filename}_configs.txt', 'w') as file:
+            file.write(f"Configurations: {json.dumps(config, indent=4)}")
+
+        # Write summary file.
+        metrics_config = {
+            "analysis_mode": config['analysis']['mode'],
+            "filter_offsets_by_duration": config["filter_offsets_by_duration"],
+            "filter_offsets_by_value": config["filter_offsets_by_value"],
+            "filter_gaps_by_duration": config['filter_gaps_by_duration'],
+            "temporal_shift_correction": config["temporal_shift_correction"]
+        }
+        if options['metrics_summary_years']:
+            with open(f'{write_path}/{filename}_metrics_summary.txt', 'w') as file:
+                file.write(f"Configurations: {json.dumps(metrics_config, indent=4)}\n\n")
+                file.write(f"% agree: Percentage of values that agree between datasets.\n"
+                           f"% values disagree: Percentage of values that disagree (excluding NaNs) between datasets.\n"
+                           f"% missing: Percentage of the primary data that is missing (NaN).\n"
+                           f"% total disagree: Percentage of data that disagrees (including NaNs) between datasets.\n"
+                           f"% time-shifted: Percentage of data (with positive error) that is time-shifted.\n"
+                           f"# VOs (FBD): Number of vertical offsets (filtered by duration).\n"
+                           f"# gaps (FBD): Number of gaps (filtered by duration).\n"
+                           f"VOs list (FBD): List of unique vertical offset values (filtered by duration).\n"
+                           f"# VOs (FBV): Number of vertical offsets (filtered by value).\n"
+                           f"min VO: Minimum vertical offset value.\n"
+                           f"max VO: Maximum vertical offset value.\n\n")
+            helpers.write_table_from_nested_dict(summary, 'Year',
+                                                 f'{write_path}/{filename}_metrics_summary.txt')
+            stage['rows'] += len(summary)
+
+        # Write temporal offset correction summary for all years.
         if do_correction:
-            initial_nan_percentage = (len(merged_df[merged_df[primary_pwl_col_name].isna()]) / size) * 100
+            if options['temp_corr_summary_years']:
+                all_processed_years_df.to_csv(f"{write_path}/{filename}_temporal_shifts_summary.csv", index=False)
+                stage['rows'] += len(all_processed_years_df)
 
-            correction_start_time = time.perf_counter()
-            logger.info(f"Temporal correction for year ({common_years.index(year) + 1}) start")
+    # Export the telemetry of the stages of this run, if enabled.
+    if config['output'].get('telemetry', False):
+        telemetry.write_jsonl(f'{write_path}/{filename}_telemetry.jsonl')
+        telemetry.write_prometheus(f'{write_path}/{filename}_telemetry.prom')
+# End write_results()
 
-            corrected_df = merged_df.copy()
-            corrected_df = corrector.temporal_shift_corrector(corrected_df,
-                                                              primary_data_column_name=primary_pwl_col_name,
-                                                              reference_data_column_name=ref_pwl_col_name,
-                                                              datetime_column_name=ref_dt_col_name)
 
-            correction_end_time = time.perf_counter()
-            correction_duration = correction_end_time - correction_start_time
-            logger.info(f"Temporal correction algorithm for year ({common_years.index(year) + 1}) finished in "
-                        f"{correction_duration:.2f} seconds")
-
-            # If doing analysis on corrected data, update merged_df with corrected_df.
-            merged_df = corrected_df
-
-            final_nan_percentage = (len(corrected_df[corrected_df[primary_pwl_col_name].isna()]) / size) * 100
-
-            # Get the annotated raw series data for current year, concat each year in common years, the corresponding
-            # time and vertical offsets per data point are also listed.
-            series_data_annotated_current_year = corrector.get_time_shift_table()
-            if year in annotated_raw_data_years:
-                # Concats the current year dict and all-years dict by extending the values for each dict key.
-                series_data_concat_dict = \
-                    {key: series_data_concat_dict[key] + series_data_annotated_current_year[key] for key in
-                     series_data_concat_dict}
-
-            # Get time-shifted percentage and error.
-            series_data_df = pd.DataFrame(series_data_annotated_current_year)
-            # Gets the time shifted cells that are not N/A or 0.
-            num_time_shifted = (~series_data_df['temporal_shift'].isin(['N/A', 0])).sum()
-            percent_time_shifted = num_time_shifted / len(series_data_df) * 100
-
-            error = (series_data_df['temporal_shift'] == 'N/A').sum()
-            error_percent = error / len(series_data_df) * 100
-
-            # Add to all-years summary dataframe.
-            shifts_summary_df = corrector.get_shifts_summary_df()[0]
-            if year in temp_corr_summary_years:
-                processed_year_row = pd.DataFrame({
-                    'Year': [year],
-                    'Temporal shifts': [shifts_summary_df['temporal_shift'].unique().tolist()],
-                    'Vertical offsets': [shifts_summary_df['vertical_offset'].unique().tolist()],
-                    'Time-shifted data %': [round(percent_time_shifted, 4)],
-                    'Positive error %': [round(error_percent, 4)],
-                    'Initial NaN %': [round(initial_nan_percentage, 4)],
-                    'Final NaN %': [round(final_nan_percentage, 4)],
-                    'Increased NaN %': [round(final_nan_percentage - initial_nan_percentage, 4)]
-                })
-                all_processed_years_df = all_processed_years_df.dropna(axis=1, how='all')
-                all_processed_years_df = pd.concat([all_processed_years_df, processed_year_row],
-                                                   ignore_index=True)
-        # End if(do_correction).
-
-        # Get comparison table.
-        stats_df = MetricsCalculator.get_comparison_stats(merged_df[primary_pwl_col_name],
-                                                          merged_df[ref_pwl_col_name], size)
+''' ***********************************************************************************************************
+    ********************************************** PROGRAM START **********************************************
+    *********************************************************************************************************** '''
+def main(args):
+    program_start_time = time.perf_counter()
 
-        # Add gap_interrupts_vertical_offsets bool to config.
-        # If mode == 'raw' do not run temporal correction algorithm.
-        # Add to metrics calculator, parameter to generate runs df including gaps as part of a VA.
+    # Store loaded configs.
+    config = helpers.load_configs(args.config)
 
-        # Get offset runs dataframe.
-        run_data_df = calculator.generate_runs_df(merged_df[primary_pwl_col_name],
-                                                  merged_df[ref_pwl_col_name],
-                                                  merged_df[ref_dt_col_name], size,
-                                                  gaps_are_interruptions=include_gaps)
-        calculator.set_runs_dataframe(run_data_df)
+    # Configure logger.
+    logging_enabled = args.logging and config['logging']['enabled']
+    logging_level = config['logging']['level']
+    logging_file = config['logging']['file']
+    logger = custom_logger(logging_level, logging_file)
+    if not logging_enabled:
+        logging.disable(logging.CRITICAL)  # Disables all logging.
 
-        # Set column names in calculator to match those in shifts_summary_df from TransformData.
-        # calculator.set_column_names(shifts_summary_df.columns[2], shifts_summary_df.columns[4],
-        #                             shifts_summary_df.columns[0], shifts_summary_df.columns[1])
+    logger.info(f"Program started with logging level: {logging_level}")
 
-        # Set the dataframe in calculator so metrics can be calculated.
-        # Using shifts_summary_df from TransformDate is preferable to using runs_df from MetricsCalculator because
-        # the latter assumes gaps are interruptions to vertical offsets while the former does not.
-        # shifts_summary_df.replace('N/A', np.nan, inplace=True)
-        # calculator.set_runs_dataframe(shifts_summary_df)
+    # Get program configurations: allow config to be overridden by cmdl args.
+    # Get data paths.
+    config_refdir = config['data']['paths']['refdir']
+    config_primarydir = config['data']['paths']['primarydir']
+    args_flag_ptr = [True]
+    paths = helpers.get_data_paths(args, config_refdir, config_primarydir, flag=args_flag_ptr)
 
-        # Calculate metrics.
-        metrics = calculator.calculate_metrics()
+    # Get output configurations.
+    config_filename = config['output']['base_filename']
+    filename = helpers.get_filename(args, config_filename)
+    config_path = config['output']['path']
+    write_path = helpers.get_output_path(args, config_path)
+    if not os.path.exists(write_path):
+        os.makedirs(write_path)
 
-        # Get table of offsets filtered by duration.
-        offsets_duration_filtered_df = calculator.generate_duration_filtered_offsets_info()
+    # Get mode of analysis.
+    analysis = args.mode if args.mode else config['analysis']['mode']
 
-        # Get table of offsets filtered by value.
-        offsets_value_filtered_df = calculator.generate_value_filtered_offsets_info()
+    # Get number of worker processes to process years with.
+    workers = args.workers
 
-        # Append year info to metrics summary.
-        if not do_correction:
-            percent_time_shifted_rounded = 'N/A'
-            error_percent_rounded = 'N/A'
-        else:
-            percent_time_shifted_rounded = round(percent_time_shifted, 2)
-            error_percent_rounded = round(error_percent, 2)
-        if year in metrics_summary_years:
-            summary[year] = {
-                "% agree": stats_df.loc['total agreements', 'percent'],
-                "% values disagree": stats_df.loc['value disagreements', 'percent'],
-                "% missing": stats_df.loc['missing (primary)', 'percent'],
-                "% total disagree": stats_df.loc['total disagreements', 'percent'],
-                "% time-shifted": f'{percent_time_shifted_rounded} (+{error_percent_rounded})',
-                "# DSs (FBD)": metrics['duration_filtered_offsets_count'],
-                "# gaps (FBD)": metrics['duration_filtered_gaps_count'],
-                "DSs list (FBD)": list(offsets_duration_filtered_df['offset'].unique()),
-                "# DSs (FBV)": metrics['value_filtered_offsets_count'],
-                "min DS": metrics['min_max_offsets'][1],
-                "max DS": metrics['min_max_offsets'][0]
-            }
-
-        # Write vertical offsets info (FBD) report.
-        # reorder_columns = [shifts_summary_df.columns[4], shifts_summary_df.columns[0], shifts_summary_df.columns[1],
-        #                    shifts_summary_df.columns[2]]
-        if year in vert_offset_info_duration_filtered_years:
-            # offsets_duration_filtered_df = offsets_duration_filtered_df[reorder_columns]  # Automatically drops the
-            # temporal_shift column from shifts_summary_df.
-            # offsets_duration_filtered_df.rename(columns={"vertical_offset": "vertical offset", "start_date": "start "
-            #                                              "date", "end_date": "end date"}, inplace=True)
-            offsets_duration_filtered_df.to_csv(f"{write_path}/{filename}_{year}_"
-                                                f"vertical_offset_info_duration_filtered.csv", index=False)
+    # Get streaming configurations.
+    streaming_config = config['analysis'].get('streaming', {})
+    streaming = streaming_config.get('enabled', False)
 
-        # Write vertical offsets info (FBV) report.
-        if year in vert_offset_info_value_filtered_years:
-            # offsets_value_filtered_df = offsets_value_filtered_df[reorder_columns]
-            # offsets_value_filtered_df.rename(columns={"vertical_offset": "vertical offset", "start_date": "start "
-            #                                           "date", "end_date": "end date"}, inplace=True)
-            offsets_value_filtered_df.to_csv(f"{write_path}/{filename}_{year}_"
-                                             f"vertical_offset_info_value_filtered.csv", index=False)
+    # Check that get_data_paths succeeded.
+    if args_flag_ptr[0] is True:
+        ref_path = paths[0]
+        primary_path = paths[1]
+    else:
+        print("args_flag_ptr is False. Data paths not entered, "
+              "or paths do not exist. Exiting program.")
+        sys.exit()
+
+    logger.info("Program configured")
+
+    # Load unchanged data files from the cache of parsed files, if enabled.
+    configure_data_cache(config)
+
+    # Record the processed years in a run manifest, so unchanged years are reused by later runs.
+    run_manifest = RunManifest(write_path, filename) if args.reuse else None
+
+    # Read the data and get the years to process.
+    station = prepare_station(config, ref_path, primary_path, write_path, filename, analysis, args.years,
+                              run_manifest, streaming)
+
+    ''' ***********************************************************************************************************
+        ********************************************* PROCESSING LOOP *********************************************
+        *********************************************************************************************************** '''
+    logger.info("Processing loop start")
+    processing_loop_start_time = time.perf_counter()
 
-        process_year_end_time = time.perf_counter()
-        process_year_duration = process_year_end_time - process_year_start_time
-        logger.info(f"Year ({common_years.index(year) + 1}) processed in {process_year_duration:.2f} seconds")
+    if workers > 1:
+        logger.info(f"Processing years with {workers} workers")
+
+    # Process the years, writing the annotated raw data of each year on a background thread.
+    annotated_data_writer = AnnotatedDataWriter(config['output'].get('annotated_raw_data_compression'))
+    if station['options']['continue_across_years']:
+        logger.info("Temporal correction continues across years, so years are processed one at a time")
+        year_results = []
+        for year, year_result in iter_years_in_order(config, station, streaming):
+            submit_annotated_data(annotated_data_writer, station, year, year_result)
+            year_results.append(year_result)
+    elif streaming:
+        lookahead_years = streaming_config.get('lookahead_years', 1)
+        logger.info(f"Streaming years with {lookahead_years} year(s) of lookahead")
+        year_results = stream_years(config, station, workers, annotated_data_writer, lookahead_years)
+    else:
+        year_args = get_year_args(config, station)
+        year_results = run_years(station, year_args, workers, annotated_data_writer)
+    annotated_data_writer.close()
     # End processing loop.
     processing_loop_end_time = time.perf_counter()
     processing_loop_duration = processing_loop_end_time - processing_loop_start_time
@@ -377,60 +744,19 @@ def main(args):
     ''' ***********************************************************************************************************
         ************************************************* RESULTS *************************************************
         *********************************************************************************************************** '''
-    logger.info("Writing results")
-    # Write configs to file.
-    with open(f'{write_path}/{filename}_configs.txt', 'w') as file:
-        file.write(f"Configurations: {json.dumps(config, indent=4)}")
+    # Merge the new results with the reused ones, in year order.
+    new_results = dict(zip(station['process_years'], year_results))
+    for year_result in new_results.values():
+        station['telemetry'].extend(year_result['telemetry'])
+    if run_manifest is not None:
+        for year, year_result in new_results.items():
+            run_manifest.store_year_result(year, station['year_hashes'][year], year_result)
+        run_manifest.save()
+    year_results = [new_results[year] if year in new_results else station['reused_results'][year]
+                    for year in station['common_years']]
 
-    if do_correction:
-        if annotated_raw_data_years:
-            # Get table of annotated series data.
-            series_data_annotated_df = pd.DataFrame(series_data_concat_dict)
-
-            reorder_columns = ['date_time', 'primary_water_level', 'reference_water_level', 'vertical_offset',
-                               'temporal_shift']
-            series_data_annotated_df = series_data_annotated_df[reorder_columns]
-            series_data_annotated_df = (series_data_annotated_df.rename(columns={
-                                        'date_time': 'Date Time', 'primary_water_level': 'Primary Water Level',
-                                        'reference_water_level': 'Reference Water Level', 'vertical_offset': 'Vertical '
-                                        'Offset', 'temporal_shift': 'Temporal Shift'}))
-            annotated_data_per_year = helpers.split_by_year(series_data_annotated_df, 'Date Time')
-
-            # Write time shift table to CSV.
-            for year, df in annotated_data_per_year.items():
-                if year in annotated_raw_data_years:
-                    df.to_csv(f"{write_path}/{filename}_{year}_annotated_raw_data.csv", index=False)
-    # End if.
-
-    # Write summary file.
-    metrics_config = {
-        "analysis_mode": config['analysis']['mode'],
-        "filter_offsets_by_duration": config["filter_offsets_by_duration"],
-        "filter_offsets_by_value": config["filter_offsets_by_value"],
-        "filter_gaps_by_duration": config['filter_gaps_by_duration'],
-        "temporal_shift_correction": config["temporal_shift_correction"]
-    }
-    if metrics_summary_years:
-        with open(f'{write_path}/{filename}_metrics_summary.txt', 'w') as file:
-            file.write(f"Configurations: {json.dumps(metrics_config, indent=4)}\n\n")
-            file.write(f"% agree: Percentage of values that agree between datasets.\n"
-                       f"% values disagree: Percentage of values that disagree (excluding NaNs) between datasets.\n"
-                       f"% missing: Percentage of the primary data that is missing (NaN).\n"
-                       f"% total disagree: Percentage of data that disagrees (including NaNs) between datasets.\n"
-                       f"% time-shifted: Percentage of data (with positive error) that is time-shifted.\n"
-                       f"# VOs (FBD): Number of vertical offsets (filtered by duration).\n"
-                       f"# gaps (FBD): Number of gaps (filtered by duration).\n"
-                       f"VOs list (FBD): List of unique vertical offset values (filtered by duration).\n"
-                       f"# VOs (FBV): Number of vertical offsets (filtered by value).\n"
-                       f"min VO: Minimum vertical offset value.\n"
-                       f"max VO: Maximum vertical offset value.\n\n")
-        helpers.write_table_from_nested_dict(summary, 'Year',
-                                             f'{write_path}/{filename}_metrics_summary.txt')
-
-    # Write temporal offset correction summary for all years.
-    if do_correction:
-        if temp_corr_summary_years:
-            all_processed_years_df.to_csv(f"{write_path}/{filename}_temporal_shifts_summary.csv", index=False)
+    logger.info("Writing results")
+    write_results(config, station, year_results)
 
     program_end_time = time.perf_counter()
     program_duration = program_end_time - program_start_time
@@ -0,0 +1,188 @@
+# Script for analyzing many station pairs in one run.
+# Reads a manifest of station pairs, and processes every (station, year) as a job on a shared pool
+# of worker processes. Each station's outputs are written to its own directory, named after the station.
+
+import helpers
+import analyze_data
+from AnnotatedDataWriter import AnnotatedDataWriter
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Analyze the station pairs listed in a manifest.")
+    parser.add_argument('--manifest', type=str, required=True,
+                        help='Path to manifest file listing the station pairs')
+    parser.add_argument('--config', type=str,
+                        help='Path to configuration file', default='config.json')
+    parser.add_argument('--output', type=str,
+                        help='Path to write the station output directories in', default='generated_files')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of worker processes shared by all jobs')
+    parser.add_argument('--mode', type=str, choices=['raw', 'corrected'],
+                        help='Type of analysis')
+    return parser.parse_args()
+# End parse_arguments()
+
+
+def load_manifest(file_path):
+    # The manifest lists the station pairs as {"stations": [{"name": ..., "refdir": ..., "primarydir": ...,
+    # "years": [...]}]}. "years" is optional and defaults to the years in the configuration.
+    with open(file_path, 'r') as file:
+        manifest = json.load(file)
+
+    stations = manifest['stations']
+    names = [station['name'] for station in stations]
+    if len(set(names)) != len(names):
+        raise ValueError("Station names in the manifest must be unique.")
+    return stations
+# End load_manifest()
+
+
+def run_year_job(station_name, year_arg):
+    # Process one year of a station, and time it. Returns the year's result in a list, like run_station_job.
+    job_start_time = time.perf_counter()
+    year_result = analyze_data.process_year(*year_arg)
+    return station_name, [(year_arg[0], year_result, time.perf_counter() - job_start_time)]
+# End run_year_job()
+
+
+def run_station_job(station_name, config, station):
+    # Process all years of a station in order, for temporal correction that continues across years, and
+    # time each year.
+    year_jobs = []
+    job_start_time = time.perf_counter()
+    for year, year_result in analyze_data.iter_years_in_order(config, station):
+        year_jobs.append((year, year_result, time.perf_counter() - job_start_time))
+        job_start_time = time.perf_counter()
+    return station_name, year_jobs
+# End run_station_job()
+
+
+def get_job_cost(year_arg):
+    # Estimate the cost of a job by the number of data points to align and correct.
+    primary_df, ref_df = year_arg[3], year_arg[4]
+    return len(primary_df) + len(ref_df)
+# End get_job_cost()
+
+
+def get_station_cost(station):
+    return sum(len(df) for df in list(station['primary_dfs_dict'].values()) + list(station['ref_dfs_dict'].values()))
+# End get_station_cost()
+
+
+def write_timing_report(stations, job_durations, results_durations, workers, batch_duration):
+    name_width = max([len('Station')] + [len(name) for name in stations])
+    print("Batch timing report")
+    print(f"{'Station':<{name_width}} | Years | Jobs (s)   | Longest year (s) | Results (s)")
+    for name in stations:
+        durations = job_durations[name]
+        if durations:
+            longest_year = max(durations, key=durations.get)
+            longest = f"{durations[longest_year]:.2f} ({longest_year})"
+        else:
+            longest = "N/A"
+        print(f"{name:<{name_width}} | {len(durations):<5} | {sum(durations.values()):<10.2f} | "
+              f"{longest:<16} | {results_durations.get(name, 0.0):.2f}")
+
+    total_job_duration = sum(sum(durations.values()) for durations in job_durations.values())
+    num_years = sum(len(durations) for durations in job_durations.values())
+    print(f"{num_years} station-years processed by {workers} workers in {batch_duration:.2f} seconds "
+          f"({total_job_duration:.2f} seconds of job time).")
+# End write_timing_report()
+
+
+def main(args):
+    batch_start_time = time.perf_counter()
+
+    config = helpers.load_configs(args.config)
+    analysis = args.mode if args.mode else config['analysis']['mode']
+    stations = load_manifest(args.manifest)
+    analyze_data.configure_data_cache(config)
+
+    # Read the data of each station pair. Stations with missing data paths are skipped.
+    prepared_stations = {}
+    for station_entry in stations:
+        name = station_entry['name']
+        refdir = station_entry['refdir']
+        primarydir = station_entry['primarydir']
+        if not os.path.exists(refdir) or not os.path.exists(primarydir):
+            print(f"Data paths for station <{name}> do not exist. Skipping station.")
+            continue
+
+        write_path = os.path.join(args.output, name)
+        if not os.path.exists(write_path):
+            os.makedirs(write_path)
+
+        prepared_stations[name] = analyze_data.prepare_station(config, refdir, primarydir, write_path, name,
+                                                                analysis, station_entry.get('years'))
+    # End for.
+
+    if not prepared_stations:
+        print("No station pairs to process. Exiting program.")
+        sys.exit()
+
+    # Schedule the longest jobs first, so that short years fill in around long ones at the end. The years of a
+    # station whose temporal correction continues across years depend on each other, so they are one job.
+    jobs = []
+    for name, station in prepared_stations.items():
+        if station['options']['continue_across_years']:
+            jobs.append((run_station_job, (name, config, station), get_station_cost(station)))
+        else:
+            jobs += [(run_year_job, (name, year_arg), get_job_cost(year_arg))
+                     for year_arg in analyze_data.get_year_args(config, station)]
+    # End for.
+    jobs.sort(key=lambda job: job[2], reverse=True)
+
+    # Results are collected per station, and a station's reports are written as soon as all of its
+    # years are processed.
+    remaining_jobs = {name: len(station['common_years']) for name, station in prepared_stations.items()}
+    station_results = {name: {} for name in prepared_stations}
+    job_durations = {name: {} for name in prepared_stations}
+    results_durations = {}
+
+    # The annotated raw data of each year is written on a background thread as soon as the year is processed.
+    annotated_data_writer = AnnotatedDataWriter(config['output'].get('annotated_raw_data_compression'))
+
+    def write_station_results(name):
+        results_start_time = time.perf_counter()
+        station = prepared_stations[name]
+        annotated_data_writer.flush()
+        year_results = [station_results[name][year] for year in station['common_years']]
+        analyze_data.write_results(config, station, year_results)
+        del station_results[name]
+        results_durations[name] = time.perf_counter() - results_start_time
+
+    for name, count in remaining_jobs.items():
+        if count == 0:
+            write_station_results(name)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(job, *job_args) for job, job_args, job_cost in jobs]
+        for future in as_completed(futures):
+            name, year_jobs = future.result()
+            for year, year_result, job_duration in year_jobs:
+                station_results[name][year] = year_result
+                prepared_stations[name]['telemetry'].extend(year_result['telemetry'])
+                analyze_data.submit_annotated_data(annotated_data_writer, prepared_stations[name], year,
+                                                   year_result)
+                job_durations[name][year] = job_duration
+                remaining_jobs[name] -= 1
+            if remaining_jobs[name] == 0:
+                write_station_results(name)
+    # End with.
+    annotated_data_writer.close()
+
+    write_timing_report(list(prepared_stations.keys()), job_durations, results_durations, args.workers,
+                        time.perf_counter() - batch_start_time)
+# End main.
+
+
+if __name__ == "__main__":
+    main_args = parse_arguments()
+    main(main_args)
@@ -0,0 +1,236 @@
+# Script for benchmarking the stages of analyze_data.py and the standalone Lighthouse scripts on synthetic data.
+# For each number of station-years, generates a synthetic station with generate_synthetic_data.py, runs the
+# analysis stages (load, align, temporal correction, comparison stats, runs, metrics, writes) and the scripts,
+# and reports the throughput of each stage in rows per second.
+#
+# With --update-baseline, the throughputs are stored in the baseline file. Otherwise they are compared to the
+# stored baseline, and the script exits with status 1 if any stage is slower than the baseline by more than
+# the tolerance. Baselines are specific to the machine they were measured on.
+
+import helpers
+import analyze_data
+import generate_synthetic_data
+from AnnotatedDataWriter import AnnotatedDataWriter
+
+import os
+import sys
+import copy
+import json
+import time
+import runpy
+import argparse
+import shutil
+
+
+# Standalone scripts to benchmark, with the path they read the Lighthouse data files from, relative to the
+# working directory. The paths must match the config section of each script.
+STANDALONE_SCRIPTS = {
+    'detect_flat_lines.py': 'data/lighthouse/time_series_integrated_with_122024_nesscan_fix/'
+                            'rockport_with_122024_nesscan_fix_raw',
+    'lighthouse_remove_outliers.py': 'data/lighthouse/rockport_nesscan_fixed/raw'
+}
+
+# First year of the synthetic stations.
+FIRST_YEAR = 1970
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis stages on synthetic data.")
+    parser.add_argument('--config', type=str,
+                        help='Path to configuration file', default='config.json')
+    parser.add_argument('--station-years', type=int, nargs='+', default=[1, 10, 50],
+                        help='Numbers of station-years to benchmark')
+    parser.add_argument('--mode', type=str, choices=['raw', 'corrected'], default='corrected',
+                        help='Type of analysis')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs of each benchmark; the fastest run of each stage is kept')
+    parser.add_argument('--workdir', type=str, default='generated_files/benchmark',
+                        help='Path to write the synthetic data and outputs in')
+    parser.add_argument('--baseline', type=str, default='benchmark_baseline.json',
+                        help='Path to the baseline throughputs file')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Store the throughputs as the new baseline instead of comparing to it')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed fractional drop in throughput before a stage counts as a regression')
+    parser.add_argument('--skip-scripts', action='store_true',
+                        help='Only benchmark the analysis stages')
+    return parser.parse_args()
+# End parse_arguments()
+
+
+def get_benchmark_config(config_path, mode):
+    # Use the configured analysis parameters, but process and report all years, without telemetry files.
+    # Years are processed independently, as the stages are timed per year.
+    config = copy.deepcopy(helpers.load_configs(config_path))
+    config['analysis']['mode'] = mode
+    config['analysis']['years'] = ['all_years']
+    config['output']['telemetry'] = False
+    config['temporal_shift_correction']['continue_across_years'] = False
+    for report in config['output']['generate_reports_for_years']:
+        config['output']['generate_reports_for_years'][report] = ['all_years']
+    return config
+# End get_benchmark_config()
+
+
+def prepare_data(workdir, station_years):
+    # Generate the synthetic station once per number of station-years. The data is seeded, so an
+    # existing directory is reused.
+    data_path = os.path.join(workdir, f'data_{station_years}')
+    years = list(range(FIRST_YEAR, FIRST_YEAR + station_years))
+    ref_path = os.path.join(data_path, 'NOAA', 'synthetic')
+    primary_path = os.path.join(data_path, 'lighthouse', 'synthetic')
+    if not os.path.exists(primary_path) or len(os.listdir(primary_path)) != station_years:
+        shutil.rmtree(data_path, ignore_errors=True)
+        generate_synthetic_data.generate_station(data_path, 'synthetic', years, seed=station_years)
+    return ref_path, primary_path
+# End prepare_data()
+
+
+def run_analysis(config, ref_path, primary_path, write_path, mode):
+    # Run the stages of analyze_data.main on one station, and get the telemetry of each stage.
+    analysis_start_time = time.perf_counter()
+    station = analyze_data.prepare_station(config, ref_path, primary_path, write_path, 'benchmark', mode)
+    annotated_data_writer = AnnotatedDataWriter(config['output'].get('annotated_raw_data_compression'))
+    year_results = analyze_data.run_years(station, analyze_data.get_year_args(config, station), 1,
+                                          annotated_data_writer)
+    annotated_data_writer.close()
+    for year_result in year_results:
+        station['telemetry'].extend(year_result['telemetry'])
+    analyze_data.write_results(config, station, year_results)
+    analysis_duration = time.perf_counter() - analysis_start_time
+
+    # Sum each stage over the years.
+    stages = {}
+    for record in station['telemetry'].get_records():
+        stage = stages.setdefault(record['stage'], {'rows': 0, 'wall_seconds': 0.0})
+        stage['rows'] += record['rows']
+        stage['wall_seconds'] += record['wall_seconds']
+    # End for.
+    rows = sum(len(df) for df in station['primary_dfs_dict'].values())
+    stages['analysis total'] = {'rows': rows, 'wall_seconds': analysis_duration}
+
+    return stages
+# End run_analysis()
+
+
+def run_script(script, input_path, primary_path, workdir):
+    # Run a standalone script in a scratch directory that holds the primary data files at the path the
+    # script reads from. Returns None if the script's dependencies are not installed.
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    scratch_path = os.path.abspath(os.path.join(workdir, 'scripts', os.path.splitext(script)[0]))
+    shutil.rmtree(scratch_path, ignore_errors=True)
+    shutil.copytree(primary_path, os.path.join(scratch_path, input_path))
+    rows = sum(len(helpers.read_data_file(os.path.join(primary_path, file))) for file in os.listdir(primary_path))
+
+    cwd = os.getcwd()
+    os.chdir(scratch_path)
+    try:
+        script_start_time = time.perf_counter()
+        runpy.run_path(script_path, run_name='__main__')
+        script_duration = time.perf_counter() - script_start_time
+    except ModuleNotFoundError as error:
+        print(f"Skipping {script}: {error}")
+        return None
+    finally:
+        os.chdir(cwd)
+
+    return {'rows': rows, 'wall_seconds': script_duration}
+# End run_script()
+
+
+def get_fastest(runs):
+    # Keep the fastest run of each stage, the least disturbed by other load on the machine.
+    fastest = {}
+    for stages in runs:
+        for name, stage in stages.items():
+            if name not in fastest or stage['wall_seconds'] < fastest[name]['wall_seconds']:
+                fastest[name] = stage
+    # End for.
+
+    for stage in fastest.values():
+        stage['rows_per_second'] = stage['rows'] / stage['wall_seconds'] if stage['wall_seconds'] > 0 else 0.0
+    return fastest
+# End get_fastest()
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    # Print the throughputs next to the baseline, and return the stages that regressed.
+    regressions = []
+    print(f"{'Station-years':<13} | {'Stage':<36} | {'Rows':<10} | {'Wall (s)':<9} | {'Rows/s':<12} | "
+          f"{'Baseline':<12} | Change")
+    for station_years, stages in results.items():
+        for name, stage in stages.items():
+            baseline_rate = baseline.get(station_years, {}).get(name)
+            if baseline_rate:
+                change = stage['rows_per_second'] / baseline_rate - 1
+                change_str = f"{change * 100:+.1f}%"
+                if change < -tolerance:
+                    regressions.append((station_years, name, change))
+                    change_str += " REGRESSION"
+            else:
+                baseline_rate = 'N/A'
+                change_str = 'N/A'
+            baseline_str = f"{baseline_rate:<12.0f}" if baseline_rate != 'N/A' else f"{baseline_rate:<12}"
+            print(f"{station_years:<13} | {name:<36} | {stage['rows']:<10} | {stage['wall_seconds']:<9.3f} | "
+                  f"{stage['rows_per_second']:<12.0f} | {baseline_str} | {change_str}")
+        # End for.
+    # End for.
+    return regressions
+# End compare_to_baseline()
+
+
+def main(args):
+    config = get_benchmark_config(args.config, args.mode)
+    if not os.path.exists(args.workdir):
+        os.makedirs(args.workdir)
+
+    results = {}
+    for station_years in args.station_years:
+        ref_path, primary_path = prepare_data(args.workdir, station_years)
+        write_path = os.path.join(args.workdir, f'output_{station_years}')
+        if not os.path.exists(write_path):
+            os.makedirs(write_path)
+
+        runs = []
+        for _ in range(args.repeat):
+            stages = run_analysis(config, ref_path, primary_path, write_path, args.mode)
+            if not args.skip_scripts:
+                for script, input_path in STANDALONE_SCRIPTS.items():
+                    script_stage = run_script(script, input_path, primary_path, args.workdir)
+                    if script_stage is not None:
+                        stages[f'script {script}'] = script_stage
+            runs.append(stages)
+        # End for.
+
+        # JSON keys are strings, so the results are keyed the same way as a loaded baseline.
+        results[str(station_years)] = get_fastest(runs)
+    # End for.
+
+    if args.update_baseline:
+        baseline = {station_years: {name: stage['rows_per_second'] for name, stage in stages.items()}
+                    for station_years, stages in results.items()}
+        with open(args.baseline, 'w') as file:
+            json.dump(baseline, file, indent=4)
+        compare_to_baseline(results, {}, args.tolerance)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+    else:
+        print(f"No baseline file {args.baseline}. Run with --update-baseline to create one.")
+
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed by more than {args.tolerance * 100:.0f}%:")
+        for station_years, name, change in regressions:
+            print(f"  {station_years} station-years, {name}: {change * 100:+.1f}%")
+        sys.exit(1)
+# End main.
+
+
+if __name__ == "__main__":
+    main_args = parse_arguments()
+    main(main_args)
@@ -18,6 +18,7 @@ import numpy as np
 from scipy.ndimage import label
 
 import helpers
+from DataCache import DataCache
 
 ''' ***********************************************************************************************************
     ************************************************* CONFIG **************************************************
@@ -37,6 +38,10 @@ duration = 10  # data points
 window_size = 20  # data points
 tolerance = 0.003
 
+# Load unchanged data files from the cache of parsed files.
+use_cache = False
+cache_path = 'generated_files/cache'
+
 current_timestamp = datetime.datetime.now().strftime('%H%M%S_%m%d%Y')
 
 write_flats = False
@@ -74,11 +79,14 @@ if not os.path.exists(output_cleaned_data) and write_cleaned_data:
 if not os.path.exists(output_stats_log) and write_log:
     os.makedirs(output_stats_log)
 
+if use_cache:
+    helpers.set_data_cache(DataCache(cache_path))
+
 data_files = glob.glob(f'{lighthouse_data_path}/*.csv')
 
 station_df = pd.DataFrame()
 for file in data_files:
-    df = pd.read_csv(file, parse_dates=['dt'])
+    df = helpers.read_data_file(file)
 
     station_df = pd.concat([station_df, df])
 # End for.
@@ -0,0 +1,199 @@
+# Script for generating synthetic tide gauge data, for testing and benchmarking without NOAA or Lighthouse
+# downloads. Writes a reference (NOAA-like) and a primary (Lighthouse-like) series per year, with temporal
+# shifts, datum offsets, gaps, flat lines and spikes injected into the primary series, and the ground truth
+# labels of every data point.
+#
+# Output layout, one CSV file per year:
+#   [output]/NOAA/[station]/[year].csv        Date Time, Water Level
+#   [output]/lighthouse/[station]/[year].csv  dt, wl
+#   [output]/labels/[station]/[year].csv      Date Time, Temporal Shift, Vertical Offset, Gap, Flat Line, Spike
+#
+# Labels use the terms of TransformData: a primary value with temporal shift s and vertical offset v satisfies
+# primary[i - s] = reference[i] - v.
+
+import helpers
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+
+# Tidal constituents as (amplitude in meters, period in hours). Amplitudes are in the range of the
+# Texas coast, where the diurnal constituents dominate.
+TIDAL_CONSTITUENTS = {
+    'M2': (0.12, 12.4206012),
+    'S2': (0.04, 12.0),
+    'N2': (0.03, 12.65834751),
+    'K1': (0.14, 23.93447213),
+    'O1': (0.13, 25.81934170),
+    'Sa': (0.10, 8766.15265)
+}
+
+# Default generation parameters. Durations are in data points (sample intervals).
+DEFAULT_PARAMS = {
+    'sample_interval': helpers.DATA_SAMPLE_INTERVAL,
+    'mean_water_level': 0.2,
+    'surge_std': 0.02,  # Standard deviation of the daily weather-driven surge, in meters.
+    'mean_segment_length': 2400,  # Mean length of the segments with a constant shift and offset.
+    'temporal_shifts': [0, 0, 0, -1, -1, 1, -2, 2, -3, 3],  # Drawn uniformly, so 0 and -1 are most likely.
+    'vertical_offsets': [0.0, 0.0, 0.0, 0.005, -0.005, 0.01, -0.01, 0.05, -0.05],
+    'num_gaps': 12,
+    'max_gap_length': 240,
+    'num_reference_gaps': 4,
+    'num_flat_lines': 6,
+    'max_flat_line_length': 120,
+    'num_spikes': 20,
+    'spike_size': 2.0
+}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Generate synthetic tide gauge data with ground truth labels.")
+    parser.add_argument('--output', type=str,
+                        help='Path to write the data directories in', default='data/synthetic')
+    parser.add_argument('--station', type=str,
+                        help='Name of the station directories', default='synthetic')
+    parser.add_argument('--years', type=int, nargs='+', default=[2019, 2020],
+                        help='Years to generate')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random number generator')
+    return parser.parse_args()
+# End parse_arguments()
+
+
+def generate_tide(datetimes, rng, mean_water_level, surge_std):
+    # Sum the tidal constituents at the given datetimes, and add a smooth surge that varies daily.
+    hours = (datetimes - np.datetime64('2000-01-01', 'us')) / np.timedelta64(1, 'h')
+    water_level = np.full(len(datetimes), mean_water_level)
+    for amplitude, period in TIDAL_CONSTITUENTS.values():
+        phase = rng.uniform(0, 2 * np.pi)
+        water_level += amplitude * np.cos(2 * np.pi * hours / period + phase)
+
+    # Surge: a daily random walk interpolated to the samples.
+    days = np.arange(np.floor(hours.min() / 24), np.ceil(hours.max() / 24) + 2)
+    surge = np.cumsum(rng.normal(0, surge_std, len(days)))
+    surge -= surge.mean()
+    water_level += np.interp(hours / 24, days, surge)
+
+    return water_level
+# End generate_tide()
+
+
+def get_segments(size, rng, mean_segment_length):
+    # Split [0, size) into segments of exponentially distributed lengths. Returns the start indices.
+    starts = [0]
+    while True:
+        start = starts[-1] + max(int(rng.exponential(mean_segment_length)), 1)
+        if start >= size:
+            break
+        starts.append(start)
+    return np.array(starts)
+# End get_segments()
+
+
+def get_random_spans(size, rng, num_spans, max_length):
+    # Random [start, end) spans of 1 to max_length data points.
+    starts = rng.integers(0, size, num_spans)
+    lengths = rng.integers(1, max_length + 1, num_spans)
+    return [(start, min(start + length, size)) for start, length in zip(starts, lengths)]
+# End get_random_spans()
+
+
+def generate_year(year, rng, **kwargs):
+    # Generate the reference and primary series of a year, and the labels of each data point.
+    params = {**DEFAULT_PARAMS, **kwargs}
+    sample_interval = params['sample_interval']
+    datetimes = helpers.get_year_grid(year, sample_interval)
+    size = len(datetimes)
+    interval = pd.Timedelta(sample_interval).to_timedelta64()
+
+    # The reference is the tide, rounded to millimeters as in the data files. It is also generated
+    # for the shifted samples around the year, so shifted values at the ends of the year exist.
+    max_shift = max(abs(shift) for shift in params['temporal_shifts'])
+    extended_datetimes = datetimes[0] + (np.arange(-max_shift, size + max_shift) * interval)
+    extended_reference = np.round(generate_tide(extended_datetimes, rng, params['mean_water_level'],
+                                                params['surge_std']), 3)
+    reference = extended_reference[max_shift:max_shift + size].copy()
+
+    # Segments of constant temporal shift and vertical offset.
+    segment_starts = get_segments(size, rng, params['mean_segment_length'])
+    segment_shifts = rng.choice(params['temporal_shifts'], len(segment_starts))
+    segment_offsets = rng.choice(params['vertical_offsets'], len(segment_starts))
+    segment_index = np.searchsorted(segment_starts, np.arange(size), side='right') - 1
+    temporal_shift = segment_shifts[segment_index]
+    vertical_offset = segment_offsets[segment_index]
+
+    # primary[i - s] = reference[i] - v, that is primary[j] = reference[j + s] - v.
+    source_index = np.arange(size) + temporal_shift + max_shift
+    primary = np.round(extended_reference[source_index] - vertical_offset, 3)
+
+    # Flat lines: the primary value is held for a span.
+    flat_line = np.zeros(size, dtype=bool)
+    for start, end in get_random_spans(size, rng, params['num_flat_lines'], params['max_flat_line_length']):
+        primary[start:end] = primary[start]
+        flat_line[start:end] = True
+
+    # Spikes: single primary values far from the tide.
+    spike = np.zeros(size, dtype=bool)
+    spike_indices = rng.integers(0, size, params['num_spikes'])
+    primary[spike_indices] += rng.choice([-1, 1], len(spike_indices)) * params['spike_size']
+    spike[spike_indices] = True
+
+    # Gaps in both series.
+    gap = np.zeros(size, dtype=bool)
+    for start, end in get_random_spans(size, rng, params['num_gaps'], params['max_gap_length']):
+        primary[start:end] = np.nan
+        gap[start:end] = True
+    for start, end in get_random_spans(size, rng, params['num_reference_gaps'], params['max_gap_length']):
+        reference[start:end] = np.nan
+
+    ref_df = pd.DataFrame({'Date Time': datetimes, 'Water Level': reference})
+    primary_df = pd.DataFrame({'dt': datetimes, 'wl': primary})
+    labels_df = pd.DataFrame({
+        'Date Time': datetimes,
+        'Temporal Shift': temporal_shift,
+        'Vertical Offset': vertical_offset,
+        'Gap': gap,
+        'Flat Line': flat_line,
+        'Spike': spike
+    })
+
+    return ref_df, primary_df, labels_df
+# End generate_year()
+
+
+def generate_station(output_path, station, years, seed=0, **kwargs):
+    # Generate and write the data files of a station for each year. Returns the reference and primary
+    # data directories.
+    rng = np.random.default_rng(seed)
+    paths = {
+        'ref': os.path.join(output_path, 'NOAA', station),
+        'primary': os.path.join(output_path, 'lighthouse', station),
+        'labels': os.path.join(output_path, 'labels', station)
+    }
+    for path in paths.values():
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    for year in years:
+        ref_df, primary_df, labels_df = generate_year(year, rng, **kwargs)
+        ref_df.to_csv(f"{paths['ref']}/{year}.csv", index=False, date_format=helpers.DATA_DATETIME_FORMAT)
+        primary_df.to_csv(f"{paths['primary']}/{year}.csv", index=False, date_format=helpers.DATA_DATETIME_FORMAT)
+        labels_df.to_csv(f"{paths['labels']}/{year}.csv", index=False, date_format=helpers.DATA_DATETIME_FORMAT)
+    # End for.
+
+    return paths['ref'], paths['primary']
+# End generate_station()
+
+
+def main(args):
+    ref_path, primary_path = generate_station(args.output, args.station, args.years, args.seed)
+    print(f"Generated years {args.years} of station <{args.station}>: refdir {ref_path}, "
+          f"primarydir {primary_path}")
+# End main.
+
+
+if __name__ == "__main__":
+    main_args = parse_arguments()
+    main(main_args)
@@ -4,12 +4,27 @@ import numpy as np
 import json
 import datetime
 import argparse
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 # Opt into future behavior for pandas. Encouraged by FutureWarning message
 # for pd.replace(): "Downcasting behavior in 'replace' is deprecated and
 # will be removed in a future version."
 pd.set_option('future.no_silent_downcasting', True)
 
+# Water levels in fixed-point storage mode are int32 tenths of a millimeter, the
+# same precision the float comparisons round to (4 decimal places of a meter).
+FIXED_POINT_SCALE = 10000
+
+# Datetime format of the data files written by preprocess_data_files.py.
+DATA_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Interval between the samples of the data files, on a regular grid from Jan 1 of each year.
+DATA_SAMPLE_INTERVAL = '6 minutes'
+
+# Cache of parsed data files used by read_data_file. Set with set_data_cache().
+data_cache = [None]
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Parse arguments from user.")
@@ -30,6 +45,10 @@ def parse_arguments():
     parser.set_defaults(logging=True)
     parser.add_argument('--mode', type=str, choices=['raw', 'corrected'],
                         help='Type of analysis')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes to process years with')
+    parser.add_argument('--reuse', action='store_true',
+                        help="Reuse the results of the years that are unchanged since the last run")
     return parser.parse_args()
 
 
@@ -79,51 +98,114 @@ def load_configs(file_path):
     return user_config
 
 
-def read_file_to_df(file, index_limit=None, flag=[False], error=[""]):
+def set_data_cache(cache):
+    # Set the DataCache used by read_data_file, or None to read every file from scratch.
+    data_cache[0] = cache
+# End set_data_cache.
 
-    # Initialize df to None.
-    df = None
 
-    # If index_limit is None, find where valid data stops using
-    # end_file_index() so that the nrows parameter can be assigned in
-    # pd.read_csv().
-    if index_limit is None:
-        index_limit = end_file_index(file)
+def read_data_file(file, datetime_format=DATA_DATETIME_FORMAT):
+    # Read a data file in one pass. The first column is parsed as datetimes with a fixed format,
+    # and the second column as float water levels, with the values that are not numbers as missing.
+    # Comment lines ('# ...') are skipped.
+    # If a data cache is set, a file that has not changed is loaded from the cache instead.
+    cache = data_cache[0]
+    if cache is not None:
+        df = cache.load(file)
+        if df is not None:
+            return df
 
-    # Read the file into a dataframe. If error reading or finding file,
-    # append the error.
-    if os.path.isfile(file):
-        try:
-            df = pd.read_csv(file, nrows=index_limit)
-            flag[0] = True
-        except Exception as e:
-            error[0] = str(e)
-            flag[0] = False
-    else:
-        error[0] = "File not found."
-        flag[0] = False
-    # End for.
+    try:
+        df = pd.read_csv(file, comment='#', dtype={1: 'float64'}, parse_dates=[0], date_format=datetime_format)
+    except ValueError:
+        # A water level that is not a number, like a status code, is read as missing.
+        df = pd.read_csv(file, comment='#', parse_dates=[0], date_format=datetime_format)
+        df[df.columns[1]] = pd.to_numeric(df.iloc[:, 1], errors='coerce')
+
+    # If the datetimes do not match the format, they are left unparsed. Infer the format instead.
+    if not pd.api.types.is_datetime64_any_dtype(df.iloc[:, 0]):
+        df[df.columns[0]] = pd.to_datetime(df.iloc[:, 0])
+
+    if cache is not None:
+        cache.store(file, df)
 
     return df
-# End read_file.
+# End read_data_file.
+
+
+def read_data_files(files, datetime_format=DATA_DATETIME_FORMAT, max_workers=None):
+    # Read data files in a thread pool. The dataframes are returned in the order of files.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(read_data_file, files, [datetime_format] * len(files)))
+# End read_data_files.
+
+
+def get_data_file_year(file, datetime_format=DATA_DATETIME_FORMAT):
+    # Get the year of a data file from its first data row, without reading the rest of the file.
+    # Returns None if the file has no data rows or the first datetime is missing.
+    first_row = pd.read_csv(file, comment='#', nrows=1, usecols=[0])
+    if first_row.empty:
+        return None
+
+    first_datetime = pd.to_datetime(first_row.iloc[:, 0], format=datetime_format, errors='coerce')[0]
+    if pd.isna(first_datetime):
+        first_datetime = pd.to_datetime(first_row.iloc[:, 0], errors='coerce')[0]
+    if pd.isna(first_datetime):
+        return None
+
+    return int(first_datetime.year)
+# End get_data_file_year.
+
+
+def get_data_file_index(files, datetime_format=DATA_DATETIME_FORMAT):
+    # Index data files by year, so only the files of the years to process have to be read. Like
+    # get_df_dictionary, a file is indexed by the year of its first row, and later files replace
+    # earlier files of the same year.
+    file_index = {}
+    for file in files:
+        year = get_data_file_year(file, datetime_format)
+        if year is not None:
+            file_index[year] = file
+    # End for.
+
+    return file_index
+# End get_data_file_index.
+
+
+def get_file_hash(file):
+    # Hash the content of a file, reading it in chunks.
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file, 'rb') as source:
+        for chunk in iter(lambda: source.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+# End get_file_hash.
 
 
-def end_file_index(filename):
+def to_fixed_point(series):
+    # Convert water levels in meters to a nullable Int32 series of tenths of a millimeter.
+    # The values are stored as int32 with a mask marking the missing values.
+    values = series.to_numpy(dtype=float, na_value=np.nan)
+    missing = np.isnan(values)
+    scaled = np.round(np.where(missing, 0.0, values) * FIXED_POINT_SCALE).astype(np.int32)
 
-    line_count = 0
-    trailing_lines = 0
+    return pd.Series(pd.arrays.IntegerArray(scaled, missing), index=series.index, name=series.name)
+# End to_fixed_point.
 
-    with open(filename, 'r', encoding='utf-8') as file:
-        for line in file:
-            line_count += 1
-            if line.startswith("# "):
-                trailing_lines += 1
-    # Close file.
 
-    valid_data_lines = line_count - trailing_lines - 1  # -1 for last new line.
+def from_fixed_point(series):
+    # Convert a fixed-point series back to float water levels in meters, with NaN for missing values.
+    if not is_fixed_point(series):
+        return series
 
-    return valid_data_lines
-# End end_file_index().
+    values = series.to_numpy(dtype=float, na_value=np.nan) / FIXED_POINT_SCALE
+    return pd.Series(values, index=series.index, name=series.name)
+# End from_fixed_point.
+
+
+def is_fixed_point(series):
+    return pd.api.types.is_integer_dtype(series.dtype)
+# End is_fixed_point.
 
 
 def split_by_year(df, datetime_col_name):
@@ -143,6 +225,55 @@ def split_by_year(df, datetime_col_name):
 # End split_by_year.
 
 
+def get_year_grid(year, sample_interval=DATA_SAMPLE_INTERVAL):
+    # Regular datetimes of a year, from Jan 1 00:00 up to the last sample before the next Jan 1.
+    start = np.datetime64(f'{year}-01-01', 'us')
+    end = np.datetime64(f'{year + 1}-01-01', 'us')
+    interval = pd.Timedelta(sample_interval).to_timedelta64().astype('timedelta64[us]')
+    size = -(-(end - start) // interval)
+
+    return start + np.arange(size) * interval
+# End get_year_grid.
+
+
+def align_to_grid(datetimes, values, grid_start, grid_size, sample_interval=DATA_SAMPLE_INTERVAL):
+    # Scatter values onto a regular grid. Since the grid is regular, the position of a timestamp is
+    # (datetime - grid_start) / sample_interval. Grid positions without a value are NaN.
+    # Timestamps outside the grid are ignored. Returns the aligned values, the number of timestamps
+    # within the grid that are not on a sample (off grid), and the number of repeated timestamps
+    # (duplicates), of which only the first is kept.
+    datetimes = np.asarray(datetimes)
+    values = np.asarray(values, dtype=float)
+    interval = pd.Timedelta(sample_interval).to_timedelta64()
+
+    # Offsets from the start of the grid. Missing datetimes (NaT) are outside of the grid.
+    offsets = datetimes - np.datetime64(grid_start)
+    in_grid = ~np.isnat(offsets)
+    in_grid[in_grid] = (offsets[in_grid] >= np.timedelta64(0, 'us')) & (offsets[in_grid] < grid_size * interval)
+    offsets = offsets[in_grid]
+    values = values[in_grid]
+
+    on_sample = offsets % interval == np.timedelta64(0, 'us')
+    off_grid_count = int(len(offsets) - np.count_nonzero(on_sample))
+    positions = (offsets[on_sample] // interval).astype(np.int64)
+    values = values[on_sample]
+
+    duplicate_count = int(len(positions) - np.count_nonzero(np.bincount(positions, minlength=grid_size)))
+
+    # Keep the first value of repeated timestamps.
+    if duplicate_count:
+        first = np.full(grid_size, len(positions))
+        np.minimum.at(first, positions, np.arange(len(positions)))
+        positions = np.flatnonzero(first < len(positions))
+        values = values[first[positions]]
+
+    aligned = np.full(grid_size, np.nan)
+    aligned[positions] = values
+
+    return aligned, off_grid_count, duplicate_count
+# End align_to_grid.
+
+
 def clean_dataframe(df, datetime_col_name, pwl_col_name):
     cols = [datetime_col_name, pwl_col_name]
 
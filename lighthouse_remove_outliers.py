@@ -12,6 +12,9 @@ import glob
 import pandas as pd
 import numpy as np
 
+import helpers
+from DataCache import DataCache
+
 ''' ***********************************************************************************************************
     ************************************************* CONFIG **************************************************
     *********************************************************************************************************** '''
@@ -33,15 +36,22 @@ medians_output_file_path = (f'generated_files/pier21_reprocessed_03312025/median
 if not os.path.exists(medians_output_path):
     os.makedirs(medians_output_path)
 
+# Load unchanged data files from the cache of parsed files.
+use_cache = False
+cache_path = 'generated_files/cache'
+
 ''' ***********************************************************************************************************
     ******************************************* PROCESSING START **********************************************
     *********************************************************************************************************** '''
 # Read preprocessed nesscan-fixed yearly files into dfs.
+if use_cache:
+    helpers.set_data_cache(DataCache(cache_path))
+
 lighthouse_files = glob.glob(f"{lighthouse_files_path}/*.csv")
 
 yearly_median = {}
 for file in lighthouse_files:
-    df = pd.read_csv(file, parse_dates=[0])
+    df = helpers.read_data_file(file)
 
     # Convert wl col to numpy.
     data = df['wl'].to_numpy()
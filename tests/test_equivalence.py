@@ -0,0 +1,225 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import generate_synthetic_data
+import helpers
+from IncrementalCorrector import IncrementalCorrector
+from MetricsCalculator import MetricsCalculator
+from RunIndex import RunIndex
+from TransformData import TransformData
+
+# Checks that the faster implementations of the temporal correction give the same results as the
+# implementations they replace, on seeded synthetic data.
+
+NAMES = {
+    'primary_data_column_name': 'prim',
+    'reference_data_column_name': 'ref',
+    'datetime_column_name': 'dt'
+}
+
+# Denser gaps, flat lines, spikes and segments than a real year, so short series exercise every case.
+DENSE_PARAMS = {
+    'mean_segment_length': 300,
+    'num_gaps': 800,
+    'max_gap_length': 60,
+    'num_flat_lines': 400,
+    'num_spikes': 600
+}
+
+
+def make_df(seed, size=None, fixed_point=False, **kwargs):
+    # The first size data points of a synthetic year, in the columns of NAMES.
+    rng = np.random.default_rng(seed)
+    reference, primary, labels = generate_synthetic_data.generate_year(2019, rng, **{**DENSE_PARAMS, **kwargs})
+    df = pd.DataFrame({'dt': reference['Date Time'], 'ref': reference['Water Level'], 'prim': primary['wl']})
+    if size is not None:
+        df = df.iloc[:size].reset_index(drop=True)
+    if fixed_point:
+        df['ref'] = helpers.to_fixed_point(df['ref'])
+        df['prim'] = helpers.to_fixed_point(df['prim'])
+    return df
+# End make_df().
+
+
+def correct(df, **kwargs):
+    # Run the temporal correction with the temporal_shift_correction configs in kwargs.
+    transform = TransformData(user_config={'temporal_shift_correction': kwargs})
+    corrected_df = transform.temporal_shift_corrector(df.copy(), **NAMES)
+    return corrected_df, transform
+# End correct().
+
+
+def to_float(series):
+    return series.to_numpy(dtype=float, na_value=np.nan)
+# End to_float().
+
+
+def assert_same_values(actual, expected):
+    np.testing.assert_array_equal(actual, expected)
+# End assert_same_values().
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+@pytest.mark.parametrize('max_temporal_shift, temporal_shifts', [
+    (0, [0, 2]),
+    (1, [0, -1, 1, 3]),
+    (3, [0, -1, -2, -3, 1, 2, 3])
+])
+@pytest.mark.parametrize('number_of_intervals', [3, 10])
+@pytest.mark.parametrize('fixed_point', [False, True])
+def test_vectorized_engine_matches_loop_engine(seed, max_temporal_shift, temporal_shifts, number_of_intervals,
+                                               fixed_point):
+    df = make_df(seed, 2000, fixed_point, temporal_shifts=temporal_shifts)
+    configs = {'number_of_intervals': number_of_intervals, 'max_temporal_shift': max_temporal_shift}
+    loop_df, loop = correct(df, engine='loop', **configs)
+    vectorized_df, vectorized = correct(df, engine='vectorized', **configs)
+
+    assert_same_values(to_float(vectorized_df['prim']), to_float(loop_df['prim']))
+    assert pd.concat(vectorized.get_shifts_summary_df()).to_string() == \
+        pd.concat(loop.get_shifts_summary_df()).to_string()
+    vectorized_table = vectorized.get_time_shift_table()
+    loop_table = loop.get_time_shift_table()
+    assert_same_values(vectorized_table.temporal_shift, loop_table.temporal_shift)
+    assert_same_values(vectorized_table.vertical_offset, loop_table.vertical_offset)
+# End test_vectorized_engine_matches_loop_engine().
+
+
+def check_nan_runs(series, starting_index, offset_criteria, size):
+    # The scan for nan runs that RunIndex replaced, as in TransformData._check_nan_runs.
+    index = starting_index
+    nan_run_found = False
+    valid_value_count = 0
+    while index + offset_criteria < size:
+        if valid_value_count >= offset_criteria:
+            break
+        if pd.isna(series[index]):
+            if not nan_run_found:
+                if series.loc[index:index + offset_criteria].isna().all():
+                    nan_run_found = True
+        elif nan_run_found:
+            break
+        else:
+            valid_value_count += 1
+        index += 1
+    # End while.
+
+    return index, nan_run_found
+# End check_nan_runs().
+
+
+def check_flat_line(series, starting_index, offset_criteria, size):
+    # The scan for flat lines that RunIndex replaced, as in TransformData._check_flat_line.
+    index = starting_index
+    valid_value_count = 0
+    flat_line_found = False
+    while index + 1 < size:
+        current_val = series[index]
+        next_val = series[index + 1]
+        if valid_value_count >= offset_criteria and not flat_line_found:
+            break
+        if pd.isna(current_val):
+            index += 1
+            continue
+        if current_val == next_val:
+            if not flat_line_found:
+                if len(series.loc[index:index + offset_criteria].unique()) == 1:
+                    flat_line_found = True
+        elif flat_line_found:
+            break
+        else:
+            valid_value_count += 1
+        index += 1
+    # End while.
+
+    return index, flat_line_found
+# End check_flat_line().
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_run_index_matches_checks(seed):
+    # RunIndex finds the same nan runs and flat lines as the scans it replaced, at every index.
+    rng = np.random.default_rng(seed)
+    for _ in range(200):
+        size = int(rng.integers(1, 60))
+        offset_criteria = int(rng.integers(0, 8))
+        values = rng.integers(0, 3, size).astype(float)
+        values[rng.random(size) < rng.random()] = np.nan
+        series = pd.Series(values)
+        run_index = RunIndex(values, ~np.isnan(values), offset_criteria)
+        for index in range(size):
+            for expected, actual in [
+                (check_nan_runs(series, index, offset_criteria, size), run_index.find_nan_run(index)),
+                (check_flat_line(series, index, offset_criteria, size), run_index.find_flat_line(index))
+            ]:
+                assert actual[1] == expected[1]
+                if expected[1]:
+                    assert actual[0] == expected[0]
+        # End for.
+    # End for.
+# End test_run_index_matches_checks().
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+@pytest.mark.parametrize('chunk_size', [997, 10000])
+@pytest.mark.parametrize('fixed_point', [False, True])
+def test_chunked_correction_matches_one_pass(seed, chunk_size, fixed_point):
+    # Correcting a series in chunks, each continuing from the carry-over state of the previous chunk and
+    # looking ahead into the next chunk, gives the same results as correcting it at once.
+    df = make_df(seed, fixed_point=fixed_point)
+    whole_df, whole = correct(df, number_of_intervals=10)
+    whole_table = whole.get_time_shift_table()
+
+    carry_over = None
+    corrected = []
+    temporal_shifts = []
+    vertical_offsets = []
+    is_annotated = []
+    for start in range(0, len(df), chunk_size):
+        stop = min(start + chunk_size, len(df))
+        chunk_df = df.iloc[start:stop].reset_index(drop=True)
+        lookahead_df = df.iloc[stop:stop + chunk_size].reset_index(drop=True) if stop < len(df) else None
+        transform = TransformData(user_config={'temporal_shift_correction': {'number_of_intervals': 10}})
+        chunk_corrected_df = transform.temporal_shift_corrector(chunk_df, **NAMES, carry_over=carry_over,
+                                                                lookahead_df=lookahead_df)
+        carry_over = transform.get_carry_over_state()
+        corrected.append(to_float(chunk_corrected_df['prim']))
+        table = transform.get_time_shift_table()
+        temporal_shifts.append(table.temporal_shift)
+        vertical_offsets.append(table.vertical_offset)
+        is_annotated.append(table.is_annotated)
+    # End for.
+
+    # As at the end of any series, the last data point of each chunk is not annotated, so the annotations
+    # are compared where both are annotated.
+    assert_same_values(np.concatenate(corrected), to_float(whole_df['prim']))
+    compared = np.concatenate(is_annotated) & whole_table.is_annotated
+    assert_same_values(np.concatenate(temporal_shifts)[compared], whole_table.temporal_shift[compared])
+    assert_same_values(np.concatenate(vertical_offsets)[compared], whole_table.vertical_offset[compared])
+# End test_chunked_correction_matches_one_pass().
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+@pytest.mark.parametrize('batch_size', [7, 500])
+@pytest.mark.parametrize('gaps_are_interruptions', [False, True])
+def test_incremental_correction_matches_full_rerun(seed, batch_size, gaps_are_interruptions):
+    # Appending the observations in batches gives the same corrected data, temporal shifts summary and runs
+    # as correcting and analyzing all of them at once.
+    config = helpers.load_configs(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                               'config.json'))
+    df = make_df(seed, 4000)
+    corrector = IncrementalCorrector(user_config=config, gaps_are_interruptions=gaps_are_interruptions, **NAMES)
+    for start in range(0, len(df), batch_size):
+        corrector.append(df.iloc[start:start + batch_size])
+
+    transform = TransformData(user_config=config)
+    whole_df = transform.temporal_shift_corrector(df.copy(), **NAMES)
+    whole_runs_df = MetricsCalculator(user_config=config).generate_runs_df(
+        whole_df['prim'], whole_df['ref'], whole_df['dt'], len(whole_df), gaps_are_interruptions=gaps_are_interruptions)
+
+    assert corrector.get_dataframe().equals(whole_df)
+    assert corrector.get_shifts_summary_df().astype(str).equals(transform.get_shifts_summary_df()[0].astype(str))
+    assert corrector.get_runs_df().equals(whole_runs_df)
+# End test_incremental_correction_matches_full_rerun().
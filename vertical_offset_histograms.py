@@ -48,6 +48,8 @@ current_timestamp = datetime.datetime.now().strftime('%H%M%S_%m%d%Y')  # For out
 station_df = pd.DataFrame()
 full_dataset = []
 for file in offsets_files:
+    # The vertical offset tables are reports written by analyze_data.py, not water level data files, so they
+    # are read directly rather than through the data file cache.
     df = pd.read_csv(file, parse_dates=['start date'])
 
     # If years is not empty (if empty, do all years), check if current year is in years, else skip